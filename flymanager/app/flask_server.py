@@ -10,13 +10,12 @@
 
 # external imports
 from datetime import datetime
-from flask import Flask, jsonify, render_template, request, redirect, Response, session, jsonify, send_file, flash, url_for
+from flask import Flask, jsonify, render_template, request, redirect, Response, session, jsonify, send_file, flash, url_for, make_response
 from werkzeug.utils import secure_filename
 import io
 from flask_cors import CORS
 from flask_session import Session
 from flask_socketio import SocketIO, emit
-from fuzzywuzzy import fuzz
 import hashlib
 import os
 import serial
@@ -28,6 +27,22 @@ from flymanager.utils.labels import *
 from flymanager.utils.scanner import *
 from flymanager.utils.utils import *
 from flymanager.utils.converter import *
+from flymanager.utils.indexes import ensure_indexes
+from flymanager.utils.events import get_history
+from flymanager.utils.uids import backfill_uid_registry, get_allocator_stats
+from flymanager.utils.explorer import EXPLORERS, build_query, get_facet_counts, api_projection, stream_ndjson
+from flymanager.utils.search import ensure_search_index
+from flymanager.utils.metadata import get_all_metadata, get_metadata_cache_stats
+from flymanager.utils.users import get_user, get_usernames, verify_password
+from flymanager.utils.activity import get_activity_stats, get_activity_feed, migrate_activity_timestamps
+from flymanager.utils.worklist import get_overdue
+from flymanager.utils.fliplog import DEFAULT_FLIP_INTERVAL, format_timestamp
+from flymanager.utils.connection import LazyDatabase, get_pool_stats
+from flymanager.utils.versions import get_data_version, make_etag
+from flymanager.utils.typeahead import TYPEAHEAD_LIMIT, suggest_genotypes, suggest_uids, resolve_genotypes
+from flymanager.utils.genes import CHROMOSOMES, GENE_COMPLETIONS, complete_genes
+from flymanager.utils.genetics import MAX_PREDICTED_CROSSES, get_genotype_cache_stats, predict_crosses
+from flymanager.utils.planner import PLAN_RESULTS, plan_cross
 
 # setup dotenv
 from dotenv import load_dotenv
@@ -39,9 +54,15 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# setup the mongo db
-client = create_mongo_client()
-db = get_database(client)
+# setup the mongo db (each worker process lazily connects with its own client)
+db = LazyDatabase()
+
+# make sure all the indexes exist, every UniqueID is registered, the search index is built
+# and the legacy string activity timestamps are converted (the activity feed is sorted on native datetimes)
+ensure_indexes(db)
+backfill_uid_registry(db)
+ensure_search_index(db)
+migrate_activity_timestamps(db)
 
 # initialize our Flask application
 app = Flask(__name__, template_folder="../templates", static_folder="../static")
@@ -90,17 +111,18 @@ def login():
     if session.get("username"):
         print(session["username"], "is already logged in")
         return redirect("/home")
-    # get all the users
-    users = list(get_all_users(db=db).keys())
+    # get all the users (cached user directory)
+    users = get_usernames(db)
     # if the request method is POST
     if request.method == "POST":
         # get the username and password
         username = request.form["username"]
         password = request.form["password"]
-        # check if the user exists
-        if username in users:
+        # check if the user exists (single indexed lookup)
+        user_document = get_user(username, db)
+        if user_document:
             # check if the password is correct
-            if get_all_users(db=db)[username] == hashlib.shake_256((username+password).encode()).hexdigest(5):
+            if verify_password(user_document, password):
                 # store the username in the session
                 session["username"] = username
                 return redirect("/home")
@@ -134,7 +156,7 @@ def forgot_password():
     # check if the user is logged in
     if not session.get("name"):
         return redirect("/login")
-    users = list(get_all_users(db=db).keys())
+    users = get_usernames(db)
     if request.method == "POST":
         # get the username, master password and new password
         username = request.form["username"]
@@ -160,6 +182,19 @@ def logout():
 
 ### END AUTHENTICATION ROUTES ###
 
+# define a route for the server metrics
+@app.route('/metrics')
+def metrics():
+    if not session.get("username"):
+        return redirect("/login")
+    return jsonify({
+        'uid_allocator': get_allocator_stats(),
+        'metadata_cache': get_metadata_cache_stats(),
+        'activity_writer': get_activity_stats(),
+        'mongo_pool': get_pool_stats(),
+        'genotype_cache': get_genotype_cache_stats()
+    })
+
 ### USER ROUTES ###
 
 # define a route for the home page
@@ -170,14 +205,34 @@ def home():
         return redirect("/login")
     # get the user's activity
     username = session.get("username")
-    activities = get_user_activities(username, db)
     # keep last 5 activities
-    activities = activities[-5:][::-1]
+    activities = get_user_activities(username, db, limit=5)
     return render_template("home.html", username=username, activities=activities)
 
+# define a route for the full activity history
+@app.route('/activity')
+def activity():
+    # check if the user is logged in
+    if not session.get("username"):
+        return redirect("/login")
+    username = session.get("username")
+    after = request.args.get('after')
+    activities, next_cursor = get_activity_feed(username, db, after=after)
+    return render_template("activity.html", username=username, activities=activities,
+                           next_cursor=next_cursor, paginated=bool(after), base_url=url_for('activity'))
+
 
 ### STOCK MANAGEMENT ROUTES ###
 
+def with_etag(response, etag):
+    # browsers must revalidate the page, which is answered with a 304 while the data version is unchanged
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def not_modified(etag):
+    return with_etag(make_response('', 304), etag)
+
 
 # define a route for the stock explorer page
 @app.route('/stock_explorer', methods=['GET', 'POST'])
@@ -187,96 +242,33 @@ def stock():
         return redirect("/login")
     
     username = session.get("username")
-    stocks = get_user_stocks(username, db)
 
-    # sort by TrayID and TrayPosition
-    stocks = sorted(stocks, key=lambda x: (x['TrayID'], int(x['TrayPosition'])))
+    if request.method == 'POST':
+        if 'clear_filters' in request.form:
+            session.pop('stock_filter_state', None)
+            return redirect('/stock_explorer')
 
-    print('Number of stocks:', len(stocks))
-    print('First stock:', stocks[0])
+        # Store filter state in session (the filters are applied by the GET)
+        filter_state = {field: request.form.get(field, '') for field in EXPLORERS['stocks']['filters']}
+        filter_state['searchQuery'] = request.form.get('searchQuery', '')
+        session['stock_filter_state'] = filter_state
+        return redirect('/stock_explorer')
 
-    # Extract unique values for filtering
-    unique_values = {
-        'Type': sorted(set(str(stock['Type']) for stock in stocks)),
-        'TrayID': sorted(set(str(stock['TrayID']) for stock in stocks)),
-        'Status': sorted(set(str(stock['Status']) for stock in stocks)),
-        'FoodType': sorted(set(str(stock['FoodType']) for stock in stocks)),
-        'Provenance': sorted(set(str(stock['Provenance']).split('/')[0] for stock in stocks))
-    }
+    # Answer conditional GETs without rendering the page if the user's data has not changed
+    filter_state = session.get('stock_filter_state', {})
+    version = get_data_version(username, db)
+    etag = make_etag(username, 'stocks', version, filter_state)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
 
-    if request.method == 'GET':
-        # Check if there are filters stored in session
-        filter_state = session.get('filter_state', {})
-        return render_template("stock_explorer.html", username=username, stocks=stocks, unique_values=unique_values, filter_state=filter_state)
-    elif request.method == 'POST':
-        if 'clear_filters' in request.form:
-            session.pop('filter_state', None)
-            return redirect('/stock_explorer')
+    # Get the values (with counts) for the filter dropdowns (the stocks themselves are streamed from /api/stocks)
+    unique_values = get_facet_counts(username, 'stocks', db, version)
 
-        # Get filter values from request
-        filter_type = str(request.form.get('filterType'))
-        filter_tray_id = str(request.form.get('filterTrayID'))
-        filter_status = str(request.form.get('filterStatus'))
-        filter_food_type = str(request.form.get('filterFoodType'))
-        filter_provenance = str(request.form.get('filterProvenance'))
-        search_query = request.form.get('searchQuery')
-
-        # Store filter state in session
-        filter_state = {
-            'filterType': filter_type,
-            'filterTrayID': filter_tray_id,
-            'filterStatus': filter_status,
-            'filterFoodType': filter_food_type,
-            'filterProvenance': filter_provenance,
-            'searchQuery': search_query
-        }
-        session['filter_state'] = filter_state
-
-        # Apply filters
-        filtered_stocks = stocks
-        if filter_type:
-            filtered_stocks = [stock for stock in filtered_stocks if str(stock['Type']) == filter_type]
-        if filter_tray_id:
-            filtered_stocks = [stock for stock in filtered_stocks if str(stock['TrayID']) == filter_tray_id]
-        if filter_status:
-            filtered_stocks = [stock for stock in filtered_stocks if str(stock['Status']) == filter_status]
-        if filter_food_type:
-            filtered_stocks = [stock for stock in filtered_stocks if str(stock['FoodType']) == filter_food_type]
-        if filter_provenance:
-            filtered_stocks = [stock for stock in filtered_stocks if str(stock['Provenance']).split('/')[0] == filter_provenance]
-
-        # Apply search
-        if search_query:
-            def match(stock):
-                search_fields = [
-                    stock['SourceID'],
-                    stock['Genotype'],
-                    stock['Name'],
-                    stock['AltReference'],
-                    stock['SeriesID'],
-                    stock['TrayID'],
-                    stock['TrayPosition'],
-                    stock['Comments']
-                ]
-                # combine all fields into a single string
-                search_string = ' '.join(str(field) for field in search_fields)
-                # find if the search query is a substring of the search string
-                return fuzz.partial_ratio(search_string.lower(), search_query.lower()) > 80
-            
-            filtered_stocks = [stock for stock in filtered_stocks if match(stock)]
-
-        # Recalculate unique values
-        unique_values = {
-            'Type': sorted(set(str(stock['Type']) for stock in filtered_stocks)),
-            'TrayID': sorted(set(str(stock['TrayID']) for stock in filtered_stocks)),
-            'Status': sorted(set(str(stock['Status']) for stock in filtered_stocks)),
-            'FoodType': sorted(set(str(stock['FoodType']) for stock in filtered_stocks)),
-            'Provenance': sorted(set(str(stock['Provenance']).split('/')[0] for stock in filtered_stocks))
-        }
+    response = make_response(render_template("stock_explorer.html", username=username, unique_values=unique_values,
+                                             filter_state=filter_state))
+    return with_etag(response, etag)
 
-        return render_template("stock_explorer.html", username=username, stocks=filtered_stocks, unique_values=unique_values, filter_state=filter_state)
 
-    
 # define a route for the add stock page
 @app.route('/add_stock', methods=['GET', 'POST'])
 def add_stock():
@@ -285,14 +277,11 @@ def add_stock():
     
     username = session.get("username")
     
-    # get metadata lists
-    types = get_metadata('types', db)
-    food_types = get_metadata('food_types', db)
-    provenances = get_metadata('provenances', db)
-    genesX = get_metadata('genesX', db)
-    genes2 = get_metadata('genes2nd', db)
-    genes3 = get_metadata('genes3rd', db)
-    genes4 = get_metadata('genes4th', db)
+    # get metadata lists (all loaded at once from the metadata cache, the genes are autocompleted by /api/genes)
+    metadata = get_all_metadata(db)
+    types = metadata['types']
+    food_types = metadata['food_types']
+    provenances = metadata['provenances']
 
 
     if request.method == 'POST':
@@ -324,13 +313,55 @@ def add_stock():
         else:
             # Handle error (e.g., QC failure)
             return render_template('add_stock.html', error=uid_or_message, username=username, 
-                                   types=types, food_types=food_types, provenances=provenances, 
-                                   genesX=genesX, genes2=genes2, genes3=genes3, 
-                                   genes4=genes4)
+                                   types=types, food_types=food_types, provenances=provenances)
 
     return render_template('add_stock.html', username=username, types=types, food_types=food_types, 
-                           provenances=provenances, genesX=genesX, genes2=genes2, 
-                           genes3=genes3, genes4=genes4)
+                           provenances=provenances)
+
+
+# define a route autocompleting the genes of a chromosome (X, 2, 3 or 4)
+@app.route('/api/genes/<chromosome>', methods=['GET'])
+def genes(chromosome):
+    if not session.get("username"):
+        return redirect("/login")
+    if chromosome not in CHROMOSOMES:
+        return jsonify({'message': 'Invalid chromosome'}), 404
+    try:
+        k = max(1, min(int(request.args.get('k', GENE_COMPLETIONS)), 100))
+    except ValueError:
+        return jsonify({'message': 'Invalid k'}), 400
+    return jsonify({'genes': complete_genes(chromosome, request.args.get('prefix', ''), db, k)})
+
+
+# define a route for registering many stocks at once
+@app.route('/add_stocks_bulk', methods=['GET', 'POST'])
+def add_stocks_bulk_page():
+    if not session.get("username"):
+        return redirect("/login")
+    
+    username = session.get("username")
+
+    if request.method == 'POST':
+        # the stocks come either as an uploaded table or as pasted tab-separated text
+        file = request.files.get('file')
+        pasted = request.form.get('pasted', '').strip()
+        try:
+            if file and file.filename:
+                rows = table_to_records(file, file.filename)
+            elif pasted:
+                rows = table_to_records(io.StringIO(pasted), 'pasted.tsv')
+            else:
+                return render_template('add_stocks_bulk.html', username=username, error="No stocks provided")
+        except Exception as e:
+            return render_template('add_stocks_bulk.html', username=username, error=f"Could not read the table: {e}")
+
+        # Add the stocks and report the outcome of each row
+        report = add_stocks_bulk(username, rows, db)
+        added = sum(row['success'] for row in report)
+        write_activity(username, 'Added {} stocks in bulk'.format(added), db)
+        return render_template('add_stocks_bulk.html', username=username, report=report, rows=rows, added=added)
+
+    return render_template('add_stocks_bulk.html', username=username)
 
 
 # define a route for the generate labels page
@@ -380,7 +411,8 @@ def view_stock(unique_id):
     # get user name
     username = session.get("username")
     stock = get_stock(username, unique_id, db)
-    return render_template('view_stock.html', username=username, stock=stock)
+    history = get_history(unique_id, db) if stock else []
+    return render_template('view_stock.html', username=username, stock=stock, history=history)
 
 
 ### CROSS MANAGEMENT ROUTES ###
@@ -393,92 +425,33 @@ def cross():
         return redirect("/login")
     
     username = session.get("username")
-    crosses = get_user_crosses(username, db)
-
-    print('Number of crosses:', len(crosses))
 
-    # nested sort by TrayID and TrayPosition
-    crosses = sorted(crosses, key=lambda x: (str(x['TrayID']), int(x['TrayPosition'])))
-
-    # Extract unique values for filtering
-    unique_values = {
-        'MaleGenotype': sorted(set(str(cross['MaleGenotype']) for cross in crosses)),
-        'FemaleGenotype': sorted(set(str(cross['FemaleGenotype']) for cross in crosses)),
-        'TrayID': sorted(set(str(cross['TrayID']) for cross in crosses)),
-        'Status': sorted(set(str(cross['Status']) for cross in crosses)),
-        'FoodType': sorted(set(str(cross['FoodType']) for cross in crosses)),
-    }
-
-    if request.method == 'GET':
-        # Check if there are filters stored in session
-        filter_state = session.get('filter_state', {})
-        return render_template("cross_explorer.html", username=username, crosses=crosses, unique_values=unique_values, filter_state=filter_state)
-    elif request.method == 'POST':
+    if request.method == 'POST':
         if 'clear_filters' in request.form:
-            session.pop('filter_state', None)
+            session.pop('cross_filter_state', None)
             return redirect('/cross_explorer')
 
-        # Get filter values from request
-        filter_MaleGenotype = str(request.form.get('filterMaleGenotype'))
-        filter_FemaleGenotype = str(request.form.get('filterFemaleGenotype'))
-        filter_tray_id = str(request.form.get('filterTrayID'))
-        filter_status = str(request.form.get('filterStatus'))
-        filter_food_type = str(request.form.get('filterFoodType'))
-        search_query = request.form.get('searchQuery')
-
-        # Store filter state in session
-        filter_state = {
-            'filterMaleGenotype': filter_MaleGenotype,
-            'filterFemaleGenotype': filter_FemaleGenotype,
-            'filterTrayID': filter_tray_id,
-            'filterStatus': filter_status,
-            'filterFoodType': filter_food_type,
-            'searchQuery': search_query
-        }
-        session['filter_state'] = filter_state
-
-        # Apply filters
-        filtered_crosses = crosses
-        if filter_MaleGenotype:
-            filtered_crosses = [cross for cross in filtered_crosses if str(cross['MaleGenotype']) == filter_MaleGenotype]
-        if filter_FemaleGenotype:
-            filtered_crosses = [cross for cross in filtered_crosses if str(cross['FemaleGenotype']) == filter_FemaleGenotype]
-        if filter_tray_id:
-            filtered_crosses = [cross for cross in filtered_crosses if str(cross['TrayID']) == filter_tray_id]
-        if filter_status:
-            filtered_crosses = [cross for cross in filtered_crosses if str(cross['Status']) == filter_status]
-        if filter_food_type:
-            filtered_crosses = [cross for cross in filtered_crosses if str(cross['FoodType']) == filter_food_type]
-        
-        # Apply search
-        if search_query:
-            def match(cross):
-                search_fields = [
-                    cross['Name'],
-                    cross['MaleGenotype'],
-                    cross['FemaleGenotype'],
-                    cross['TrayID'],
-                    cross['TrayPosition'],
-                    cross['Comments']
-                ]
-                # combine all fields into a single string
-                search_string = ' '.join(str(field) for field in search_fields)
-                # find if the search query is a substring of the search string
-                return fuzz.partial_ratio(search_string, search_query) > 80
-            
-            filtered_crosses = [cross for cross in filtered_crosses if match(stock)]
-
-        # Recalculate unique values
-        unique_values = {
-            'MaleGenotype': sorted(set(str(cross['MaleGenotype']) for cross in filtered_crosses)),
-            'FemaleGenotype': sorted(set(str(cross['FemaleGenotype']) for cross in filtered_crosses)),
-            'TrayID': sorted(set(str(cross['TrayID']) for cross in filtered_crosses)),
-            'Status': sorted(set(str(cross['Status']) for cross in filtered_crosses)),
-            'FoodType': sorted(set(str(cross['FoodType']) for cross in filtered_crosses))
-        }
-
-        return render_template("cross_explorer.html", username=username, crosses=filtered_crosses, unique_values=unique_values, filter_state=filter_state)
+        # Store filter state in session (the filters are applied by the GET)
+        filter_state = {field: request.form.get(field, '') for field in EXPLORERS['crosses']['filters']}
+        filter_state['searchQuery'] = request.form.get('searchQuery', '')
+        session['cross_filter_state'] = filter_state
+        return redirect('/cross_explorer')
+
+    # Answer conditional GETs without rendering the page if the user's data has not changed
+    filter_state = session.get('cross_filter_state', {})
+    version = get_data_version(username, db)
+    etag = make_etag(username, 'crosses', version, filter_state)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+
+    # Get the values (with counts) for the filter dropdowns (the crosses themselves are streamed from /api/crosses)
+    unique_values = get_facet_counts(username, 'crosses', db, version)
+
+    response = make_response(render_template("cross_explorer.html", username=username, unique_values=unique_values,
+                                             filter_state=filter_state))
+    return with_etag(response, etag)
     
+
 # define a route for the add cross page
 @app.route('/add_cross', methods=['GET', 'POST'])
 def add_cross():
@@ -488,9 +461,8 @@ def add_cross():
     username = session.get("username")
     ports = get_available_ports()
 
-    # get metadata lists
+    # get metadata lists (the genotypes and UniqueIDs are suggested by the typeahead endpoints)
     food_types = get_metadata('food_types', db)
-    genotypes = get_all_genotypes(username, db)
 
     if request.method == 'POST':
         # Collect form data
@@ -518,35 +490,120 @@ def add_cross():
         else:
             # Handle error (e.g., QC failure)
             return render_template('add_cross.html', error=uid_or_message, username=username,
-                                   food_types=food_types, genotypes=genotypes, ports=ports)
+                                   food_types=food_types, ports=ports)
 
     return render_template('add_cross.html', username=username,
-                           food_types=food_types, genotypes=genotypes, ports=ports)
+                           food_types=food_types, ports=ports)
+
+def typeahead_limit():
+    # number of suggestions requested by the typeahead (capped to TYPEAHEAD_LIMIT)
+    try:
+        return max(1, min(int(request.args.get('limit', TYPEAHEAD_LIMIT)), TYPEAHEAD_LIMIT))
+    except ValueError:
+        return TYPEAHEAD_LIMIT
 
-# Route to fetch genotype based on Unique ID
-@app.route('/get_genotype/<unique_id>')
-def get_genotype(unique_id):
+# Route to suggest the user's genotypes starting with a prefix
+@app.route('/api/typeahead/genotypes', methods=['GET'])
+def typeahead_genotypes():
+    if not session.get("username"):
+        return redirect("/login")
     username = session.get("username")
-    stock = db['stocks'].find_one({"UniqueID": unique_id, "User": username})
-    if stock:
-        return jsonify({'genotype': stock['Genotype']})
-    else:
-        return jsonify({'genotype': ''}), 404
-    
-from urllib.parse import unquote
+    genotypes = suggest_genotypes(username, request.args.get('prefix', ''), db, limit=typeahead_limit())
+    return jsonify({'genotypes': genotypes})
 
-@app.route('/get_uids/<genotype>', methods=['GET'])
-def get_uids(genotype):
-    # Debugging information
-    print(f"Received genotype: {genotype}")
-    
-    decoded_genotype = unquote(unquote(genotype))
-    print(f"Decoded genotype: {decoded_genotype}")
-    
-    uids = db['stocks'].find({"Genotype": decoded_genotype}, {"UniqueID": 1})
-    uid_list = [doc['UniqueID'] for doc in uids]
-    
-    return jsonify({'uids': uid_list})
+# Route to suggest the user's stocks with a UniqueID starting with a prefix (optionally of a single genotype),
+# paged by UniqueID: "next" is the "after" of the next page (null on the last page)
+@app.route('/api/typeahead/uids', methods=['GET'])
+def typeahead_uids():
+    if not session.get("username"):
+        return redirect("/login")
+    username = session.get("username")
+    limit = typeahead_limit()
+    # one extra stock tells if there is a next page
+    stocks = suggest_uids(username, request.args.get('prefix', ''), db, genotype=request.args.get('genotype'),
+                          limit=limit + 1, after=request.args.get('after'))
+    next_uid = stocks[limit - 1]['UniqueID'] if len(stocks) > limit else None
+    return jsonify({'stocks': stocks[:limit], 'next': next_uid})
+
+# Route to resolve many UniqueIDs to their genotypes in one request
+@app.route('/api/resolve_uids', methods=['POST'])
+def resolve_uids():
+    if not session.get("username"):
+        return redirect("/login")
+    username = session.get("username")
+    uids = (request.json or {}).get('uids', [])
+    if not isinstance(uids, list):
+        return jsonify({'message': 'uids must be a list'}), 400
+    return jsonify({'genotypes': resolve_genotypes(username, [str(uid) for uid in uids], db)})
+
+
+# Route to predict the offspring classes of crosses, given by their parent genotypes or by the UniqueIDs of
+# recorded crosses, e.g. {"crosses": [{"female": "...", "male": "..."}, {"UniqueID": "..."}], "lethal": ["CyO"]}
+@app.route('/api/predict_crosses', methods=['POST'])
+def api_predict_crosses():
+    if not session.get("username"):
+        return redirect("/login")
+    username = session.get("username")
+    body = request.json or {}
+    crosses = body.get('crosses', [])
+    lethal = body.get('lethal', [])
+    if not isinstance(crosses, list) or not all(isinstance(cross, dict) for cross in crosses):
+        return jsonify({'message': 'crosses must be a list of objects'}), 400
+    if len(crosses) > MAX_PREDICTED_CROSSES:
+        return jsonify({'message': f'At most {MAX_PREDICTED_CROSSES} crosses can be predicted at once'}), 400
+    if not isinstance(lethal, list):
+        return jsonify({'message': 'lethal must be a list'}), 400
+    # the genotypes must be strings (the distinct crosses are predicted once, keyed by their genotypes)
+    if any(not isinstance(cross.get(parent), (str, type(None))) for cross in crosses for parent in ('female', 'male')):
+        return jsonify({'message': 'female and male must be genotype strings'}), 400
+    if not all(isinstance(allele, str) for allele in lethal):
+        return jsonify({'message': 'lethal must be a list of alleles'}), 400
+
+    # read the parents of the recorded crosses in a single query
+    uids = [str(cross['UniqueID']) for cross in crosses if cross.get('UniqueID')]
+    recorded = {}
+    if uids:
+        cursor = db['crosses'].find({'User': username, 'UniqueID': {'$in': uids}},
+                                    {'_id': 0, 'UniqueID': 1, 'MaleGenotype': 1, 'FemaleGenotype': 1})
+        recorded = {cross['UniqueID']: cross for cross in cursor}
+
+    pairs = []
+    for cross in crosses:
+        if cross.get('UniqueID'):
+            parents = recorded.get(str(cross['UniqueID']), {})
+            pairs.append((parents.get('FemaleGenotype'), parents.get('MaleGenotype')))
+        else:
+            pairs.append((cross.get('female'), cross.get('male')))
+
+    results = predict_crosses(pairs, lethal=lethal)
+    for cross, result in zip(crosses, results):
+        if cross.get('UniqueID'):
+            result['UniqueID'] = cross['UniqueID']
+            if str(cross['UniqueID']) not in recorded:
+                result.pop('Offspring', None)
+                result['Error'] = 'Cross not found'
+    return jsonify({'results': results})
+
+
+# Route to plan the crosses (parent pairs and two-generation schemes) producing a target genotype from the user's
+# stocks, e.g. /api/plan_cross?genotype=w; Gal4/CyO; UAS-GFP/TM3; +&sex=female&admin_include=1
+@app.route('/api/plan_cross', methods=['GET'])
+def api_plan_cross():
+    if not session.get("username"):
+        return redirect("/login")
+    username = session.get("username")
+    try:
+        k = max(1, min(int(request.args.get('k', PLAN_RESULTS)), 100))
+        generations = int(request.args.get('generations', 2))
+    except ValueError:
+        return jsonify({'message': 'Invalid k or generations'}), 400
+    admin_include = request.args.get('admin_include', '').lower() in ('1', 'true', 'yes')
+    try:
+        plan = plan_cross(username, request.args.get('genotype', ''), db, sex=request.args.get('sex') or None,
+                          admin_include=admin_include, k=k, generations=generations)
+    except ValueError as e:
+        return jsonify({'message': f'Invalid target: {e}'}), 400
+    return jsonify(plan)
 
 
 ### FLY FLIPPING ROUTES ###
@@ -564,6 +621,23 @@ def flip():
 # Dictionary to store active threads
 active_threads = {}
 
+def scanned_stock_details(stock):
+    # the stock fields shown by the fly flipper
+    return {
+        'uniqueID': stock['UniqueID'],
+        'seriesID': stock['SeriesID'],
+        'replicateID': stock['ReplicateID'],
+        'trayID': stock['TrayID'],
+        'trayPosition': stock['TrayPosition'],
+        'foodType': stock['FoodType'],
+        'provenance': stock['Provenance'],
+        'name': stock['Name'],
+        'altReference': stock['AltReference'],
+        'genotype': stock['Genotype'],
+        'status': stock['Status'],
+        'lastFlipDate': format_timestamp(stock['LastFlipDate'])
+    }
+
 def scan_qr_code(port_index, ports, username, thread_id, baudrate=9600, size=11):
     # Start listening for QR code scan
     port_device = ports[port_index].device
@@ -600,23 +674,10 @@ def scan_qr_code(port_index, ports, username, thread_id, baudrate=9600, size=11)
         uid = qr_code.strip()
 
         # Check if the UID exists in the stocks
-        stocks = get_user_stocks(username, db)
-        matching_stock = next((stock for stock in stocks if stock['UniqueID'] == uid), None)
+        matching_stock = get_stock(username, uid, db)
 
         if matching_stock:
-            socketio.emit('qr_scanned', {
-                'uniqueID': uid,
-                'seriesID': matching_stock['SeriesID'],
-                'replicateID': matching_stock['ReplicateID'],
-                'trayID': matching_stock['TrayID'],
-                'trayPosition': matching_stock['TrayPosition'],
-                'foodType': matching_stock['FoodType'],
-                'provenance': matching_stock['Provenance'],
-                'name': matching_stock['Name'],
-                'altReference': matching_stock['AltReference'],
-                'genotype': matching_stock['Genotype'],
-                'status': matching_stock['Status']
-            })
+            socketio.emit('qr_scanned', scanned_stock_details(matching_stock))
         else:
             socketio.emit('qr_not_recognized')
 
@@ -666,9 +727,72 @@ def handle_flip_stock():
     uid = data.get('uniqueID')
     
     print('Flipping stock:', uid)
-    flip_stock(username, uid, db, flip_time, new_status=status, added_comment=comment)
+    stock = flip_stock(username, uid, db, flip_time, new_status=status, added_comment=comment)
+    if stock is None:
+        return jsonify({'message': 'Stock not found'}), 404
     
-    return jsonify({'message': 'Stock flipped successfully!'})
+    # return the flipped stock so that the flipper does not need to read it again
+    return jsonify({'message': 'Stock flipped successfully!', 'stock': scanned_stock_details(stock)})
+
+# define a route streaming the stocks or crosses as NDJSON (one document per line, then {"_next": cursor}),
+# optionally filtered by an allele query (alleleQuery, see flymanager.utils.alleles)
+@app.route('/api/<kind>', methods=['GET'])
+def api_documents(kind):
+    if not session.get("username"):
+        return redirect("/login")
+    username = session.get("username")
+
+    if kind not in ('stocks', 'crosses'):
+        return jsonify({'message': 'Invalid kind'}), 404
+    try:
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+    except ValueError:
+        return jsonify({'message': 'Invalid limit'}), 400
+    if limit is not None and limit < 1:
+        return jsonify({'message': 'Invalid limit'}), 400
+
+    # the filters use the explorer form field names (e.g. ?filterStatus=Healthy&searchQuery=...)
+    filter_state = {field: request.args.get(field, '') for field in EXPLORERS[kind]['filters']}
+    filter_state['searchQuery'] = request.args.get('searchQuery', '')
+    filter_state['alleleQuery'] = request.args.get('alleleQuery', '')
+    fields = [field for field in request.args.get('fields', '').split(',') if field]
+    after = request.args.get('after')
+
+    # reject an invalid allele query before streaming
+    # (e.g. ?alleleQuery={"and": [{"allele": "UAS-GFP", "chromosome": "3"}, {"allele": "w", "chromosome": "X"}]})
+    try:
+        build_query(username, kind, filter_state)
+    except ValueError as e:
+        return jsonify({'message': f'Invalid allele query: {e}'}), 400
+
+    # answer conditional GETs without reading the documents if the user's data has not changed
+    etag = make_etag(username, kind, get_data_version(username, db), filter_state, fields, after, limit)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+
+    lines = stream_ndjson(username, kind, db, filter_state, after=after, limit=limit,
+                          projection=api_projection(kind, fields))
+    return with_etag(Response(lines, mimetype='application/x-ndjson'), etag)
+
+# define a route for the overdue flips worklist (for the whole collection or a single tray)
+@app.route('/api/overdue', methods=['GET'])
+def overdue():
+    if not session.get("username"):
+        return redirect("/login")
+    username = session.get("username")
+
+    collection_name = request.args.get('kind', 'stocks')
+    if collection_name not in ('stocks', 'crosses'):
+        return jsonify({'message': 'Invalid kind'}), 400
+    try:
+        days = float(request.args.get('days', DEFAULT_FLIP_INTERVAL))
+    except ValueError:
+        return jsonify({'message': 'Invalid number of days'}), 400
+
+    worklist = get_overdue(username, db, collection_name, days=days, tray_id=request.args.get('tray'))
+    for document in worklist:
+        document['LastFlipDate'] = format_timestamp(document['LastFlipDate'])
+    return jsonify({'days': days, 'count': len(worklist), 'overdue': worklist})
 
 @app.route('/download_data', methods=['GET'])
 def download_data():
@@ -727,12 +851,14 @@ def upload_data():
                 file.save(file_path)
                 
                 # Process the Excel file and update MongoDB
-                xls_to_mongo(file_path, db)
+                genotype_errors = xls_to_mongo(file_path, db)
                 
                 # Remove the file after processing
                 os.remove(file_path)
                 
                 flash('Data successfully uploaded and updated.')
+                if genotype_errors:
+                    flash(f'{len(genotype_errors)} genotypes failed the QC and were imported unchanged.')
                 return redirect("/home")
             except Exception as e:
                 print(f"Error processing Excel file: {e}")
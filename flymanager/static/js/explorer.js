@@ -0,0 +1,407 @@
+// Virtualized explorer shared by the stock and cross explorers:
+// the documents are streamed once from /api/<kind> (NDJSON), the filters and the selection are kept in a client-side
+// index and only the rows of cards inside the viewport are rendered.
+
+const ROW_HEIGHT = 200; // height of a row of collapsed cards, including the gap (matches the explorer css)
+const ROW_GAP = 15; // gap between the rows of cards (matches the explorer css)
+const OVERSCAN = 3; // number of rows rendered above and below the viewport
+
+let cart = JSON.parse(localStorage.getItem('cart')) || [];
+
+function saveCart() {
+    localStorage.setItem('cart', JSON.stringify(cart));
+}
+
+function updateCart() {
+    let cartItems = document.getElementById('cartItems');
+    cartItems.innerHTML = '';
+    if (cart.length === 0) {
+        cartItems.innerHTML = '<p>Your cart is empty.</p>';
+    } else {
+        cart.forEach(function(item, index) {
+            cartItems.innerHTML += `<div class="cart-item">
+                <span>${escapeHtml(item.identifier)} - ${escapeHtml(item.name)}</span>
+                <input type="number" class="form-control quantity-input" value="${item.quantity}" min="1" style="width: 60px; display: inline-block; margin: 0 10px;" onchange="updateQuantity(${index}, this.value)">
+                <button class="btn btn-danger btn-sm" onclick="removeFromCart(${index})">Remove</button>
+            </div>`;
+        });
+    }
+    saveCart();
+}
+
+function updateQuantity(index, quantity) {
+    cart[index].quantity = quantity;
+    saveCart();
+}
+
+function removeFromCart(index) {
+    cart.splice(index, 1);
+    updateCart();
+}
+
+function emptyCart() {
+    cart = [];
+    updateCart();
+}
+
+function escapeHtml(value) {
+    if (value === undefined || value === null) {
+        return '';
+    }
+    return String(value).replace(/[&<>"']/g, function(character) {
+        return {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[character];
+    });
+}
+
+// value of a document for a filter field (provenances are filtered on the source, the part before the first '/')
+function facetValue(document, field) {
+    let value = document[field] === undefined || document[field] === null ? '' : String(document[field]);
+    return field === 'Provenance' ? value.split('/')[0] : value;
+}
+
+// options:
+//   kind: "stocks" or "crosses" (the API endpoint)
+//   itemClass: css class of the cards
+//   filters: {form field: document field} of the filter dropdowns
+//   renderBadges(document): html of the badges
+//   renderSummary(document), renderDetails(document): html of the card body and of its details
+//   cartLabel(document): {identifier, name} shown in the cart
+//   viewUrl: page of a single document (followed by its UniqueID)
+function createExplorer(options) {
+    const container = document.getElementById('explorerContainer');
+    const spacer = document.getElementById('explorerSpacer');
+    const grid = document.getElementById('explorerGrid');
+    const count = document.getElementById('explorerCount');
+    const form = document.getElementById('filterForm');
+
+    let documents = []; // all the documents, in tray order
+    let positions = new Map(); // UniqueID -> position in documents
+    let postings = {}; // filter field -> value -> set of positions
+    let visible = []; // positions of the documents matching the filters (in display order)
+    let selected = new Set(); // selected UniqueIDs
+    let expanded = new Set(); // UniqueIDs of the cards showing their details
+    let heights = new Map(); // UniqueID -> measured height of an expanded card
+    let searchRanking = null; // ranked UniqueIDs of the search query (null without a search)
+    let loaded = false;
+    let renderPending = false;
+
+    Object.values(options.filters).forEach(function(field) {
+        postings[field] = new Map();
+    });
+
+    function addDocument(doc) {
+        let position = documents.length;
+        documents.push(doc);
+        positions.set(doc.UniqueID, position);
+        Object.values(options.filters).forEach(function(field) {
+            let value = facetValue(doc, field);
+            if (!postings[field].has(value)) {
+                postings[field].set(value, new Set());
+            }
+            postings[field].get(value).add(position);
+        });
+    }
+
+    function filterValues() {
+        let values = {};
+        Object.entries(options.filters).forEach(function([formField, field]) {
+            let input = form.elements[formField];
+            if (input && input.value) {
+                values[field] = input.value;
+            }
+        });
+        return values;
+    }
+
+    // intersect the posting sets of the selected filter values (smallest first)
+    function applyFilters() {
+        let sets = Object.entries(filterValues()).map(function([field, value]) {
+            return postings[field].get(value) || new Set();
+        });
+        sets.sort((a, b) => a.size - b.size);
+        let matches = function(position) {
+            return sets.every(set => set.has(position));
+        };
+
+        if (searchRanking !== null) {
+            visible = searchRanking.map(uid => positions.get(uid)).filter(position => position !== undefined && matches(position));
+        } else if (sets.length > 0) {
+            visible = Array.from(sets[0]).filter(matches).sort((a, b) => a - b);
+        } else {
+            visible = documents.map((doc, position) => position);
+        }
+        scheduleRender();
+    }
+
+    function columns() {
+        return getComputedStyle(grid).gridTemplateColumns.split(' ').length || 1;
+    }
+
+    function scheduleRender() {
+        if (!renderPending) {
+            renderPending = true;
+            requestAnimationFrame(render);
+        }
+    }
+
+    function renderCard(doc) {
+        let uid = doc.UniqueID;
+        let isSelected = selected.has(uid);
+        let isExpanded = expanded.has(uid);
+        return `<div class="${options.itemClass}${isSelected ? ' selected' : ''}${isExpanded ? ' expanded' : ''}" data-status="${escapeHtml(doc.Status)}" data-uid="${escapeHtml(uid)}">
+            <div style="display: flex; justify-content: space-between; align-items: center;">
+                <div class="checkbox-and-badges">
+                    <input type="checkbox" class="select-box"${isSelected ? ' checked' : ''}>
+                    <div class="badges">
+                        ${options.renderBadges(doc)}
+                    </div>
+                </div>
+                <div style="display: flex; align-items: center;">
+                    <button class="btn btn-link btn-sm expand-btn">
+                        <i class="fas ${isExpanded ? 'fa-chevron-up' : 'fa-chevron-down'}"></i>
+                    </button>
+                    <button class="btn btn-link btn-sm view-details-btn">
+                        <i class="fas fa-external-link-alt"></i>
+                    </button>
+                </div>
+            </div>
+            <div style="flex-grow: 1; padding-top: 10px;">
+                ${isExpanded ? options.renderDetails(doc) : options.renderSummary(doc)}
+            </div>
+        </div>`;
+    }
+
+    // extra height of the rows holding expanded cards, as sorted [row, extra pixels] (the other rows are ROW_HEIGHT high)
+    function rowExtras(perRow) {
+        let extras = new Map();
+        expanded.forEach(function(uid) {
+            let index = visible.indexOf(positions.get(uid));
+            if (index < 0 || !heights.has(uid)) {
+                return;
+            }
+            let row = Math.floor(index / perRow);
+            let extra = Math.max(0, heights.get(uid) + ROW_GAP - ROW_HEIGHT);
+            extras.set(row, Math.max(extras.get(row) || 0, extra));
+        });
+        return Array.from(extras).sort((a, b) => a[0] - b[0]);
+    }
+
+    function rowTop(row, extras) {
+        return row * ROW_HEIGHT + extras.filter(([r]) => r < row).reduce((total, [, extra]) => total + extra, 0);
+    }
+
+    function rowAt(y, extras) {
+        let offset = 0;
+        for (let [row, extra] of extras) {
+            let top = row * ROW_HEIGHT + offset;
+            if (y < top) {
+                break;
+            }
+            if (y < top + ROW_HEIGHT + extra) {
+                return row;
+            }
+            offset += extra;
+        }
+        return Math.floor((y - offset) / ROW_HEIGHT);
+    }
+
+    // render the rows of cards inside the viewport (plus a few rows of overscan)
+    function render() {
+        renderPending = false;
+        let perRow = columns();
+        let rows = Math.ceil(visible.length / perRow);
+        let extras = rowExtras(perRow);
+        spacer.style.height = rowTop(rows, extras) + 'px';
+
+        let firstRow = Math.max(0, rowAt(container.scrollTop, extras) - OVERSCAN);
+        let lastRow = Math.min(rows, rowAt(container.scrollTop + container.clientHeight, extras) + 1 + OVERSCAN);
+        grid.style.transform = `translateY(${rowTop(firstRow, extras)}px)`;
+        grid.innerHTML = visible.slice(firstRow * perRow, lastRow * perRow)
+            .map(position => renderCard(documents[position])).join('');
+
+        // the expanded cards grow with their details: measure them and lay the rows out again if a height changed
+        let changed = false;
+        grid.querySelectorAll('.expanded').forEach(function(card) {
+            if (heights.get(card.dataset.uid) !== card.offsetHeight) {
+                heights.set(card.dataset.uid, card.offsetHeight);
+                changed = true;
+            }
+        });
+        if (changed) {
+            scheduleRender();
+        }
+
+        let status = `Showing ${visible.length} of ${documents.length}`;
+        count.textContent = loaded ? status : status + ' (loading...)';
+    }
+
+    // read the NDJSON stream, rendering the documents as they arrive
+    async function load(after) {
+        let url = `/api/${options.kind}` + (after ? `?after=${encodeURIComponent(after)}` : '');
+        let response = await fetch(url, {credentials: 'same-origin'});
+        let reader = response.body.getReader();
+        let decoder = new TextDecoder();
+        let buffer = '';
+        let next = null;
+        while (true) {
+            let {done, value} = await reader.read();
+            buffer += decoder.decode(value || new Uint8Array(), {stream: !done});
+            let lines = buffer.split('\n');
+            buffer = lines.pop();
+            lines.filter(line => line.trim()).forEach(function(line) {
+                let doc = JSON.parse(line);
+                if ('_next' in doc) {
+                    next = doc._next;
+                } else {
+                    addDocument(doc);
+                }
+            });
+            applyFilters();
+            if (done) {
+                break;
+            }
+        }
+        if (next) {
+            return load(next);
+        }
+        loaded = true;
+        applyFilters();
+    }
+
+    // the search is ranked by the server (trigram index) with the selected filters, so that the best matches are not
+    // crowded out by documents that the filters hide (the filters are applied locally as well)
+    async function search(query) {
+        if (!query) {
+            searchRanking = null;
+            return;
+        }
+        let params = new URLSearchParams({fields: 'UniqueID', searchQuery: query});
+        Object.keys(options.filters).forEach(function(formField) {
+            let input = form.elements[formField];
+            if (input && input.value) {
+                params.set(formField, input.value);
+            }
+        });
+        let response = await fetch(`/api/${options.kind}?${params}`, {credentials: 'same-origin'});
+        let text = await response.text();
+        searchRanking = text.split('\n').filter(line => line.trim()).map(line => JSON.parse(line))
+            .filter(doc => !('_next' in doc)).map(doc => doc.UniqueID);
+    }
+
+    form.addEventListener('submit', async function(event) {
+        if (event.submitter && event.submitter.name === 'clear_filters') {
+            return; // clearing the filters reloads the page
+        }
+        event.preventDefault();
+        // remember the filters in the session (for the next visit), without following the redirect
+        fetch(form.action, {method: 'POST', body: new FormData(form), credentials: 'same-origin', redirect: 'manual'});
+        await search(form.elements['searchQuery'].value.trim());
+        container.scrollTop = 0;
+        applyFilters();
+    });
+
+    form.querySelectorAll('select').forEach(function(select) {
+        select.addEventListener('change', async function() {
+            if (searchRanking !== null) {
+                await search(form.elements['searchQuery'].value.trim());
+            }
+            container.scrollTop = 0;
+            applyFilters();
+        });
+    });
+
+    form.querySelector('button[name="clear_filters"]').addEventListener('click', function(event) {
+        if (!confirm('Are you sure you want to clear all filters?')) {
+            event.preventDefault();
+        }
+    });
+
+    container.addEventListener('scroll', scheduleRender);
+    window.addEventListener('resize', scheduleRender);
+
+    // the cards are re-rendered while scrolling, so their events are handled on the grid
+    grid.addEventListener('change', function(event) {
+        if (!event.target.classList.contains('select-box')) {
+            return;
+        }
+        let card = event.target.closest('[data-uid]');
+        if (event.target.checked) {
+            selected.add(card.dataset.uid);
+            card.classList.add('selected');
+        } else {
+            selected.delete(card.dataset.uid);
+            card.classList.remove('selected');
+        }
+    });
+
+    grid.addEventListener('click', function(event) {
+        let button = event.target.closest('button');
+        if (!button) {
+            return;
+        }
+        let uid = button.closest('[data-uid]').dataset.uid;
+        if (button.classList.contains('expand-btn')) {
+            if (expanded.has(uid)) {
+                expanded.delete(uid);
+            } else {
+                expanded.add(uid);
+            }
+            scheduleRender();
+        } else if (button.classList.contains('view-details-btn')) {
+            window.open(options.viewUrl + uid, '_blank');
+        }
+    });
+
+    document.getElementById('selectAllBtn').addEventListener('click', function() {
+        visible.forEach(position => selected.add(documents[position].UniqueID));
+        scheduleRender();
+    });
+
+    document.getElementById('deselectAllBtn').addEventListener('click', function() {
+        selected.clear();
+        scheduleRender();
+    });
+
+    document.getElementById('addToCartBtn').addEventListener('click', function() {
+        selected.forEach(function(uid) {
+            let doc = documents[positions.get(uid)];
+            let label = options.cartLabel(doc);
+            let existingItem = cart.find(cartItem => cartItem.uid === uid);
+            if (existingItem) {
+                existingItem.quantity++;
+            } else {
+                cart.push({quantity: 1, identifier: label.identifier, name: label.name, uid: uid});
+            }
+        });
+        updateCart();
+        selected.clear();
+        scheduleRender();
+    });
+
+    document.getElementById('generateLabelsBtn').addEventListener('click', function() {
+        if (cart.length > 0) {
+            let selectedUids = cart.map(item => item.uid).join(',');
+            let quantities = cart.map(item => item.quantity).join(',');
+            let blankSpaces = prompt('How many blank spaces should be left?');
+            if (blankSpaces !== null) {
+                let labelsForm = document.getElementById('generateLabelsForm');
+                document.getElementById('selectedUids').value = selectedUids;
+                document.getElementById('blankSpaces').value = blankSpaces;
+                document.getElementById('quantities').value = quantities;
+                labelsForm.submit();
+            }
+        } else {
+            alert('Your cart is empty.');
+        }
+        emptyCart();
+    });
+
+    document.getElementById('emptyCartBtn').addEventListener('click', function() {
+        if (confirm('Are you sure you want to empty the cart?')) {
+            emptyCart();
+        }
+    });
+
+    updateCart();
+    search(form.elements['searchQuery'].value.trim()).then(() => load());
+}
@@ -43,7 +43,7 @@ document.addEventListener("DOMContentLoaded", function() {
                 document.getElementById('flipTime').value = getLocalDateTime();
                 document.getElementById('comment').value = '';
                 stockDetails.style.display = 'none';
-                alert('Stock flipped successfully!');
+                alert(info.message);
             })
         }
         else {
@@ -174,7 +174,7 @@ document.addEventListener("DOMContentLoaded", function() {
         .then(response => response.json())
         .then(data => {
             stockDetails.style.display = 'none';
-            alert('Stock flipped successfully!');
+            alert(data.message);
         });
     });
 
@@ -0,0 +1,258 @@
+# Description: This file contains the asynchronous activity writer (activities are queued in memory and written in batches) and the activity feed.
+
+import atexit
+import base64
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import PyMongoError
+from flymanager.utils.fliplog import parse_timestamp
+
+ACTIVITY_COLLECTION = "activity"
+
+# maximum number of activities waiting to be written (new activities are dropped when the queue is full)
+ACTIVITY_QUEUE_SIZE = 10000
+
+# a batch is written as soon as it has ACTIVITY_BATCH_SIZE activities or is ACTIVITY_FLUSH_INTERVAL seconds old
+ACTIVITY_BATCH_SIZE = 100
+ACTIVITY_FLUSH_INTERVAL = 1.0
+
+# number of activities per page of the activity history
+FEED_PAGE_SIZE = 50
+
+# sentinel telling the writer thread to stop
+_STOP = object()
+
+
+class ActivityWriter:
+    """
+    Write activity documents to MongoDB from a background thread.
+    Activities are put on a bounded queue and written with insert_many when a batch is full or old enough,
+    so request handlers never wait for the database.
+    """
+
+    def __init__(self, db, queue_size=ACTIVITY_QUEUE_SIZE, batch_size=ACTIVITY_BATCH_SIZE,
+                 flush_interval=ACTIVITY_FLUSH_INTERVAL):
+        """
+        Parameters:
+        db: pymongo.database.Database
+            The MongoDB database instance.
+        queue_size: int
+            The maximum number of queued activities.
+        batch_size: int
+            The maximum number of activities per insert.
+        flush_interval: float
+            The maximum time (in seconds) an activity waits in the queue.
+        """
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stats = {"written": 0, "dropped": 0, "failed": 0, "batches": 0}
+        self._thread = threading.Thread(target=self._run, name="activity-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, activity_document):
+        """
+        Queue an activity document (returns False if it was dropped because the queue is full).
+        """
+        if self._closed:
+            # the writer is shut down, write synchronously
+            self._insert([activity_document])
+            return True
+        try:
+            self._queue.put_nowait(activity_document)
+            return True
+        except queue.Full:
+            with self._lock:
+                self._stats["dropped"] += 1
+            return False
+
+    def _run(self):
+        """
+        Collect the queued activities into batches and write them until the writer is closed.
+        """
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._insert(batch)
+
+    def _insert(self, batch):
+        """
+        Write a batch of activities (failures are counted and logged, never raised to the caller).
+        """
+        if not batch:
+            return
+        try:
+            self.db[ACTIVITY_COLLECTION].insert_many(batch, ordered=False)
+            with self._lock:
+                self._stats["written"] += len(batch)
+                self._stats["batches"] += 1
+        except PyMongoError as e:
+            print(f"Failed to write {len(batch)} activities: {e}")
+            with self._lock:
+                self._stats["failed"] += len(batch)
+
+    def close(self):
+        """
+        Stop the writer thread and write everything still in the queue.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+
+        # write the activities queued while the thread was stopping
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                batch.append(item)
+        self._insert(batch)
+
+    def stats(self):
+        """
+        Get the writer statistics: queue depth, written, dropped and failed activities and the number of batches.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize()
+        return stats
+
+
+# activity writer of this process (created on first use)
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_activity_writer(db):
+    """
+    Get the activity writer of this process, starting it on first use (it is closed at interpreter shutdown).
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ActivityWriter(db)
+            atexit.register(_writer.close)
+        return _writer
+
+
+def _after_fork_in_child():
+    """
+    Forget the parent's activity writer in a forked child (its thread does not exist in the child,
+    and the queued activities are written by the parent).
+    """
+    global _writer, _writer_lock
+    _writer = None
+    _writer_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def get_activity_stats():
+    """
+    Get the statistics of the activity writer of this process (None if no activity has been written yet).
+    """
+    return _writer.stats() if _writer is not None else None
+
+
+def encode_feed_cursor(activity_document):
+    """
+    Encode the sort key (timestamp, _id) of the last activity of a page into an opaque cursor.
+    Legacy string timestamps are parsed (None is returned if the timestamp cannot be parsed).
+    """
+    timestamp = parse_timestamp(activity_document["timestamp"])
+    if timestamp is None:
+        return None
+    key = [timestamp.isoformat(), str(activity_document["_id"])]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_feed_cursor(cursor):
+    """
+    Decode a cursor created by encode_feed_cursor (returns None if the cursor is invalid).
+    """
+    try:
+        timestamp, activity_id = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        return datetime.datetime.fromisoformat(timestamp), ObjectId(activity_id)
+    except (ValueError, TypeError, AttributeError, InvalidId):
+        return None
+
+
+def get_activity_feed(user, db, limit=FEED_PAGE_SIZE, after=None):
+    """
+    Get one page of the user's activities, most recent first, from the (user, timestamp, _id) index.
+    Parameters:
+    user: str
+        The username of the user.
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    limit: int
+        The page size.
+    after: str
+        The cursor returned with the previous page (None for the first page).
+    Returns:
+    activities: list
+        The activity documents of the page.
+    next_cursor: str
+        The cursor of the next page, or None if this is the last page.
+    """
+    query = {"user": user}
+    key = decode_feed_cursor(after) if after else None
+    if key:
+        timestamp, activity_id = key
+        query["$or"] = [
+            {"timestamp": {"$lt": timestamp}},
+            {"timestamp": timestamp, "_id": {"$lt": activity_id}},
+        ]
+
+    # fetch one extra activity to know if there is a next page
+    activities = list(db[ACTIVITY_COLLECTION].find(
+        query, sort=[("timestamp", -1), ("_id", -1)], limit=limit + 1
+    ))
+    if len(activities) > limit:
+        activities = activities[:limit]
+        return activities, encode_feed_cursor(activities[-1])
+    return activities, None
+
+
+def migrate_activity_timestamps(db):
+    """
+    Convert the legacy "%Y-%m-%d %H:%M:%S" activity timestamps into native datetimes (one-off migration).
+    Parameters:
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    Returns:
+    count: int
+        The number of migrated activities.
+    """
+    result = db[ACTIVITY_COLLECTION].update_many(
+        {"timestamp": {"$type": "string"}},
+        [{"$set": {"timestamp": {"$dateFromString": {
+            "dateString": "$timestamp", "format": "%Y-%m-%d %H:%M:%S", "onError": "$timestamp"
+        }}}}]
+    )
+    return result.modified_count
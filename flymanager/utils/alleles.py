@@ -0,0 +1,134 @@
+# Description: This file contains the allele queries of the stocks and crosses (allele and chromosome predicates combined with AND/OR), answered by the multikey allele indexes.
+
+import json
+from flymanager.utils.genetics import CHROMOSOME_NAMES, allele_field
+
+# genotype fields queried per collection, and the parents of a cross
+QUERY_GENOTYPE_FIELDS = {
+    "stocks": ["Genotype"],
+    "crosses": ["MaleGenotype", "FemaleGenotype"],
+}
+PARENTS = {"male": "MaleGenotype", "female": "FemaleGenotype"}
+
+ZYGOSITIES = ("homozygous", "heterozygous")
+
+# maximum number of allele predicates in a query (every predicate is one or more index scans)
+MAX_PREDICATES = 32
+
+
+def _allele_condition(allele, zygosity):
+    """
+    Build the condition on an allele array field (the arrays hold the distinct alleles of a chromosome).
+    """
+    if zygosity == "homozygous":
+        # the same allele on both homologs: the array is exactly [allele]
+        return [allele]
+    if zygosity == "heterozygous":
+        return {"$all": [allele], "$size": 2}
+    return allele
+
+
+def _compile_predicate(predicate, collection_name):
+    """
+    Compile an allele predicate ({"allele": ..., "chromosome": ..., "zygosity": ..., "parent": ...}).
+    Without a chromosome (or a parent for the crosses) the predicate matches any of them.
+    The values are type checked before any lookup (the query is user supplied JSON).
+    """
+    allele = predicate.get("allele")
+    if not isinstance(allele, str) or not allele.strip():
+        raise ValueError("allele must be a non-empty string")
+    unknown = set(predicate) - {"allele", "chromosome", "zygosity", "parent"}
+    if unknown:
+        raise ValueError(f"Unknown allele predicate fields: {', '.join(sorted(unknown))}")
+
+    chromosome = predicate.get("chromosome")
+    if chromosome is None:
+        chromosomes = CHROMOSOME_NAMES
+    elif isinstance(chromosome, (str, int)) and not isinstance(chromosome, bool) and str(chromosome) in CHROMOSOME_NAMES:
+        chromosomes = [str(chromosome)]
+    else:
+        raise ValueError(f"chromosome must be one of {', '.join(CHROMOSOME_NAMES)}")
+
+    zygosity = predicate.get("zygosity")
+    if zygosity is not None and (not isinstance(zygosity, str) or zygosity not in ZYGOSITIES):
+        raise ValueError(f"zygosity must be one of {', '.join(ZYGOSITIES)}")
+
+    parent = predicate.get("parent")
+    if parent is None:
+        fields = QUERY_GENOTYPE_FIELDS[collection_name]
+    elif collection_name == "crosses" and isinstance(parent, str) and parent in PARENTS:
+        fields = [PARENTS[parent]]
+    else:
+        raise ValueError("parent must be male or female (crosses only)")
+
+    condition = _allele_condition(allele.strip(), zygosity)
+    clauses = [{allele_field(field, name): condition} for field in fields for name in chromosomes]
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+def compile_allele_query(query, collection_name):
+    """
+    Compile an allele query into a MongoDB query on the allele arrays.
+    A query is an allele predicate, e.g. {"allele": "UAS-GFP", "chromosome": "3"}, or {"and": [...]} / {"or": [...]}
+    of queries, e.g. {"and": [{"allele": "UAS-GFP", "chromosome": "3"}, {"or": [{"allele": "w", "chromosome": "X"},
+    {"allele": "w1118", "chromosome": "X"}]}]}.
+    An allele predicate can also set "zygosity" ("homozygous" or "heterozygous") and, for the crosses,
+    "parent" ("male" or "female").
+    Parameters:
+    query: dict or str
+        The allele query (or its JSON).
+    collection_name: str
+        "stocks" or "crosses"
+    Returns:
+    mongo_query: dict
+        The MongoDB query (every allele predicate is answered by the (User, allele array) indexes).
+    Raises:
+    ValueError
+        If the query is invalid.
+    """
+    if isinstance(query, str):
+        query = json.loads(query)
+    count = [0]
+
+    def compile_node(node):
+        if not isinstance(node, dict):
+            raise ValueError("An allele query must be an object")
+        if "allele" in node:
+            count[0] += 1
+            if count[0] > MAX_PREDICATES:
+                raise ValueError(f"An allele query can have at most {MAX_PREDICATES} predicates")
+            return _compile_predicate(node, collection_name)
+        if len(node) != 1 or next(iter(node)) not in ("and", "or"):
+            raise ValueError('An allele query must be an allele predicate, {"and": [...]} or {"or": [...]}')
+        operator, children = next(iter(node.items()))
+        if not isinstance(children, list) or not children:
+            raise ValueError(f"{operator} must be a non-empty list")
+        compiled = [compile_node(child) for child in children]
+        return compiled[0] if len(compiled) == 1 else {"$" + operator: compiled}
+
+    return compile_node(query)
+
+
+def find_by_alleles(user, collection_name, query, db, projection=None, limit=0):
+    """
+    Get the user's stocks or crosses matching an allele query.
+    Parameters:
+    user: str
+        The username of the user.
+    collection_name: str
+        "stocks" or "crosses"
+    query: dict or str
+        The allele query (see compile_allele_query).
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    projection: dict
+        The projection of the returned documents.
+    limit: int
+        The maximum number of documents (0 for all).
+    Returns:
+    documents: list
+        The matching documents.
+    """
+    mongo_query = {"User": user}
+    mongo_query.update(compile_allele_query(query, collection_name))
+    return list(db[collection_name].find(mongo_query, projection, limit=limit))
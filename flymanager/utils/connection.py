@@ -0,0 +1,200 @@
+# Description: This file contains the MongoDB connection manager (per-process lazy clients configured from the environment and pool statistics).
+
+import os
+import threading
+import time
+from pymongo import MongoClient, monitoring
+
+# client options read from the environment: environment variable -> (MongoClient option, type)
+CLIENT_SETTINGS = {
+    "MONGO_MAX_POOL_SIZE": ("maxPoolSize", int),
+    "MONGO_MIN_POOL_SIZE": ("minPoolSize", int),
+    "MONGO_MAX_IDLE_TIME_MS": ("maxIdleTimeMS", int),
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": ("waitQueueTimeoutMS", int),
+    "MONGO_CONNECT_TIMEOUT_MS": ("connectTimeoutMS", int),
+    "MONGO_SOCKET_TIMEOUT_MS": ("socketTimeoutMS", int),
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": ("serverSelectionTimeoutMS", int),
+    "MONGO_COMPRESSORS": ("compressors", str),
+    "MONGO_APP_NAME": ("appname", str),
+}
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """
+    Collect connection pool statistics (checkouts, checkout failures and the time spent waiting for a connection).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = {}
+        self.reset()
+
+    def reset(self):
+        """
+        Clear the statistics.
+        """
+        with self._lock:
+            self._started.clear()
+            self._stats = {
+                "checkouts": 0,
+                "checkout_failures": 0,
+                "checked_out": 0,
+                "connections_created": 0,
+                "connections_closed": 0,
+                "pool_clears": 0,
+                "total_wait": 0.0,
+                "max_wait": 0.0,
+            }
+
+    def _wait(self, event):
+        """
+        Get the time (in seconds) a checkout waited (from the event if the driver reports it).
+        """
+        started = self._started.pop(threading.get_ident(), None)
+        duration = getattr(event, "duration", None)
+        if duration is not None:
+            return duration
+        return time.perf_counter() - started if started is not None else 0.0
+
+    def connection_check_out_started(self, event):
+        with self._lock:
+            self._started[threading.get_ident()] = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            wait = self._wait(event)
+            self._stats["checkouts"] += 1
+            self._stats["checked_out"] += 1
+            self._stats["total_wait"] += wait
+            self._stats["max_wait"] = max(self._stats["max_wait"], wait)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self._wait(event)
+            self._stats["checkout_failures"] += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self._stats["checked_out"] -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self._stats["connections_created"] += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self._stats["connections_closed"] += 1
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self._stats["pool_clears"] += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def stats(self):
+        """
+        Get the statistics, with the mean and max checkout wait in milliseconds.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        total_wait = stats.pop("total_wait")
+        stats["mean_wait_ms"] = 1000 * total_wait / stats["checkouts"] if stats["checkouts"] else 0.0
+        stats["max_wait_ms"] = 1000 * stats.pop("max_wait")
+        return stats
+
+
+# pool statistics of this process (shared by all its clients)
+pool_listener = PoolStatsListener()
+
+# client of this process (created lazily, and again in every forked child)
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def client_options():
+    """
+    Read the MongoClient options from the environment (unset variables keep the driver defaults).
+    Returns:
+    options: dict
+        The keyword arguments for MongoClient.
+    """
+    options = {}
+    for variable, (option, cast) in CLIENT_SETTINGS.items():
+        value = os.getenv(variable)
+        if value:
+            options[option] = cast(value)
+    return options
+
+
+def new_client():
+    """
+    Create a MongoClient for MONGO_URI with the environment options and the pool statistics listener.
+    """
+    return MongoClient(os.getenv("MONGO_URI"), event_listeners=[pool_listener], **client_options())
+
+
+def get_client():
+    """
+    Get the MongoClient of this process, creating it on first use.
+    A process forked after the client was created gets its own client (MongoClient is not fork-safe).
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            _client = new_client()
+            _client_pid = pid
+        return _client
+
+
+def get_db():
+    """
+    Get the flymanager database (MONGO_DB_NAME) from the client of this process.
+    """
+    return get_client()[os.getenv("MONGO_DB_NAME")]
+
+
+def get_pool_stats():
+    """
+    Get the connection pool statistics of this process.
+    """
+    return pool_listener.stats()
+
+
+class LazyDatabase:
+    """
+    Stand-in for a pymongo Database that resolves to the database of the current process on every access,
+    so a module-level db can be shared safely by pre-fork worker processes.
+    """
+
+    def __getattr__(self, name):
+        return getattr(get_db(), name)
+
+    def __getitem__(self, name):
+        return get_db()[name]
+
+
+def _after_fork_in_child():
+    """
+    Forget the parent's client in a forked child (its sockets belong to the parent) and reset the statistics.
+    """
+    global _client, _client_pid, _client_lock
+    _client = None
+    _client_pid = None
+    _client_lock = threading.Lock()
+    pool_listener.__init__()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
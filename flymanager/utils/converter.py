@@ -1,6 +1,24 @@
 # Description: This file contains functions to convert data between different formats (e.g., CSV, Excel, MongoDB).
 
 import pandas as pd
+from flymanager.utils.fliplog import FLIPLOG_CAP, OVERFLOW_COLLECTION, parse_flip_log, format_flip_log, \
+    parse_timestamp, format_timestamp
+from flymanager.utils.worklist import DATE_FIELDS
+from flymanager.utils.events import EVENTS_COLLECTION, SNAPSHOTS_COLLECTION, backfill_events
+from flymanager.utils.uids import UIDS_COLLECTION, backfill_uid_registry
+from flymanager.utils.explorer import invalidate_facets
+from flymanager.utils.search import SEARCH_COLLECTION, rebuild_search_index
+from flymanager.utils.metadata import VERSION_COLLECTION, bump_metadata_version
+from flymanager.utils.versions import VERSIONS_COLLECTION, bump_data_version
+from flymanager.utils.genetics import GENOTYPE_KEY_FIELDS, CHROMOSOME_NAMES, qc_genotypes, canonical_genotypes, allele_arrays, allele_field, genotype_errors
+
+# collections derived from the stocks and crosses, which are not exported to spreadsheets but rebuilt on import
+# (the overflow flips are exported within the FlipLogs)
+INTERNAL_COLLECTIONS = [EVENTS_COLLECTION, SNAPSHOTS_COLLECTION, UIDS_COLLECTION, SEARCH_COLLECTION,
+                        OVERFLOW_COLLECTION, VERSIONS_COLLECTION, VERSION_COLLECTION]
+
+# fields maintained by the app, dropped on import (EventCount is set again by backfill_events)
+INTERNAL_FIELDS = ["_id", "EventCount", "FlipLogOverflow"]
 
 # csv to mongo and vice versa
 def csv_to_mongo(file_path, collection, db):
@@ -56,6 +74,73 @@ def get_collection_names(db):
     collection_names = db.list_collection_names()
     return collection_names
 
+def check_genotypes(df, sheet):
+    """
+    QC the genotype columns of an imported stock or cross DataFrame at once: the valid genotypes are cleaned and the
+    canonical genotype keys and allele arrays are added (the genotypes that fail the QC are imported unchanged,
+    without keys and with empty allele arrays).
+    Parameters:
+    df: pandas.DataFrame
+        The stocks or crosses.
+    sheet: str
+        The name of the data in the error report (e.g. "stocks").
+    Returns:
+    df: pandas.DataFrame
+        The DataFrame with the cleaned genotypes, the canonical genotype keys and the allele arrays.
+    errors: list
+        A list of {"sheet": sheet, "row": index, "field": genotype field, "genotype": value, "error": message}.
+    """
+    errors = []
+    for field, (canonical_field, hash_field) in GENOTYPE_KEY_FIELDS.items():
+        if field not in df:
+            continue
+        qc = qc_genotypes(df[field])
+        for error in genotype_errors(df[field], qc):
+            errors.append({"sheet": sheet, "field": field, **error})
+        keys = canonical_genotypes(df[field], qc)
+        df[field] = qc["Genotype"]
+        df[canonical_field] = keys["CanonicalGenotype"]
+        df[hash_field] = keys["GenotypeHash"]
+        alleles = allele_arrays(df[field], qc)
+        for chromosome in CHROMOSOME_NAMES:
+            df[allele_field(field, chromosome)] = alleles[chromosome]
+    return df, errors
+
+def prepare_documents(df, collection_name):
+    """
+    Convert an imported stock or cross sheet into documents: the internal fields are dropped, the genotypes are QCed,
+    the flip logs and dates are parsed and the flips beyond FLIPLOG_CAP are moved to overflow entries.
+    Parameters:
+    df: pandas.DataFrame
+        The stocks or crosses.
+    collection_name: str
+        "stocks" or "crosses"
+    Returns:
+    documents: list
+        The documents to insert.
+    errors: list
+        The genotypes that failed the QC (see check_genotypes).
+    overflow: list
+        The overflow entries of the flip logs.
+    """
+    # replace NaN values with empty strings, QC all the genotypes at once
+    df = df.drop(columns=[field for field in INTERNAL_FIELDS if field in df])
+    df, errors = check_genotypes(df.fillna("").astype(str), collection_name)
+    documents = df.to_dict(orient="records")
+
+    # store the flip logs as capped lists of datetimes and the dates as datetimes
+    overflow = []
+    for document in documents:
+        if "FlipLog" in document:
+            flips = parse_flip_log(document["FlipLog"])
+            document["FlipLog"] = flips[:FLIPLOG_CAP]
+            overflow.extend({"UniqueID": document["UniqueID"], "User": document["User"],
+                             "Collection": collection_name, "FlipDate": flip} for flip in flips[FLIPLOG_CAP:])
+        for field in DATE_FIELDS:
+            if document.get(field):
+                document[field] = parse_timestamp(document[field]) or document[field]
+    return documents, errors, overflow
+
 def xls_to_mongo(file_path, db):
     """
     Load an Excel file into a MongoDB database with each sheet as a collection.
@@ -64,6 +149,9 @@ def xls_to_mongo(file_path, db):
         The path to the Excel file.
     db: pymongo.database.Database
         The MongoDB database instance.
+    Returns:
+    errors: list
+        The genotypes that failed the QC (see check_genotypes).
     """
     # Load the Excel file into a pandas ExcelFile object
     xls = pd.ExcelFile(file_path)
@@ -85,7 +173,7 @@ def xls_to_mongo(file_path, db):
         if "Cross" in sheet_name:
             crosses.append(sheet_name)
             continue
-        if "metadata" in sheet_name:
+        if "metadata" in sheet_name or sheet_name in INTERNAL_COLLECTIONS:
             continue
 
         # Load the sheet into a DataFrame
@@ -106,9 +194,8 @@ def xls_to_mongo(file_path, db):
         user_stock["User"] = username
         stock_df = pd.concat([stock_df, user_stock], ignore_index=True)
     
-    # replace NaN values with empty strings
-    stock_df = stock_df.fillna("").astype(str).to_dict(orient="records")
-    
+    stock_df, stock_errors, stock_overflow = prepare_documents(stock_df, "stocks")
+
     cross_df = pd.DataFrame()
     for cross in crosses:
         username = cross.split("_")[0]
@@ -116,15 +203,43 @@ def xls_to_mongo(file_path, db):
         user_cross["User"] = username
         cross_df = pd.concat([cross_df, user_cross], ignore_index=True)
 
-    # replace NaN values with empty strings
-    cross_df = cross_df.fillna("").astype(str).to_dict(orient="records")
+    cross_df, cross_errors, cross_overflow = prepare_documents(cross_df, "crosses")
 
     # # Insert the stock and cross data into the MongoDB collection
     if len(stock_df) > 0:
         db["stocks"].insert_many(stock_df)
     if len(cross_df) > 0:
         db["crosses"].insert_many(cross_df)
+    if stock_overflow or cross_overflow:
+        db[OVERFLOW_COLLECTION].insert_many(stock_overflow + cross_overflow)
+
+    # make sure every imported stock and cross has a history in the event store and a registered UniqueID
+    backfill_events(db)
+    backfill_uid_registry(db)
+
+    # the search index, the cached explorer facets and the cached metadata are stale for every user
+    rebuild_search_index(db)
+    invalidate_facets()
+    bump_metadata_version(db)
+    for user in set(db["stocks"].distinct("User")) | set(db["crosses"].distinct("User")):
+        bump_data_version(user, db)
 
+    # report the genotypes that failed the QC (they were imported unchanged)
+    errors = stock_errors + cross_errors
+    for error in errors:
+        print(f"{error['sheet']} row {error['row']}: {error['field']} {error['genotype']!r} failed QC ({error['error']})")
+    return errors
+
+
+def full_flip_logs(df, collection_name, user, db):
+    """
+    Get the complete flip logs (document flips plus overflow) of the user's exported stocks or crosses.
+    """
+    overflow = {}
+    for entry in db[OVERFLOW_COLLECTION].find({"User": user, "Collection": collection_name}, {"UniqueID": 1, "FlipDate": 1}):
+        overflow.setdefault(entry["UniqueID"], []).append(entry["FlipDate"])
+    return pd.Series([sorted(set(parse_flip_log(flip_log) + overflow.get(uid, [])), reverse=True)
+                      for uid, flip_log in zip(df["UniqueID"], df["FlipLog"])], index=df.index)
 
 def mongo_to_xls(db, file_path):
     """
@@ -144,8 +259,8 @@ def mongo_to_xls(db, file_path):
     # Iterate over each collection
     for collection_name in collection_names:
 
-        # Skip the stock, cross and metadata collections and process them separately
-        if collection_name == "stocks" or collection_name == "crosses":
+        # Skip the stock and cross collections (processed separately) and the internal collections (rebuilt on import)
+        if collection_name == "stocks" or collection_name == "crosses" or collection_name in INTERNAL_COLLECTIONS:
             continue
 
         # Query all documents in the collection
@@ -162,6 +277,11 @@ def mongo_to_xls(db, file_path):
     usernames = db["stocks"].distinct("User")
     for username in usernames:
         stock_df = pd.DataFrame(list(db["stocks"].find({"User": username})))
+        if "FlipLog" in stock_df:
+            stock_df["FlipLog"] = full_flip_logs(stock_df, "stocks", username, db).map(format_flip_log)
+        for field in DATE_FIELDS:
+            if field in stock_df:
+                stock_df[field] = stock_df[field].map(format_timestamp)
         stock_df.to_excel(writer, sheet_name=username + "_Stock", index=False)
 
     # Process cross data
@@ -169,7 +289,38 @@ def mongo_to_xls(db, file_path):
     usernames = db["crosses"].distinct("User")
     for username in usernames:
         cross_df = pd.DataFrame(list(db["crosses"].find({"User": username})))
+        if "FlipLog" in cross_df:
+            cross_df["FlipLog"] = full_flip_logs(cross_df, "crosses", username, db).map(format_flip_log)
+        for field in DATE_FIELDS:
+            if field in cross_df:
+                cross_df[field] = cross_df[field].map(format_timestamp)
         cross_df.to_excel(writer, sheet_name=username + "_Cross", index=False)
     
     # Save the Excel file
     writer.close()
+
+
+def table_to_records(file, filename):
+    """
+    Load an uploaded table (.xlsx, .csv or tab-separated .tsv/.txt) into a list of records.
+    Parameters:
+    file: file-like
+        The uploaded file.
+    filename: str
+        The name of the uploaded file (used to pick the format).
+    Returns:
+    records: list
+        A list of dictionaries (one per row) with the empty cells removed.
+    """
+    # every cell is read as text, so that IDs like 3 are not turned into "3.0" and values like "NA" are kept
+    extension = filename.rsplit('.', 1)[-1].lower()
+    if extension == "xlsx":
+        df = pd.read_excel(file, dtype=str, keep_default_na=False)
+    elif extension in ["tsv", "txt"]:
+        df = pd.read_csv(file, sep="\t", dtype=str, keep_default_na=False)
+    else:
+        df = pd.read_csv(file, dtype=str, keep_default_na=False)
+
+    # replace the remaining NaN values with empty strings and drop the empty fields
+    records = df.fillna("").to_dict(orient="records")
+    return [{k: v.strip() for k, v in record.items() if v.strip()} for record in records]
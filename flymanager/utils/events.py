@@ -0,0 +1,174 @@
+# Description: This file contains the append-only event store for stocks and crosses and the point-in-time reconstruction.
+
+import datetime
+from pymongo import ASCENDING, DESCENDING
+from flymanager.utils.fliplog import parse_timestamp
+
+EVENTS_COLLECTION = "events"
+SNAPSHOTS_COLLECTION = "snapshots"
+
+# a full snapshot of a stock/cross is stored every SNAPSHOT_INTERVAL events
+SNAPSHOT_INTERVAL = 25
+
+# fields that are not part of the reconstructed state
+UNTRACKED_FIELDS = ["_id", "FlipLog", "FlipLogOverflow", "ModificationLog", "EventCount"]
+
+
+def make_event(kind, uid, user, action, changes=None, ts=None):
+    """
+    Create an event document.
+    Parameters:
+    kind: str
+        "stock" or "cross"
+    uid: str
+        The unique identifier of the stock or cross.
+    user: str
+        The username of the owner.
+    action: str
+        "create", "edit", "flip" or "delete"
+    changes: dict
+        The fields set by the event (the full document for "create").
+    ts: datetime.datetime
+        The time of the event (defaults to now).
+    Returns:
+    event: dict
+        The event document.
+    """
+    return {
+        "UniqueID": uid,
+        "User": user,
+        "Kind": kind,
+        "Action": action,
+        "Changes": {k: v for k, v in (changes or {}).items() if k not in UNTRACKED_FIELDS},
+        "ts": ts or datetime.datetime.now(),
+    }
+
+
+def record_events(events, db):
+    """
+    Append a batch of events to the event store with a single insert.
+    Parameters:
+    events: list
+        The event documents (see make_event).
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    """
+    if events:
+        db[EVENTS_COLLECTION].insert_many(events)
+
+
+def maybe_snapshot(document, kind, db, ts=None):
+    """
+    Store a snapshot of the document if its event count has reached the snapshot interval.
+    Parameters:
+    document: dict
+        The stock or cross document after the mutation (with its EventCount).
+    kind: str
+        "stock" or "cross"
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    ts: datetime.datetime
+        The time of the snapshot (defaults to now).
+    """
+    if not document or document.get("EventCount", 0) % SNAPSHOT_INTERVAL != 0:
+        return
+    db[SNAPSHOTS_COLLECTION].insert_one({
+        "UniqueID": document["UniqueID"],
+        "Kind": kind,
+        "ts": ts or datetime.datetime.now(),
+        "State": {k: v for k, v in document.items() if k not in UNTRACKED_FIELDS},
+    })
+
+
+def apply_event(state, event):
+    """
+    Apply an event to a state (returns the new state, or None if the stock/cross was deleted).
+    """
+    if event["Action"] == "create":
+        return dict(event["Changes"])
+    if event["Action"] == "delete":
+        return None
+    state = dict(state or {})
+    state.update(event["Changes"])
+    return state
+
+
+def get_state_at(uid, as_of, db):
+    """
+    Rebuild the state of a stock or cross as of a given time by replaying events from the latest snapshot.
+    Parameters:
+    uid: str
+        The unique identifier of the stock or cross.
+    as_of: datetime.datetime or str
+        The point in time.
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    Returns:
+    state: dict
+        The fields of the stock or cross at that time, or None if it did not exist.
+    """
+    as_of = parse_timestamp(as_of)
+
+    # start from the most recent snapshot before the requested time
+    snapshot = db[SNAPSHOTS_COLLECTION].find_one(
+        {"UniqueID": uid, "ts": {"$lte": as_of}},
+        sort=[("ts", DESCENDING)]
+    )
+    query = {"UniqueID": uid, "ts": {"$lte": as_of}}
+    state = None
+    if snapshot:
+        state = snapshot["State"]
+        query["ts"]["$gt"] = snapshot["ts"]
+
+    # replay the events since the snapshot
+    for event in db[EVENTS_COLLECTION].find(query).sort("ts", ASCENDING):
+        state = apply_event(state, event)
+    return state
+
+
+def get_history(uid, db, limit=None):
+    """
+    Get the events of a stock or cross (most recent first).
+    Parameters:
+    uid: str
+        The unique identifier of the stock or cross.
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    limit: int
+        The maximum number of events to return.
+    Returns:
+    events: list
+        A list of event documents.
+    """
+    cursor = db[EVENTS_COLLECTION].find({"UniqueID": uid}, {"_id": 0}).sort("ts", DESCENDING)
+    if limit:
+        cursor = cursor.limit(limit)
+    return list(cursor)
+
+
+def backfill_events(db):
+    """
+    Record a "create" event for every stock and cross that has no events yet (one-off migration).
+    Parameters:
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    Returns:
+    backfilled: dict
+        The number of documents backfilled per collection.
+    """
+    backfilled = {}
+    tracked = set(db[EVENTS_COLLECTION].distinct("UniqueID"))
+    for kind, collection_name in [("stock", "stocks"), ("cross", "crosses")]:
+        events = []
+        for document in db[collection_name].find():
+            if document["UniqueID"] in tracked:
+                continue
+            ts = parse_timestamp(document.get("CreationDate")) or datetime.datetime.now()
+            events.append(make_event(kind, document["UniqueID"], document["User"], "create", document, ts))
+        record_events(events, db)
+        # the backfilled documents have a single event
+        if events:
+            db[collection_name].update_many({"UniqueID": {"$in": [event["UniqueID"] for event in events]}},
+                                            {"$set": {"EventCount": 1}})
+        backfilled[collection_name] = len(events)
+    return backfilled
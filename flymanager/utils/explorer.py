@@ -0,0 +1,327 @@
+# Description: This file contains the query engine behind the stock and cross explorers (server-side filters and keyset pagination).
+
+import base64
+import datetime
+import json
+import re
+import threading
+from flymanager.utils.indexes import TRAY_COLLATION
+from flymanager.utils.search import search
+from flymanager.utils.alleles import compile_allele_query
+from flymanager.utils.fliplog import format_timestamp
+
+# number of stocks/crosses shown per explorer page
+PAGE_SIZE = 100
+
+# explorer definitions: form field -> document field for the filters (the searched fields are in flymanager.utils.search)
+EXPLORERS = {
+    "stocks": {
+        "filters": {
+            "filterType": "Type",
+            "filterTrayID": "TrayID",
+            "filterStatus": "Status",
+            "filterFoodType": "FoodType",
+            "filterProvenance": "Provenance",
+        },
+    },
+    "crosses": {
+        "filters": {
+            "filterMaleGenotype": "MaleGenotype",
+            "filterFemaleGenotype": "FemaleGenotype",
+            "filterTrayID": "TrayID",
+            "filterStatus": "Status",
+            "filterFoodType": "FoodType",
+        },
+    },
+}
+
+# explorer pages are sorted by tray, tray position and UniqueID (matching the tray index)
+TRAY_SORT = [("TrayID", 1), ("TrayPosition", 1), ("UniqueID", 1)]
+
+# fields that the explorers never display
+EXPLORER_PROJECTION = {"FlipLog": 0, "FlipLogOverflow": 0, "EventCount": 0}
+
+# fields that the stock/cross API can return (the sort key fields are always returned, they make up the cursors)
+API_FIELDS = {
+    "stocks": ["UniqueID", "SourceID", "Genotype", "Name", "AltReference", "Type", "SeriesID", "ReplicateID", "TrayID",
+               "TrayPosition", "Status", "FoodType", "Provenance", "Comments", "CreationDate", "LastFlipDate",
+               "DataModifiedDate"],
+    "crosses": ["UniqueID", "Name", "MaleUniqueID", "MaleGenotype", "FemaleUniqueID", "FemaleGenotype", "TrayID",
+                "TrayPosition", "Status", "FoodType", "Comments", "CreationDate", "LastFlipDate", "DataModifiedDate"],
+}
+KEY_FIELDS = ["TrayID", "TrayPosition", "UniqueID"]
+
+# number of documents read from MongoDB per batch when streaming
+STREAM_BATCH_SIZE = 1000
+
+# cached (data version, facet counts) per (user, collection)
+_facet_cache = {}
+_facet_lock = threading.Lock()
+
+
+def encode_cursor(document):
+    """
+    Encode the sort key of the last document of a page into an opaque cursor.
+    """
+    key = [document.get("TrayID", ""), document.get("TrayPosition", ""), document["UniqueID"]]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor created by encode_cursor (returns None if the cursor is invalid).
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, AttributeError):
+        return None
+    if not isinstance(key, list) or len(key) != 3:
+        return None
+    return key
+
+
+def build_query(user, collection_name, filter_state=None):
+    """
+    Compile the explorer filters into a MongoDB query.
+    Parameters:
+    user: str
+        The username of the user.
+    collection_name: str
+        "stocks" or "crosses"
+    filter_state: dict
+        The filter form values (e.g. {"filterType": "...", "filterTrayID": "..."}), empty values are ignored.
+        An "alleleQuery" (see flymanager.utils.alleles.compile_allele_query) is added to the filters.
+    Returns:
+    query: dict
+        The MongoDB query.
+    Raises:
+    ValueError
+        If the allele query is invalid.
+    """
+    query = {"User": user}
+    for form_field, field in EXPLORERS[collection_name]["filters"].items():
+        value = (filter_state or {}).get(form_field)
+        if not value:
+            continue
+        if field == "Provenance":
+            # provenances are filtered on the source (the part before the first '/')
+            query[field] = {"$regex": "^" + re.escape(value) + "(/|$)"}
+        else:
+            query[field] = value
+    allele_query = (filter_state or {}).get("alleleQuery")
+    if allele_query:
+        query.update(compile_allele_query(allele_query, collection_name))
+    return query
+
+
+def _after(key):
+    """
+    Build the keyset condition selecting the documents after a sort key.
+    """
+    tray_id, tray_position, uid = key
+    return {"$or": [
+        {"TrayID": {"$gt": tray_id}},
+        {"TrayID": tray_id, "TrayPosition": {"$gt": tray_position}},
+        {"TrayID": tray_id, "TrayPosition": tray_position, "UniqueID": {"$gt": uid}},
+    ]}
+
+
+def query_page(user, collection_name, db, filter_state=None, after=None, limit=PAGE_SIZE, projection=EXPLORER_PROJECTION):
+    """
+    Get one page of the user's stocks or crosses, filtered and sorted by tray in MongoDB.
+    With a search query, the best matches (up to limit) are returned on a single page, best first.
+    Parameters:
+    user: str
+        The username of the user.
+    collection_name: str
+        "stocks" or "crosses"
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    filter_state: dict
+        The filter form values, including the optional "searchQuery".
+    after: str
+        The cursor returned with the previous page (None for the first page).
+    limit: int
+        The page size.
+    projection: dict
+        The projection of the returned documents (must keep the sort key fields).
+    Returns:
+    documents: list
+        The documents of the page.
+    next_cursor: str
+        The cursor of the next page, or None if this is the last page.
+    """
+    query = build_query(user, collection_name, filter_state)
+
+    search_query = (filter_state or {}).get("searchQuery")
+    if search_query:
+        # the search index selects the candidates, which are ranked by relevance
+        return search(user, collection_name, search_query, db, filters=query, k=limit, projection=projection), None
+
+    key = decode_cursor(after) if after else None
+    if key:
+        query = {"$and": [query, _after(key)]}
+
+    # fetch one extra document to know if there is a next page
+    documents = list(db[collection_name].find(query, projection, sort=TRAY_SORT, collation=TRAY_COLLATION,
+                                              limit=limit + 1))
+
+    if len(documents) > limit:
+        documents = documents[:limit]
+        return documents, encode_cursor(documents[-1])
+    return documents, None
+
+
+def api_projection(collection_name, fields=None):
+    """
+    Build the projection of a stock/cross API request.
+    Parameters:
+    collection_name: str
+        "stocks" or "crosses"
+    fields: list
+        The requested fields (all the API fields if empty), unknown fields are ignored.
+    Returns:
+    projection: dict
+        The inclusion projection, with the sort key fields.
+    """
+    allowed = API_FIELDS[collection_name]
+    fields = [field for field in fields or allowed if field in allowed]
+    projection = {"_id": 0}
+    projection.update({field: 1 for field in fields + KEY_FIELDS})
+    return projection
+
+
+def _json_default(value):
+    """
+    Serialize the values that json does not know (dates are formatted like in the rest of the app).
+    """
+    if isinstance(value, datetime.datetime):
+        return format_timestamp(value)
+    return str(value)
+
+
+def stream_ndjson(user, collection_name, db, filter_state=None, after=None, limit=None, projection=None,
+                  batch_size=STREAM_BATCH_SIZE):
+    """
+    Stream the user's stocks or crosses as NDJSON (one JSON document per line), reading MongoDB in keyset batches
+    so that memory use does not grow with the number of documents.
+    The last line is {"_next": cursor}, with the cursor to resume from (null once everything has been sent).
+    Parameters:
+    user: str
+        The username of the user.
+    collection_name: str
+        "stocks" or "crosses"
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    filter_state: dict
+        The filter values, including the optional "searchQuery" (the best matches are sent on their own).
+    after: str
+        The cursor to resume from (None to start from the first document).
+    limit: int
+        The maximum number of documents to send (all if None).
+    projection: dict
+        The projection of the documents (defaults to all the API fields).
+    batch_size: int
+        The number of documents read per query.
+    Yields:
+    line: str
+        The NDJSON lines.
+    """
+    projection = projection or api_projection(collection_name)
+
+    def read_page(after, limit):
+        return query_page(user, collection_name, db, filter_state, after=after, limit=limit, projection=projection)
+
+    yield from stream_pages(read_page, after=after, limit=limit, batch_size=batch_size)
+
+
+def stream_pages(read_page, after=None, limit=None, batch_size=STREAM_BATCH_SIZE):
+    """
+    Stream documents read page by page as NDJSON, then {"_next": cursor} (see stream_ndjson).
+    Parameters:
+    read_page: function
+        read_page(after, limit) returns one page of documents and the cursor of the next page (None on the last page).
+    after: str
+        The cursor to resume from (None to start from the first document).
+    limit: int
+        The maximum number of documents to send (all if None).
+    batch_size: int
+        The number of documents read per page.
+    Yields:
+    line: str
+        The NDJSON lines.
+    """
+    sent = 0
+    while True:
+        page_size = batch_size if limit is None else min(batch_size, limit - sent)
+        documents, after = read_page(after, page_size)
+        for document in documents:
+            yield json.dumps(document, default=_json_default) + "\n"
+        sent += len(documents)
+        if after is None or (limit is not None and sent >= limit):
+            break
+    yield json.dumps({"_next": after}) + "\n"
+
+
+def _facet_expression(field):
+    """
+    Get the expression grouped on by the facet of a filter field.
+    """
+    if field == "Provenance":
+        # provenances are grouped by their source (the part before the first '/')
+        return {"$arrayElemAt": [{"$split": [{"$toString": "$Provenance"}, "/"]}, 0]}
+    return {"$toString": "$" + field}
+
+
+def get_facet_counts(user, collection_name, db, version=None):
+    """
+    Get the distinct values, with their counts, of every filter field of the user's stocks or crosses
+    in a single $facet aggregation. The result is cached per user until the user's data changes.
+    Parameters:
+    user: str
+        The username of the user.
+    collection_name: str
+        "stocks" or "crosses"
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    version: str
+        The user's data version (the cached counts are only used if they were computed at this version,
+        so changes made by other processes are picked up).
+    Returns:
+    facets: dict
+        A dictionary of {field: sorted list of (value, count)}.
+    """
+    with _facet_lock:
+        cached = _facet_cache.get((user, collection_name))
+    if cached is not None and (version is None or cached[0] == version):
+        return cached[1]
+
+    fields = list(EXPLORERS[collection_name]["filters"].values())
+    pipeline = [
+        {"$match": {"User": user}},
+        {"$facet": {
+            field: [{"$group": {"_id": _facet_expression(field), "count": {"$sum": 1}}}]
+            for field in fields
+        }}
+    ]
+    result = next(db[collection_name].aggregate(pipeline), {})
+    facets = {
+        field: sorted((str(group["_id"]), group["count"]) for group in result.get(field, []))
+        for field in fields
+    }
+
+    with _facet_lock:
+        _facet_cache[(user, collection_name)] = (version, facets)
+    return facets
+
+
+def invalidate_facets(user=None):
+    """
+    Drop the cached facet counts of a user (or of all users if user is None).
+    """
+    with _facet_lock:
+        if user is None:
+            _facet_cache.clear()
+        else:
+            for key in [key for key in _facet_cache if key[0] == user]:
+                del _facet_cache[key]
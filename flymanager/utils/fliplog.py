@@ -0,0 +1,235 @@
+# Description: This file contains functions for the flip logs of stocks and crosses (storage, migration and analytics).
+
+import datetime
+import numpy as np
+import pandas as pd
+from pymongo import UpdateOne
+
+# number of most recent flips kept on the stock/cross document (older flips are moved to the overflow collection)
+FLIPLOG_CAP = 50
+
+# collection holding the flips that no longer fit in the documents
+OVERFLOW_COLLECTION = "flip_log_overflow"
+
+# flip interval (in days) assumed for stocks that have been flipped only once
+DEFAULT_FLIP_INTERVAL = 14
+
+
+def parse_timestamp(timestamp):
+    """
+    Parse a timestamp string ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M" or the "T"-separated form from the flip UI).
+    Parameters:
+    timestamp: str or datetime.datetime
+        The timestamp to parse.
+    Returns:
+    timestamp: datetime.datetime
+        The parsed timestamp, or None if it cannot be parsed.
+    """
+    if isinstance(timestamp, datetime.datetime):
+        return timestamp
+    try:
+        return datetime.datetime.fromisoformat(str(timestamp).strip().replace(' ', 'T'))
+    except ValueError:
+        return None
+
+
+def format_timestamp(timestamp):
+    """
+    Format a datetime as "%Y-%m-%d %H:%M:%S" (other values, e.g. unmigrated strings, are returned unchanged).
+    """
+    if isinstance(timestamp, datetime.datetime):
+        return timestamp.strftime("%Y-%m-%d %H:%M:%S")
+    return timestamp
+
+
+def parse_flip_log(flip_log):
+    """
+    Convert a legacy semicolon-joined FlipLog string into a list of datetimes (most recent first).
+    Parameters:
+    flip_log: str or list
+        The flip log as stored in the document.
+    Returns:
+    flips: list
+        A list of datetime.datetime objects sorted from the most recent to the oldest.
+    """
+    if isinstance(flip_log, list):
+        entries = flip_log
+    elif isinstance(flip_log, str):
+        entries = flip_log.split(";")
+    else:
+        entries = []
+    flips = [parse_timestamp(entry) for entry in entries if str(entry).strip()]
+    return sorted([flip for flip in flips if flip is not None], reverse=True)
+
+
+def format_flip_log(flip_log):
+    """
+    Convert a FlipLog array back into the semicolon-joined string (used for spreadsheets).
+    """
+    if not isinstance(flip_log, list):
+        return flip_log
+    return "; ".join(flip.strftime("%Y-%m-%d %H:%M:%S") for flip in flip_log)
+
+
+def flip_log_update(flip_time):
+    """
+    Build the pipeline expressions that prepend a flip to the capped FlipLog array.
+    Flips beyond FLIPLOG_CAP are moved into the temporary FlipLogOverflow field, to be spilled by spill_flip_log.
+    Legacy string logs are converted on the fly.
+    Parameters:
+    flip_time: datetime.datetime
+        The time of the flip.
+    Returns:
+    update_fields: dict
+        The FlipLog and FlipLogOverflow expressions for a $set stage.
+    """
+    legacy_log = {"$map": {
+        "input": {"$split": ["$FlipLog", ";"]},
+        "in": {"$let": {
+            "vars": {"entry": {"$trim": {"input": "$$this"}}},
+            "in": {"$dateFromString": {
+                "dateString": "$$entry", "format": "%Y-%m-%d %H:%M:%S", "onNull": None,
+                "onError": {"$dateFromString": {"dateString": "$$entry", "format": "%Y-%m-%d %H:%M", "onError": None}}
+            }}
+        }}
+    }}
+    previous_log = {"$switch": {
+        "branches": [
+            {"case": {"$isArray": "$FlipLog"}, "then": "$FlipLog"},
+            {"case": {"$eq": [{"$type": "$FlipLog"}, "string"]},
+             "then": {"$filter": {"input": legacy_log, "cond": {"$ne": ["$$this", None]}}}}
+        ],
+        "default": []
+    }}
+    return {
+        "FlipLog": {"$slice": [{"$concatArrays": [[flip_time], previous_log]}, FLIPLOG_CAP]},
+        "FlipLogOverflow": {"$let": {
+            "vars": {"log": {"$concatArrays": [[flip_time], previous_log]}},
+            "in": {"$cond": [
+                {"$gt": [{"$size": "$$log"}, FLIPLOG_CAP]},
+                {"$slice": ["$$log", FLIPLOG_CAP, {"$size": "$$log"}]},
+                "$$REMOVE"
+            ]}
+        }}
+    }
+
+
+def spill_flip_log(document, collection_name, db):
+    """
+    Move the flips in the FlipLogOverflow field of an updated document into the overflow collection.
+    Parameters:
+    document: dict
+        The document returned by the flip (modified in place to drop FlipLogOverflow).
+    collection_name: str
+        The collection the document belongs to ("stocks" or "crosses").
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    """
+    if not document or not document.get("FlipLogOverflow"):
+        return
+    overflow = document.pop("FlipLogOverflow")
+    db[OVERFLOW_COLLECTION].insert_many([
+        {"UniqueID": document["UniqueID"], "User": document["User"], "Collection": collection_name, "FlipDate": flip}
+        for flip in overflow
+    ])
+    # only clear the overflow we just moved (a concurrent flip may have spilled more in the meantime)
+    db[collection_name].update_one(
+        {"_id": document["_id"], "FlipLogOverflow": overflow},
+        {"$unset": {"FlipLogOverflow": ""}}
+    )
+
+
+def get_full_flip_log(uid, db, collection_name="stocks"):
+    """
+    Get the complete flip history of a stock or cross (document flips plus overflow).
+    Parameters:
+    uid: str
+        The unique identifier of the stock or cross.
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    collection_name: str
+        The collection the document belongs to ("stocks" or "crosses").
+    Returns:
+    flips: list
+        A list of datetime.datetime objects sorted from the most recent to the oldest.
+    """
+    document = db[collection_name].find_one({"UniqueID": uid}, {"FlipLog": 1})
+    flips = parse_flip_log(document.get("FlipLog")) if document else []
+    overflow = db[OVERFLOW_COLLECTION].find({"UniqueID": uid}, {"FlipDate": 1}).sort("FlipDate", -1)
+    flips.extend(entry["FlipDate"] for entry in overflow)
+    return sorted(set(flips), reverse=True)
+
+
+def migrate_flip_logs(db, batch_size=1000):
+    """
+    Convert the legacy string FlipLogs of all stocks and crosses into capped datetime arrays (one-off migration).
+    Parameters:
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    batch_size: int
+        The number of documents updated per bulk write.
+    Returns:
+    migrated: dict
+        The number of migrated documents per collection.
+    """
+    migrated = {}
+    for collection_name in ["stocks", "crosses"]:
+        collection = db[collection_name]
+        migrated[collection_name] = 0
+        updates = []
+        overflow = []
+        for document in collection.find({"FlipLog": {"$type": "string"}}, {"UniqueID": 1, "User": 1, "FlipLog": 1}):
+            flips = parse_flip_log(document["FlipLog"])
+            updates.append(UpdateOne({"_id": document["_id"]}, {"$set": {"FlipLog": flips[:FLIPLOG_CAP]}}))
+            overflow.extend({"UniqueID": document["UniqueID"], "User": document["User"],
+                             "Collection": collection_name, "FlipDate": flip} for flip in flips[FLIPLOG_CAP:])
+            if len(updates) >= batch_size:
+                collection.bulk_write(updates, ordered=False)
+                migrated[collection_name] += len(updates)
+                updates = []
+        if updates:
+            collection.bulk_write(updates, ordered=False)
+            migrated[collection_name] += len(updates)
+        if overflow:
+            db[OVERFLOW_COLLECTION].insert_many(overflow, ordered=False)
+    return migrated
+
+
+def flip_interval_stats(user, db, collection_name="stocks", now=None):
+    """
+    Compute the flip interval statistics of all of the user's stocks (or crosses) in one pass.
+    Parameters:
+    user: str
+        The username of the user.
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    collection_name: str
+        The collection to analyse ("stocks" or "crosses").
+    now: datetime.datetime
+        The reference time for the overdue scores (defaults to the current time).
+    Returns:
+    stats: pandas.DataFrame
+        A dataframe indexed by UniqueID with the columns n_flips, last_flip, mean_interval_days,
+        days_since_flip and overdue_score (days since the last flip / mean flip interval, > 1 means overdue).
+    """
+    now = pd.Timestamp(now or datetime.datetime.now())
+    documents = db[collection_name].find({"User": user}, {"_id": 0, "UniqueID": 1, "FlipLog": 1})
+    df = pd.DataFrame(list(documents), columns=["UniqueID", "FlipLog"])
+
+    # one row per flip
+    flips = df.explode("FlipLog").dropna(subset=["FlipLog"])
+    flips["FlipLog"] = pd.to_datetime(flips["FlipLog"], errors="coerce")
+    flips = flips.dropna(subset=["FlipLog"]).sort_values(["UniqueID", "FlipLog"])
+
+    # intervals between consecutive flips of the same stock
+    flips["interval"] = flips.groupby("UniqueID")["FlipLog"].diff().dt.total_seconds() / 86400
+
+    stats = flips.groupby("UniqueID").agg(
+        n_flips=("FlipLog", "size"),
+        last_flip=("FlipLog", "max"),
+        mean_interval_days=("interval", "mean"),
+    )
+    stats["days_since_flip"] = (now - stats["last_flip"]).dt.total_seconds() / 86400
+    expected_interval = stats["mean_interval_days"].fillna(DEFAULT_FLIP_INTERVAL).clip(lower=1)
+    stats["overdue_score"] = np.round(stats["days_since_flip"] / expected_interval, 3)
+    return stats.sort_values("overdue_score", ascending=False)
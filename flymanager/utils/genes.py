@@ -0,0 +1,138 @@
+# Description: This file contains the gene autocompletion service (a sorted array per chromosome, searched by prefix with bisect).
+
+import bisect
+import heapq
+import threading
+from flymanager.utils.metadata import get_all_metadata
+
+# chromosome (as used in the URLs) -> metadata collection of its genes
+CHROMOSOMES = {
+    "X": "genesX",
+    "2": "genes2nd",
+    "3": "genes3rd",
+    "4": "genes4th",
+}
+
+# default number of completions returned per lookup
+GENE_COMPLETIONS = 20
+
+# above this fraction of changed genes an index is rebuilt instead of updated in place
+REBUILD_FRACTION = 0.1
+
+# maximum number of cached completions per chromosome (short prefixes match many genes and are ranked only once)
+COMPLETION_CACHE_SIZE = 4096
+
+
+class GeneIndex:
+    """
+    Sorted array of (lowercase gene, gene) searched by prefix with bisect.
+    """
+
+    def __init__(self, genes=()):
+        self.rebuild(genes)
+
+    def rebuild(self, genes):
+        """
+        Build the index from a list of genes.
+        """
+        self.genes = set(gene for gene in genes if gene)
+        self.keys = sorted((gene.lower(), gene) for gene in self.genes)
+        self.completions = {}
+
+    def update(self, genes):
+        """
+        Bring the index up to date with a new list of genes, inserting and removing only the genes that changed.
+        Returns:
+        changed: int
+            The number of added and removed genes.
+        """
+        genes = set(gene for gene in genes if gene)
+        added = genes - self.genes
+        removed = self.genes - genes
+        changed = len(added) + len(removed)
+        if changed > REBUILD_FRACTION * max(len(self.keys), 1):
+            self.rebuild(genes)
+            return changed
+        for gene in removed:
+            key = (gene.lower(), gene)
+            position = bisect.bisect_left(self.keys, key)
+            if position < len(self.keys) and self.keys[position] == key:
+                del self.keys[position]
+        for gene in added:
+            bisect.insort(self.keys, (gene.lower(), gene))
+        self.genes = genes
+        if changed:
+            self.completions = {}
+        return changed
+
+    def complete(self, prefix, k=GENE_COMPLETIONS):
+        """
+        Get the best k genes starting with a prefix (case insensitive): an exact match first, then the shortest genes,
+        then in alphabetical order.
+        """
+        prefix = prefix.lower()
+        cached = self.completions.get((prefix, k))
+        if cached is not None:
+            return cached
+        start = bisect.bisect_left(self.keys, (prefix,))
+        end = bisect.bisect_left(self.keys, (prefix + "\uffff",), start)
+        matches = heapq.nsmallest(k, (self.keys[i] for i in range(start, end)),
+                                  key=lambda key: (key[0] != prefix, len(key[0]), key))
+        completions = [gene for _, gene in matches]
+        if len(self.completions) >= COMPLETION_CACHE_SIZE:
+            self.completions = {}
+        self.completions[(prefix, k)] = completions
+        return completions
+
+    def __len__(self):
+        return len(self.keys)
+
+
+# gene indexes of this process and the metadata lists they were built from
+_indexes = {chromosome: GeneIndex() for chromosome in CHROMOSOMES}
+_source = None
+_index_lock = threading.Lock()
+
+
+def get_gene_index(chromosome, db):
+    """
+    Get the gene index of a chromosome, kept in sync with the metadata cache (the indexes are only updated when the
+    cached metadata lists are reloaded, i.e. after the metadata version changed).
+    Parameters:
+    chromosome: str
+        "X", "2", "3" or "4"
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    Returns:
+    index: GeneIndex
+        The gene index of the chromosome.
+    """
+    global _source
+    lists = get_all_metadata(db)
+    with _index_lock:
+        if lists is not _source:
+            for name, collection_name in CHROMOSOMES.items():
+                _indexes[name].update(lists.get(collection_name, []))
+            _source = lists
+        return _indexes[chromosome]
+
+
+def complete_genes(chromosome, prefix, db, k=GENE_COMPLETIONS):
+    """
+    Autocomplete a gene of a chromosome.
+    Parameters:
+    chromosome: str
+        "X", "2", "3" or "4"
+    prefix: str
+        The beginning of the gene (case insensitive).
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    k: int
+        The maximum number of genes.
+    Returns:
+    genes: list
+        The best matching genes (exact match, then shortest first).
+    """
+    index = get_gene_index(chromosome, db)
+    with _index_lock:
+        return index.complete(prefix, k)
@@ -1,8 +1,53 @@
 # Description: This file contains functions for fly genetics.
 
+import hashlib
+import os
+import sys
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+from functools import lru_cache
+from itertools import product
 import requests
 import pandas as pd
 
+# maximum number of distinct genotypes kept by the canonicalization caches
+GENOTYPE_CACHE_SIZE = 4096
+
+# chromosomes of a genotype, in order (the column names of the vectorized allele columns start with these)
+CHROMOSOME_NAMES = ["X", "2", "3", "4"]
+
+# QC error messages (shared by the string and Series versions of the QC)
+NOT_A_STRING = "Genotype must be a string"
+WRONG_FORMAT = "Genotype must be in the format xchromosome; chromosome1; chromosome2"
+WRONG_CHROMOSOME_FORMAT = "Chromosomes must be in the format chromosomeA/chromosomeB (heterozygous) or chromosomeBoth (homozygous)"
+
+# genotype field -> (canonical genotype field, genotype hash field) stored on the stocks and crosses
+GENOTYPE_KEY_FIELDS = {
+    "Genotype": ("CanonicalGenotype", "GenotypeHash"),
+    "MaleGenotype": ("CanonicalMaleGenotype", "MaleGenotypeHash"),
+    "FemaleGenotype": ("CanonicalFemaleGenotype", "FemaleGenotypeHash"),
+}
+
+# genotype field -> prefix of its allele array fields (one field per chromosome, e.g. "Alleles3" or "MaleAllelesX")
+ALLELE_FIELDS = {
+    "Genotype": "Alleles",
+    "MaleGenotype": "MaleAlleles",
+    "FemaleGenotype": "FemaleAlleles",
+}
+
+# maximum number of memoized chromosome pairs of the cross predictor
+CROSS_CACHE_SIZE = 16384
+
+# batches of crosses smaller than this are predicted in the calling process (starting a process pool costs more)
+PARALLEL_CROSSES = 64
+
+# number of distinct crosses sent to a worker process at once
+CROSS_CHUNK_SIZE = 16
+
+# maximum number of crosses predicted per API request
+MAX_PREDICTED_CROSSES = 1000
+
 def refresh_bloomington_data():
     """
     Refresh the bloomington data.
@@ -21,20 +66,28 @@ def get_bloomington_data():
 def qc_genotype(genotype):
     """
     Check if the genotype is in the correct format.
+    The result is cached per genotype string and the cleaned genotype is interned, so repeated genotypes are only
+    checked once and share a single string.
     """
     if not isinstance(genotype, str):
-        return False, "Genotype must be a string"
-    
+        return False, NOT_A_STRING
+    return _qc_genotype(genotype)
+
+@lru_cache(maxsize=GENOTYPE_CACHE_SIZE)
+def _qc_genotype(genotype):
+    """
+    Check the format of a genotype string (see qc_genotype).
+    """
     # Check if the genotype is in the correct format xchromosome; chromosome1; chromosome2
     if not genotype.count(";") == 3:
-        return False, "Genotype must be in the format xchromosome; chromosome1; chromosome2"
+        return False, WRONG_FORMAT
     
     # clean the genotype
     genotype = genotype.split(";")
     genotype = [x.strip() for x in genotype]
     # make sure each chromosome is in the correct format (atmost 1 '/' symbol)
     if any([x.count("/") > 1 for x in genotype]):
-        return False, "Chromosomes must be in the format chromosomeA/chromosomeB (heterozygous) or chromosomeBoth (homozygous)"
+        return False, WRONG_CHROMOSOME_FORMAT
     
     chrs = []
     for chr in genotype:
@@ -46,7 +99,7 @@ def qc_genotype(genotype):
             chr = "/".join(chr)
         chrs.append(chr)
     
-    genotype = "; ".join(chrs)
+    genotype = sys.intern("; ".join(chrs))
 
     return True, genotype
 
@@ -67,4 +120,407 @@ def get_genetic_components(genotype):
             components.append(alleles)
         else:
             components.append([chr if chr != "" else "+", chr if chr != "" else "+"])
-    return components
\ No newline at end of file
+    return components
+
+@lru_cache(maxsize=GENOTYPE_CACHE_SIZE)
+def genotype_keys(genotype):
+    """
+    Get the canonical key of a genotype and its short hash.
+    The canonical key lists both alleles of every chromosome in alphabetical order ("+" for wild type), so all the
+    ways of writing the same genotype ("w; CyO/+; +; +", "w/w; +/CyO; +/+; +/+", ...) share the same key.
+    Parameters:
+    genotype: str
+        The genotype.
+    Returns:
+    canonical: str
+        The canonical genotype (None if the genotype fails the QC).
+    genotype_hash: str
+        The first 16 hexadecimal digits of the SHA-1 of the canonical genotype (None if the genotype fails the QC).
+    """
+    qc, genotype = qc_genotype(genotype)
+    if not qc:
+        return None, None
+    chromosomes = []
+    for chromosome in genotype.split(";"):
+        alleles = [allele.strip() or "+" for allele in chromosome.split("/")]
+        if len(alleles) == 1:
+            alleles = alleles * 2
+        chromosomes.append("/".join(sorted(alleles)))
+    canonical = sys.intern("; ".join(chromosomes))
+    return canonical, hashlib.sha1(canonical.encode()).hexdigest()[:16]
+
+def genotype_key_fields(document):
+    """
+    Get the canonical genotype and genotype hash fields of the genotype fields of a stock or cross document
+    (or of an update), e.g. {"CanonicalGenotype": ..., "GenotypeHash": ...} for a stock.
+    """
+    fields = {}
+    for field, (canonical_field, hash_field) in GENOTYPE_KEY_FIELDS.items():
+        if field in document and isinstance(document[field], str):
+            canonical, genotype_hash = genotype_keys(document[field])
+            fields[canonical_field] = canonical
+            fields[hash_field] = genotype_hash
+    return fields
+
+def allele_field(genotype_field, chromosome):
+    """
+    Get the name of the allele array field of a genotype field and chromosome (e.g. "Alleles3", "MaleAllelesX").
+    """
+    return ALLELE_FIELDS[genotype_field] + chromosome
+
+@lru_cache(maxsize=GENOTYPE_CACHE_SIZE)
+def genotype_alleles(genotype):
+    """
+    Get the distinct alleles of every chromosome of a genotype (from get_genetic_components).
+    Parameters:
+    genotype: str
+        The genotype.
+    Returns:
+    alleles: tuple
+        One sorted tuple of distinct alleles per chromosome ("+" for wild type), in the order of CHROMOSOME_NAMES:
+        a homozygous chromosome has a single allele, a heterozygous chromosome two (None if the genotype fails the QC).
+    """
+    qc, genotype = qc_genotype(genotype)
+    if not qc:
+        return None
+    return tuple(tuple(sorted(set(allele.strip() or "+" for allele in alleles)))
+                 for alleles in get_genetic_components(genotype))
+
+def genotype_allele_fields(document):
+    """
+    Get the allele array fields of the genotype fields of a stock or cross document (or of an update),
+    e.g. {"AllelesX": ["w"], "Alleles2": ["+", "CyO"], ...} for a stock (empty arrays if the genotype fails the QC).
+    """
+    fields = {}
+    for field in ALLELE_FIELDS:
+        if field in document and isinstance(document[field], str):
+            alleles = genotype_alleles(document[field]) or [()] * len(CHROMOSOME_NAMES)
+            for chromosome, chromosome_alleles in zip(CHROMOSOME_NAMES, alleles):
+                fields[allele_field(field, chromosome)] = list(chromosome_alleles)
+    return fields
+
+def get_genotype_cache_stats():
+    """
+    Get the statistics of the genotype caches of this process.
+    """
+    return {
+        "qc": _qc_genotype.cache_info()._asdict(),
+        "keys": genotype_keys.cache_info()._asdict(),
+        "alleles": genotype_alleles.cache_info()._asdict(),
+        "x_offspring": x_offspring.cache_info()._asdict(),
+        "autosome_offspring": autosome_offspring.cache_info()._asdict(),
+    }
+
+
+# Vectorized versions (a pandas Series of genotypes at once, e.g. a whole imported sheet)
+
+def _on_distinct(genotypes, function):
+    """
+    Apply a Series function to the distinct genotypes only (imports repeat the same genotypes many times)
+    and expand the result back to one row per genotype, with the original index.
+    """
+    genotypes = pd.Series(genotypes, dtype=object)
+    codes, distinct = pd.factorize(genotypes, use_na_sentinel=False)
+    result = function(pd.Series(distinct, dtype=object))
+    result = result.iloc[codes]
+    result.index = genotypes.index
+    return result
+
+def _split_chromosomes(genotypes):
+    """
+    Split a Series of genotypes into a DataFrame with one stripped column per chromosome (0 to 3).
+    """
+    chromosomes = genotypes.str.split(";", n=3, expand=True).reindex(columns=range(4)).astype(object)
+    return chromosomes.fillna("").apply(lambda chromosome: chromosome.str.strip())
+
+def _allele_columns(chromosome, strip_alleles=False):
+    """
+    Split a Series of chromosomes into its two alleles in alphabetical order ("+" for an empty allele, the same allele
+    twice for a homozygous chromosome).
+    """
+    alleles = chromosome.str.split("/", n=1, expand=True).reindex(columns=range(2))
+    heterozygous = alleles[1].notna()
+    first = alleles[0].fillna("")
+    second = alleles[1].where(heterozygous, first).fillna("")
+    if strip_alleles:
+        first, second = first.str.strip(), second.str.strip()
+    swap = second < first
+    first, second = first.where(~swap, second), second.where(~swap, first)
+    return first.replace("", "+"), second.replace("", "+")
+
+def qc_genotypes(genotypes):
+    """
+    Check and clean a whole Series of genotypes at once (same rules and results as qc_genotype).
+    Parameters:
+    genotypes: pandas.Series
+        The genotypes (any values, non-strings fail the QC).
+    Returns:
+    qc: pandas.DataFrame
+        A DataFrame with the same index and the columns "Valid" (bool), "Genotype" (the cleaned genotype, or the
+        original value if the QC failed) and "Error" (the error message, "" if valid).
+    """
+    return _on_distinct(genotypes, _qc_series)
+
+def _qc_series(genotypes):
+    """
+    Check and clean a Series of distinct genotypes (see qc_genotypes).
+    """
+    is_string = genotypes.map(lambda genotype: isinstance(genotype, str)).astype(bool)
+    text = genotypes.where(is_string, "")
+
+    error = pd.Series("", index=genotypes.index, dtype=object)
+    error[~is_string] = NOT_A_STRING
+    error[is_string & (text.str.count(";") != 3)] = WRONG_FORMAT
+
+    chromosomes = _split_chromosomes(text)
+    slashes = chromosomes.apply(lambda chromosome: chromosome.str.count("/"))
+    error[(error == "") & (slashes > 1).any(axis=1)] = WRONG_CHROMOSOME_FORMAT
+    valid = error == ""
+
+    # arrange the heterozygous chromosomes in alphabetical order
+    for column in range(4):
+        heterozygous = valid & (slashes[column] == 1)
+        if heterozygous.any():
+            alleles = chromosomes.loc[heterozygous, column].str.split("/", n=1, expand=True)
+            swap = alleles[1] < alleles[0]
+            chromosomes.loc[heterozygous, column] = alleles[0].where(~swap, alleles[1]) + "/" + alleles[1].where(~swap, alleles[0])
+
+    cleaned = chromosomes[0] + "; " + chromosomes[1] + "; " + chromosomes[2] + "; " + chromosomes[3]
+    return pd.DataFrame({"Valid": valid, "Genotype": cleaned.where(valid, genotypes), "Error": error})
+
+def genetic_components(genotypes):
+    """
+    Explode a Series of genotypes (that passed the QC) into two allele columns per chromosome
+    (same alleles as get_genetic_components).
+    Parameters:
+    genotypes: pandas.Series
+        The cleaned genotypes.
+    Returns:
+    components: pandas.DataFrame
+        A DataFrame with the same index and the columns "X_1", "X_2", "2_1", "2_2", "3_1", "3_2", "4_1" and "4_2".
+    """
+    return _on_distinct(genotypes, _components_series)
+
+def _components_series(genotypes):
+    """
+    Explode a Series of distinct cleaned genotypes into allele columns (see genetic_components).
+    """
+    chromosomes = _split_chromosomes(genotypes.fillna(""))
+    columns = {}
+    for column, name in enumerate(CHROMOSOME_NAMES):
+        columns[f"{name}_1"], columns[f"{name}_2"] = _allele_columns(chromosomes[column])
+    return pd.DataFrame(columns, index=chromosomes.index)
+
+def canonical_genotypes(genotypes, qc=None):
+    """
+    Get the canonical keys and hashes of a whole Series of genotypes (same keys as genotype_keys).
+    Parameters:
+    genotypes: pandas.Series
+        The genotypes.
+    qc: pandas.DataFrame
+        The result of qc_genotypes(genotypes), if already computed.
+    Returns:
+    keys: pandas.DataFrame
+        A DataFrame with the same index and the columns "CanonicalGenotype" and "GenotypeHash" (None if the QC failed).
+    """
+    qc = qc_genotypes(genotypes) if qc is None else qc
+    return _on_distinct(qc["Genotype"].where(qc["Valid"], None), _keys_series)
+
+def _keys_series(genotypes):
+    """
+    Get the canonical keys of a Series of distinct cleaned genotypes (None for the genotypes that failed the QC).
+    """
+    valid = genotypes.notna()
+    chromosomes = _split_chromosomes(genotypes.where(valid, ""))
+    canonical = None
+    for column in range(4):
+        first, second = _allele_columns(chromosomes[column], strip_alleles=True)
+        chromosome = first + "/" + second
+        canonical = chromosome if canonical is None else canonical + "; " + chromosome
+
+    # the hashes are computed once per distinct genotype
+    hashes = {key: hashlib.sha1(key.encode()).hexdigest()[:16] for key in canonical[valid].unique()}
+    keys = pd.DataFrame({"CanonicalGenotype": canonical, "GenotypeHash": canonical.map(hashes)}, dtype=object)
+    keys[~valid] = None
+    return keys
+
+def allele_arrays(genotypes, qc=None):
+    """
+    Get the allele arrays of a whole Series of genotypes (same alleles as genotype_alleles).
+    Parameters:
+    genotypes: pandas.Series
+        The genotypes.
+    qc: pandas.DataFrame
+        The result of qc_genotypes(genotypes), if already computed.
+    Returns:
+    alleles: pandas.DataFrame
+        A DataFrame with the same index and one column of lists of distinct alleles per chromosome ("X", "2", "3" and
+        "4"), empty lists if the QC failed.
+    """
+    qc = qc_genotypes(genotypes) if qc is None else qc
+    return _on_distinct(qc["Genotype"].where(qc["Valid"], None), _alleles_series)
+
+def _alleles_series(genotypes):
+    """
+    Get the allele arrays of a Series of distinct cleaned genotypes (see allele_arrays).
+    """
+    valid = genotypes.notna()
+    components = _components_series(genotypes.where(valid, ""))
+    columns = {}
+    for name in CHROMOSOME_NAMES:
+        first = components[f"{name}_1"].astype(object).str.strip().replace("", "+")
+        second = components[f"{name}_2"].astype(object).str.strip().replace("", "+")
+        columns[name] = [sorted({a, b}) if ok else [] for a, b, ok in zip(first, second, valid)]
+    return pd.DataFrame(columns, index=genotypes.index)
+
+def genotype_errors(genotypes, qc=None):
+    """
+    Get the row-level report of the genotypes that fail the QC.
+    Parameters:
+    genotypes: pandas.Series
+        The genotypes.
+    qc: pandas.DataFrame
+        The result of qc_genotypes(genotypes), if already computed.
+    Returns:
+    errors: list
+        A list of {"row": index, "genotype": value, "error": message}.
+    """
+    qc = qc_genotypes(genotypes) if qc is None else qc
+    failed = qc[~qc["Valid"]]
+    return [{"row": row, "genotype": genotype, "error": error}
+            for row, genotype, error in zip(failed.index, pd.Series(genotypes)[failed.index], failed["Error"])]
+
+
+# Cross outcome prediction (Mendelian segregation of the four chromosomes, the X being sex-linked)
+
+def _format_chromosome(alleles):
+    """
+    Write a chromosome from its alleles like the QC does ("a/b" in alphabetical order, a single allele if homozygous
+    or hemizygous).
+    """
+    alleles = sorted(set(alleles))
+    return "/".join(alleles)
+
+@lru_cache(maxsize=CROSS_CACHE_SIZE)
+def autosome_offspring(female, male):
+    """
+    Get the offspring classes of an autosome from the alleles of the female and male parents.
+    Returns a tuple of (chromosome, probability) in alphabetical order.
+    """
+    classes = defaultdict(Fraction)
+    for female_allele, male_allele in product(female, male):
+        classes[_format_chromosome((female_allele, male_allele))] += Fraction(1, 4)
+    return tuple(sorted(classes.items()))
+
+@lru_cache(maxsize=CROSS_CACHE_SIZE)
+def x_offspring(female, male):
+    """
+    Get the offspring classes of the X chromosome: daughters get one X of the mother and the X of the father, sons
+    get one X of the mother (and the Y of the father).
+    Returns a tuple of (sex, chromosome, probability within the sex) in order.
+    """
+    male_x = sorted(set(allele for allele in male if allele != "Y"))
+    if len(male_x) != 1:
+        raise ValueError("The X chromosome of the male must be hemizygous (e.g. w or w/Y)")
+    classes = defaultdict(Fraction)
+    for female_allele in female:
+        classes[("female", _format_chromosome((female_allele, male_x[0])))] += Fraction(1, 2)
+        classes[("male", _format_chromosome((female_allele,)))] += Fraction(1, 2)
+    return tuple((sex, chromosome, probability) for (sex, chromosome), probability in sorted(classes.items()))
+
+def _parent_components(genotype, parent):
+    """
+    Get the alleles of every chromosome of a parent (as tuples), after the QC.
+    """
+    qc, cleaned = qc_genotype(genotype)
+    if not qc:
+        raise ValueError(f"{parent} genotype: {cleaned}")
+    return [tuple(allele.strip() or "+" for allele in alleles) for alleles in get_genetic_components(cleaned)]
+
+def predict_cross(female_genotype, male_genotype, lethal=()):
+    """
+    Predict the offspring classes of a cross, by enumerating the Mendelian segregation of every chromosome
+    (memoized per chromosome pair) and combining the four chromosomes.
+    Parameters:
+    female_genotype: str
+        The genotype of the female parent.
+    male_genotype: str
+        The genotype of the male parent (its X is hemizygous, written "w" or "w/Y").
+    lethal: iterable
+        Alleles that are lethal when homozygous (e.g. balancers such as "CyO" or "TM3"); the offspring carrying two
+        copies are removed and the frequencies of the other classes are rescaled.
+    Returns:
+    classes: list
+        The offspring classes as {"Sex": "female"/"male", "Genotype": ..., "Frequency": float, "Fraction": "1/8"},
+        most frequent first.
+    Raises:
+    ValueError
+        If a genotype fails the QC or the male X is not hemizygous.
+    """
+    female = _parent_components(female_genotype, "Female")
+    male = _parent_components(male_genotype, "Male")
+    lethal = set(lethal)
+
+    x_classes = x_offspring(female[0], male[0])
+    autosomes = [autosome_offspring(female_chromosome, male_chromosome)
+                 for female_chromosome, male_chromosome in zip(female[1:], male[1:])]
+
+    def viable(chromosome):
+        return not (lethal and "/" not in chromosome and chromosome in lethal)
+
+    classes = []
+    for sex, x_chromosome, x_probability in x_classes:
+        # sons carry a single X, lethality only applies to the homozygous daughters
+        if sex == "female" and not viable(x_chromosome):
+            continue
+        for combination in product(*autosomes):
+            if not all(viable(chromosome) for chromosome, _ in combination):
+                continue
+            probability = Fraction(1, 2) * x_probability
+            for _, chromosome_probability in combination:
+                probability *= chromosome_probability
+            genotype = "; ".join([x_chromosome] + [chromosome for chromosome, _ in combination])
+            classes.append((sex, genotype, probability))
+
+    total = sum(probability for _, _, probability in classes)
+    classes.sort(key=lambda offspring: (-offspring[2], offspring[0], offspring[1]))
+    return [{"Sex": sex, "Genotype": genotype, "Frequency": float(probability / total),
+             "Fraction": str(probability / total)}
+            for sex, genotype, probability in classes]
+
+def _predict_or_error(cross):
+    """
+    Predict a (female genotype, male genotype, lethal) cross, returning the error message instead of raising
+    (used by the worker processes of predict_crosses).
+    """
+    female_genotype, male_genotype, lethal = cross
+    try:
+        return {"Offspring": predict_cross(female_genotype, male_genotype, lethal)}
+    except ValueError as e:
+        return {"Error": str(e)}
+
+def predict_crosses(crosses, lethal=(), processes=None):
+    """
+    Predict the offspring classes of many crosses. Every distinct cross is predicted once, on a process pool
+    for large batches.
+    Parameters:
+    crosses: list
+        The crosses as (female genotype, male genotype) pairs (strings, or None for a missing parent).
+    lethal: iterable
+        Alleles that are lethal when homozygous (see predict_cross).
+    processes: int
+        The number of worker processes (the number of CPUs if None, 1 to predict in the calling process).
+    Returns:
+    results: list
+        One result per cross, in order: {"Offspring": [...]} (see predict_cross) or {"Error": message}.
+    """
+    lethal = tuple(sorted(set(lethal)))
+    distinct = list(dict.fromkeys((female, male, lethal) for female, male in crosses))
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(distinct) < PARALLEL_CROSSES:
+        predictions = [_predict_or_error(cross) for cross in distinct]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            predictions = list(executor.map(_predict_or_error, distinct, chunksize=CROSS_CHUNK_SIZE))
+    predictions = dict(zip(distinct, predictions))
+    return [dict(predictions[(female, male, lethal)]) for female, male in crosses]
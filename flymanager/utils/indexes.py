@@ -0,0 +1,252 @@
+# Description: This file contains the index definitions for the MongoDB collections and functions to provision and audit them.
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from flymanager.utils.genetics import CHROMOSOME_NAMES, allele_field
+
+# error codes returned by MongoDB when an index with the same name/keys already exists with different options
+INDEX_CONFLICT_CODES = (85, 86)
+
+# error codes returned by MongoDB when a unique index cannot be built because of duplicate values
+DUPLICATE_KEY_CODES = (11000, 11001)
+
+# maximum number of duplicate values reported per unique index
+MAX_REPORTED_DUPLICATES = 20
+
+METADATA_COLLECTIONS = ["types", "food_types", "provenances", "genesX", "genes2nd", "genes3rd", "genes4th"]
+
+# collation used to sort trays and tray positions in natural order ("2" before "10");
+# queries must use the same collation to be able to use the tray indexes
+TRAY_COLLATION = {"locale": "en", "numericOrdering": True}
+
+# Index definitions for every collection touched by flymanager.utils.mongo
+# Each entry is (name, keys, options)
+INDEXES = {
+    "stocks": [
+        ("UniqueID_unique", [("UniqueID", ASCENDING)], {"unique": True}),
+        ("User_UniqueID", [("User", ASCENDING), ("UniqueID", ASCENDING)], {}),
+        ("User_TrayID_TrayPosition_UniqueID_LastFlipDate",
+         [("User", ASCENDING), ("TrayID", ASCENDING), ("TrayPosition", ASCENDING), ("UniqueID", ASCENDING),
+          ("LastFlipDate", ASCENDING)],
+         {"collation": TRAY_COLLATION}),
+        ("User_Genotype", [("User", ASCENDING), ("Genotype", ASCENDING)], {}),
+        ("User_GenotypeHash", [("User", ASCENDING), ("GenotypeHash", ASCENDING)], {}),
+    ],
+    "crosses": [
+        ("UniqueID_unique", [("UniqueID", ASCENDING)], {"unique": True}),
+        ("User_UniqueID", [("User", ASCENDING), ("UniqueID", ASCENDING)], {}),
+        ("User_TrayID_TrayPosition_UniqueID_LastFlipDate",
+         [("User", ASCENDING), ("TrayID", ASCENDING), ("TrayPosition", ASCENDING), ("UniqueID", ASCENDING),
+          ("LastFlipDate", ASCENDING)],
+         {"collation": TRAY_COLLATION}),
+        ("User_MaleGenotypeHash", [("User", ASCENDING), ("MaleGenotypeHash", ASCENDING)], {}),
+        ("User_FemaleGenotypeHash", [("User", ASCENDING), ("FemaleGenotypeHash", ASCENDING)], {}),
+    ],
+    "activity": [
+        ("user_timestamp_id", [("user", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], {}),
+    ],
+    "users": [
+        ("Username_unique", [("Username", ASCENDING)], {"unique": True}),
+    ],
+    "events": [
+        ("UniqueID_ts", [("UniqueID", ASCENDING), ("ts", ASCENDING)], {}),
+    ],
+    "snapshots": [
+        ("UniqueID_ts", [("UniqueID", ASCENDING), ("ts", DESCENDING)], {}),
+    ],
+    "search_index": [
+        ("User_Kind_Grams", [("User", ASCENDING), ("Kind", ASCENDING), ("Grams", ASCENDING)], {}),
+    ],
+    "flip_log_overflow": [
+        ("UniqueID_FlipDate", [("UniqueID", ASCENDING), ("FlipDate", DESCENDING)], {}),
+    ],
+}
+for metadata_collection in METADATA_COLLECTIONS:
+    # not unique: existing deployments and uploaded spreadsheets may hold duplicate values
+    # (add_metadata checks for an existing value, served by this index)
+    INDEXES[metadata_collection] = [("Value", [("Value", ASCENDING)], {})]
+
+# multikey indexes on the allele arrays of every chromosome (a compound index can only hold one array field)
+ALLELE_INDEX_FIELDS = {"stocks": ["Genotype"], "crosses": ["MaleGenotype", "FemaleGenotype"]}
+for collection_name, genotype_fields in ALLELE_INDEX_FIELDS.items():
+    for genotype_field in genotype_fields:
+        for chromosome in CHROMOSOME_NAMES:
+            field = allele_field(genotype_field, chromosome)
+            INDEXES[collection_name].append((f"User_{field}", [("User", ASCENDING), (field, ASCENDING)], {}))
+
+# indexes that were replaced by a newer definition and are dropped by ensure_indexes
+RETIRED_INDEXES = {
+    "stocks": ["User_TrayID_TrayPosition", "User_TrayID_TrayPosition_UniqueID"],
+    "crosses": ["User_TrayID_TrayPosition", "User_TrayID_TrayPosition_UniqueID"],
+    "activity": ["user_timestamp"],
+}
+for metadata_collection in METADATA_COLLECTIONS:
+    RETIRED_INDEXES[metadata_collection] = ["Value_unique"]
+
+
+def ensure_indexes(db):
+    """
+    Create all the declared indexes in the MongoDB database (safe to call on every startup).
+    Retired indexes are dropped first; if an index exists with the same name but a different definition, it is dropped
+    and recreated. A unique index that cannot be built because of duplicate values in existing data is skipped (the
+    duplicates are printed and listed by index_report), so that the app can still start.
+    Parameters:
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    Returns:
+    created: dict
+        A dictionary of {collection: [index names]} that were provisioned.
+    """
+    # drop the indexes that have been replaced first (a replacement may use the same keys under a new name)
+    existing_collections = set(db.list_collection_names())
+    for collection_name, names in RETIRED_INDEXES.items():
+        if collection_name not in existing_collections:
+            continue
+        existing = db[collection_name].index_information()
+        for name in names:
+            if name in existing:
+                db[collection_name].drop_index(name)
+
+    created = {}
+    for collection_name, indexes in INDEXES.items():
+        collection = db[collection_name]
+        models = [IndexModel(keys, name=name, **options) for name, keys, options in indexes]
+        try:
+            created[collection_name] = collection.create_indexes(models)
+            continue
+        except OperationFailure as e:
+            if e.code not in INDEX_CONFLICT_CODES + DUPLICATE_KEY_CODES:
+                raise
+            if e.code in INDEX_CONFLICT_CODES:
+                # an outdated definition is in the way, drop it
+                existing = collection.index_information()
+                for name, keys, options in indexes:
+                    if name in existing and not _same_definition(existing[name], keys, options):
+                        collection.drop_index(name)
+
+        # build the indexes one by one, so that a unique index blocked by duplicates does not block the others
+        created[collection_name] = []
+        for model, (name, keys, options) in zip(models, indexes):
+            try:
+                created[collection_name] += collection.create_indexes([model])
+            except OperationFailure as e:
+                if e.code not in DUPLICATE_KEY_CODES:
+                    raise
+                duplicates = duplicate_values(collection, keys)
+                print(f"Index {collection_name}.{name} not created, duplicate values: "
+                      f"{', '.join(str(value) for value in duplicates)} (see scripts/manage_indexes.py)")
+    return created
+
+
+def duplicate_values(collection, keys, limit=MAX_REPORTED_DUPLICATES):
+    """
+    Get the values of the index keys that are held by more than one document (which block a unique index).
+    Parameters:
+    collection: pymongo.collection.Collection
+        The MongoDB collection.
+    keys: list
+        The keys of the index, as (field, direction) pairs.
+    limit: int
+        The maximum number of values.
+    Returns:
+    values: list
+        The duplicate values (dictionaries of {field: value} for compound keys).
+    """
+    fields = [field for field, _ in keys]
+    pipeline = [
+        {"$group": {"_id": {field.replace(".", "_"): "$" + field for field in fields}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+        {"$sort": {"_id": 1}},
+        {"$limit": limit},
+    ]
+    groups = collection.aggregate(pipeline, allowDiskUse=True)
+    return [next(iter(group["_id"].values())) if len(fields) == 1 else group["_id"] for group in groups]
+
+
+def _same_definition(info, keys, options):
+    """
+    Check if an existing index (from index_information) matches a declared definition.
+    """
+    if [tuple(k) for k in info["key"]] != [tuple(k) for k in keys]:
+        return False
+    for option, value in options.items():
+        # the server fills in the defaults of sub-documents such as the collation
+        if isinstance(value, dict):
+            if any(info.get(option, {}).get(k) != v for k, v in value.items()):
+                return False
+        elif info.get(option) != value:
+            return False
+    return True
+
+
+def _is_prefix(keys, other_keys):
+    """
+    Check if the index keys are a strict prefix of another index's keys.
+    """
+    return len(keys) < len(other_keys) and other_keys[:len(keys)] == keys
+
+
+def index_report(db):
+    """
+    Audit the indexes in the MongoDB database against the declared indexes.
+    Parameters:
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    Returns:
+    report: dict
+        A dictionary of {collection: {"missing": [...], "undeclared": [...], "redundant": [...], "unused": [...],
+        "duplicates": [...]}} where redundant indexes are non-unique indexes whose keys are a prefix of another index,
+        unused indexes have not been accessed since the server started (according to $indexStats) and duplicates
+        lists the missing unique indexes blocked by duplicate values, with these values.
+    """
+    report = {}
+    existing_collections = set(db.list_collection_names())
+    for collection_name in sorted(set(INDEXES) | existing_collections):
+        collection = db[collection_name]
+        declared = {name: [tuple(k) for k in keys] for name, keys, _ in INDEXES.get(collection_name, [])}
+        existing = collection.index_information() if collection_name in existing_collections else {}
+        existing_keys = {name: [tuple(k) for k in info["key"]] for name, info in existing.items()}
+
+        # declared indexes that are not present (by key pattern)
+        missing = [name for name, keys in declared.items() if keys not in existing_keys.values()]
+
+        # missing unique indexes that cannot be built because of duplicate values
+        duplicates = []
+        if collection_name in existing_collections:
+            for name, keys, options in INDEXES.get(collection_name, []):
+                if name in missing and options.get("unique"):
+                    values = duplicate_values(collection, keys)
+                    if values:
+                        duplicates.append(f"{name} ({', '.join(str(value) for value in values)})")
+
+        # indexes present on the server that are not declared (ignoring the default _id index)
+        undeclared = [name for name, keys in existing_keys.items()
+                      if name != "_id_" and keys not in declared.values()]
+
+        # non-unique indexes that are covered by a longer index with the same prefix
+        redundant = []
+        for name, keys in existing_keys.items():
+            if name == "_id_" or existing[name].get("unique"):
+                continue
+            if any(_is_prefix(keys, other_keys) for other_keys in existing_keys.values()):
+                redundant.append(name)
+
+        # indexes that have never been used since the server started
+        unused = []
+        if existing:
+            try:
+                for stats in collection.aggregate([{"$indexStats": {}}]):
+                    if stats["name"] != "_id_" and stats["accesses"]["ops"] == 0:
+                        unused.append(stats["name"])
+            except OperationFailure:
+                # $indexStats requires the indexStats privilege
+                unused = None
+
+        report[collection_name] = {
+            "missing": missing,
+            "undeclared": undeclared,
+            "redundant": redundant,
+            "unused": unused,
+            "duplicates": duplicates,
+        }
+    return report
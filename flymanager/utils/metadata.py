@@ -0,0 +1,127 @@
+# Description: This file contains the versioned in-process cache of the metadata lists (types, food types, provenances and genes).
+
+import threading
+import time
+import uuid
+from flymanager.utils.indexes import METADATA_COLLECTIONS
+
+# collection holding the version stamp of the metadata (a single document)
+VERSION_COLLECTION = "metadata_version"
+VERSION_ID = "metadata"
+
+# minimum number of seconds between two version checks against the database
+VERSION_CHECK_INTERVAL = 2.0
+
+# cached metadata lists and their version (shared by all threads of the process)
+_cache_lock = threading.Lock()
+_cache = {
+    "version": None,
+    "lists": None,
+    "checked_at": 0.0,
+}
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "version_checks": 0,
+}
+
+
+def get_metadata_version(db):
+    """
+    Get the current version stamp of the metadata (None if the metadata has never been versioned).
+    """
+    document = db[VERSION_COLLECTION].find_one({"_id": VERSION_ID})
+    return document["Version"] if document else None
+
+
+def bump_metadata_version(db):
+    """
+    Stamp the metadata with a new version (must be called after every change to a metadata collection).
+    Parameters:
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    Returns:
+    version: str
+        The new version stamp.
+    """
+    version = uuid.uuid4().hex
+    db[VERSION_COLLECTION].update_one({"_id": VERSION_ID}, {"$set": {"Version": version}}, upsert=True)
+    invalidate_metadata()
+    return version
+
+
+def load_all_metadata(db):
+    """
+    Load all the metadata lists from the MongoDB database in a single aggregation.
+    Parameters:
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    Returns:
+    lists: dict
+        A dictionary of {metadata type: list of values}.
+    """
+    def tagged(metadata_type):
+        return [{"$project": {"_id": 0, "Type": {"$literal": metadata_type}, "Value": 1}}]
+
+    first, *others = METADATA_COLLECTIONS
+    pipeline = tagged(first) + [{"$unionWith": {"coll": other, "pipeline": tagged(other)}} for other in others]
+    lists = {metadata_type: [] for metadata_type in METADATA_COLLECTIONS}
+    for document in db[first].aggregate(pipeline):
+        lists[document["Type"]].append(document["Value"])
+    return lists
+
+
+def get_all_metadata(db):
+    """
+    Get all the metadata lists, served from memory as long as the version stamp has not changed.
+    The version stamp is checked at most once every VERSION_CHECK_INTERVAL seconds.
+    Parameters:
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    Returns:
+    lists: dict
+        A dictionary of {metadata type: list of values} (shared, do not modify).
+    """
+    now = time.monotonic()
+    with _cache_lock:
+        if _cache["lists"] is not None and now - _cache["checked_at"] < VERSION_CHECK_INTERVAL:
+            _stats["hits"] += 1
+            return _cache["lists"]
+
+    # check the version stamp before loading, so a concurrent change forces a reload on the next check
+    version = get_metadata_version(db)
+    with _cache_lock:
+        _stats["version_checks"] += 1
+        if _cache["lists"] is not None and _cache["version"] == version:
+            _cache["checked_at"] = now
+            _stats["hits"] += 1
+            return _cache["lists"]
+
+    lists = load_all_metadata(db)
+    with _cache_lock:
+        _stats["misses"] += 1
+        _cache.update(version=version, lists=lists, checked_at=now)
+    return lists
+
+
+def invalidate_metadata():
+    """
+    Drop the cached metadata lists of this process.
+    """
+    with _cache_lock:
+        _cache.update(version=None, lists=None, checked_at=0.0)
+
+
+def get_metadata_cache_stats():
+    """
+    Get the metadata cache statistics of this process.
+    Returns:
+    stats: dict
+        The number of hits, misses and version checks, the hit rate and the cached version.
+    """
+    with _cache_lock:
+        stats = dict(_stats)
+        stats["version"] = _cache["version"]
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
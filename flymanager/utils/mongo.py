@@ -1,17 +1,32 @@
 import os
-from pymongo import MongoClient
+from pymongo import ReturnDocument, UpdateMany
+from pymongo.errors import BulkWriteError
 from dotenv import load_dotenv
 import datetime
-from hashlib import shake_256
-from flymanager.utils.genetics import qc_genotype
+import pandas as pd
+from flymanager.utils.genetics import qc_genotype, genotype_keys, genotype_key_fields, genotype_allele_fields, GENOTYPE_KEY_FIELDS, \
+    qc_genotypes, canonical_genotypes, allele_arrays, allele_field
+from flymanager.utils.indexes import ensure_indexes
+from flymanager.utils.fliplog import flip_log_update, spill_flip_log, parse_timestamp
+from flymanager.utils.events import make_event, record_events, maybe_snapshot
+from flymanager.utils.uids import allocate_uid, allocate_uids, release_uids
+from flymanager.utils.explorer import invalidate_facets
+from flymanager.utils.search import index_documents, remove_documents
+from flymanager.utils.metadata import get_all_metadata, bump_metadata_version
+from flymanager.utils.users import get_user, get_initials, hash_password, invalidate_directory
+from flymanager.utils.activity import get_activity_writer, get_activity_feed
+from flymanager.utils.connection import new_client
+from flymanager.utils.versions import bump_data_version
+from flymanager.utils.typeahead import invalidate_typeahead
+from flymanager.utils.planner import invalidate_stock_index
 
 
 # Load environment variables from .env file
 load_dotenv()
 
 def create_mongo_client():
-    mongo_uri = os.getenv("MONGO_URI")
-    client = MongoClient(mongo_uri)
+    # the pool, timeout and compressor settings are read from the environment (see flymanager.utils.connection)
+    client = new_client()
     return client
 
 def get_database(client):
@@ -36,12 +51,15 @@ def reset_database(db):
     db.create_collection("genes3rd")
     db.create_collection("genes4th")
 
+    # Create the indexes
+    ensure_indexes(db)
+
 
 # Authentication and User Management
 
 def write_activity(user, activity, db):
     """
-    Write an activity to the MongoDB collection.
+    Write an activity to the MongoDB collection (queued and written in batches by the activity writer).
     Parameters:
     user: str
         the username of the user
@@ -50,8 +68,8 @@ def write_activity(user, activity, db):
     db: pymongo.database.Database
         the database instance for MongoDB
     """
-    # get timestamp
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # get timestamp (stored as a native datetime, to the second)
+    timestamp = datetime.datetime.now().replace(microsecond=0)
     
     # create the activity document
     activity_document = {
@@ -60,8 +78,8 @@ def write_activity(user, activity, db):
         "activity": activity
     }
     
-    # insert the document into the activities collection
-    db.activity.insert_one(activity_document)
+    # queue the document for the activities collection
+    get_activity_writer(db).write(activity_document)
 
 def add_user(user, password, initials, db):
     """
@@ -82,11 +100,11 @@ def add_user(user, password, initials, db):
     users_collection = db['users']
     
     # Check if the user already exists
-    if users_collection.find_one({"Username": user}):
+    if get_user(user, db):
         return False
     
     # Hash the password
-    hashed_password = shake_256((user + password).encode()).hexdigest(5)
+    hashed_password = hash_password(user, password)
     
     # Add the user document to the collection
     user_document = {
@@ -96,6 +114,7 @@ def add_user(user, password, initials, db):
     }
     
     users_collection.insert_one(user_document)
+    invalidate_directory()
     
     # Log the activity
     write_activity(user, "User added", db)
@@ -143,13 +162,14 @@ def change_password(user, new_password, db):
     users_collection = db['users']
     
     # Hash the new password
-    hashed_password = shake_256((user + new_password).encode()).hexdigest(5)
+    hashed_password = hash_password(user, new_password)
     
     # Update the user document in the collection
     result = users_collection.update_one(
         {"Username": user},
         {"$set": {"Password": hashed_password}}
     )
+    invalidate_directory()
     
     # Log the activity
     write_activity(user, "Password changed", db)
@@ -186,15 +206,8 @@ def get_user_initials(user, db):
     initials: str
         the initials of the user
     """
-    users_collection = db['users']
-    
-    # Find the user document by username
-    user_document = users_collection.find_one({"Username": user})
-    
-    if user_document:
-        return user_document.get("Initials")
-    else:
-        return None
+    # Look up the user in the cached user directory
+    return get_initials(user, db)
 
 def get_user_crosses(user, db):
     """
@@ -212,24 +225,24 @@ def get_user_crosses(user, db):
     filtered_crosses = crosses_collection.find({"User": user})
     return list(filtered_crosses)
 
-def get_user_activities(user, db):
+def get_user_activities(user, db, limit=5):
     """
-    Retrieve the user's activities from the MongoDB database.
+    Retrieve the user's most recent activities from the MongoDB database.
     
     Parameters:
     user: str
         The username of the user.
     db: pymongo.database.Database
         The MongoDB database instance.
+    limit: int
+        The maximum number of activities to return.
     
     Returns:
     list
-        A list of dictionaries representing the user's activities.
+        A list of dictionaries representing the user's activities (most recent first).
     """
-    activities_collection = db["activity"]
-    
-    # Find all activities where the 'username' field matches the given user
-    user_activities = list(activities_collection.find({"username": user}))
+    # Read the first page of the activity feed (served by the user/timestamp index)
+    user_activities, _ = get_activity_feed(user, db, limit=limit)
     
     return user_activities
 
@@ -247,20 +260,78 @@ def get_all_genotypes(user, db):
     genotypes: list
         A list of all the unique genotypes.
     """
-    stocks_collection = db["stocks"]
+    # distinct genotypes of the user's stocks (served by the (User, Genotype) index)
+    genotypes = db["stocks"].distinct("Genotype", {"User": user})
     
-    # Find all the stocks and crosses of the user
-    user_stocks = stocks_collection.find({"User": user})
+    return genotypes
+
+# Stock and Cross Management
+
+def get_stocks_by_genotype(user, genotype, db, projection=None):
+    """
+    Get the user's stocks with a genotype, however it is written (indexed equality match on the genotype hash).
     
-    # Extract the genotypes from the stocks and crosses
-    stock_genotypes = [stock["Genotype"] for stock in user_stocks]
+    Parameters:
+    user: str
+        The username of the user.
+    genotype: str
+        The genotype.
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    projection: dict
+        The projection of the returned stocks.
+
+    Returns:
+    stocks: list
+        The stocks with the same canonical genotype (none if the genotype fails the QC).
+    """
+    canonical, genotype_hash = genotype_keys(genotype)
+    if canonical is None:
+        return []
+    query = {"User": user, "GenotypeHash": genotype_hash, "CanonicalGenotype": canonical}
+    return list(db["stocks"].find(query, projection))
+
+def backfill_genotype_keys(db):
+    """
+    Store the canonical genotype keys and the allele arrays on all the stocks and crosses (one update per distinct genotype).
     
-    # Remove duplicates and sort the genotypes
-    genotypes = list(set(stock_genotypes))
+    Parameters:
+    db: pymongo.database.Database
+        The MongoDB database instance.
+
+    Returns:
+    updated: dict
+        The number of updated documents per collection.
+    """
+    updated = {}
+    for collection_name in ["stocks", "crosses"]:
+        operations = []
+        for field in GENOTYPE_KEY_FIELDS:
+            for genotype in db[collection_name].distinct(field):
+                keys = genotype_key_fields({field: genotype})
+                keys.update(genotype_allele_fields({field: genotype}))
+                if keys:
+                    operations.append(UpdateMany({field: genotype}, {"$set": keys}))
+        updated[collection_name] = db[collection_name].bulk_write(operations, ordered=False).modified_count if operations else 0
+    return updated
+
+def _user_data_changed(user, db):
+    """
+    Bump the user's data version and invalidate everything derived from the user's stocks and crosses
+    (called by every stock/cross mutator).
     
-    return genotypes
+    Parameters:
+    user: str
+        The username of the user.
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    """
+    bump_data_version(user, db)
+    invalidate_facets(user)
+    invalidate_typeahead(user)
+    invalidate_stock_index(user)
 
-# Stock and Cross Management
+STOCK_REQUIRED_FIELDS = ["SourceID", "Genotype", "Name", "Type", "SeriesID", "ReplicateID", "Status"]
 
 def uid_exists(uid, db):
     """
@@ -318,13 +389,8 @@ def add_to_stock(user, properties, db):
         The unique identifier of the stock.
     """
 
-    assert "SourceID" in properties, "SourceID is required"
-    assert "Genotype" in properties, "Genotype is required"
-    assert "Name" in properties, "Name is required"
-    assert "Type" in properties, "Type is required"
-    assert "SeriesID" in properties, "SeriesID is required"
-    assert "ReplicateID" in properties, "ReplicateID is required"
-    assert "Status" in properties, "Status is required"
+    for field in STOCK_REQUIRED_FIELDS:
+        assert field in properties, f"{field} is required"
 
     # make sure genotype meets the qc
     qc, genotype = qc_genotype(properties["Genotype"])
@@ -332,20 +398,50 @@ def add_to_stock(user, properties, db):
     if not qc:
         return False, genotype
 
-    # create UniqueID as a hash of the (User + Genotype + SeriesID + ReplicateID)
+    # create UniqueID as a hash of the (User + Genotype + SeriesID + ReplicateID), unique across all users
     uid = str(user) + str(properties["Genotype"]) + str(properties["SeriesID"]) + str(properties["ReplicateID"])
-    uid = shake_256(uid.encode()).hexdigest(5)
+    uid = allocate_uid(uid, "stock", db)
+    
+    # create the document to insert
+    stock_document = _stock_document(user, uid, properties, genotype, datetime.datetime.now())
+
+    # insert the document into the MongoDB collection
+    stocks_collection = db["stocks"]
+    stocks_collection.insert_one(stock_document)
 
-    # make sure the UniqueID is unique across all users
-    while uid_exists(uid, db):
-        print("UniqueID already exists, generating a new one")
-        uid = shake_256(uid.encode()).hexdigest(5)
+    # record the creation in the event store
+    record_events([make_event("stock", uid, user, "create", stock_document)], db)
+    index_documents([stock_document], "stocks", db)
+    _user_data_changed(user, db)
     
-    # get creation timestamp
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return True, uid
 
-    # create the document to insert
-    stock_document = {
+def _stock_document(user, uid, properties, genotype, now, genotype_fields=None):
+    """
+    Create a new stock document.
+    
+    Parameters:
+    user: str
+        The username of the user.
+    uid: str
+        The allocated unique identifier of the stock.
+    properties: dict
+        The properties of the stock (see add_to_stock).
+    genotype: str
+        The genotype after QC.
+    now: datetime.datetime
+        The creation time.
+    genotype_fields: dict
+        The canonical genotype, genotype hash and allele array fields, if already computed.
+    
+    Returns:
+    stock_document: dict
+        The document to insert.
+    """
+    timestamp = now.replace(microsecond=0)
+    if genotype_fields is None:
+        genotype_fields = {**genotype_key_fields({"Genotype": genotype}), **genotype_allele_fields({"Genotype": genotype})}
+    return {
         "UniqueID": uid,
         "User": user,
         "SourceID": properties["SourceID"],
@@ -363,16 +459,91 @@ def add_to_stock(user, properties, db):
         "Comments": properties.get("Comments", ""),
         "CreationDate": timestamp,
         "LastFlipDate": timestamp,
-        "FlipLog": timestamp,
+        "FlipLog": [timestamp],
         "DataModifiedDate": timestamp,
-        "ModificationLog": f"{timestamp} : Stock created"
+        "EventCount": 1,
+        **genotype_fields
     }
 
-    # insert the document into the MongoDB collection
-    stocks_collection = db["stocks"]
-    stocks_collection.insert_one(stock_document)
+def add_stocks_bulk(user, rows, db):
+    """
+    Add many stocks to the user's stock collection in MongoDB at once.
+    All rows are validated first, the UniqueIDs are allocated in one block and
+    the valid stocks are inserted with a single unordered insert_many.
     
-    return True, uid
+    Parameters:
+    user: str
+        The username of the user.
+    rows: list
+        A list of dictionaries with the properties of each stock (see add_to_stock).
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    
+    Returns:
+    report: list
+        A list with one dictionary per row: {"row": index, "success": bool, "uid": str} on success
+        or {"row": index, "success": False, "error": str} on failure.
+    """
+    report = [{"row": i, "success": False} for i in range(len(rows))]
+    if not rows:
+        return report
+
+    # check, canonicalize and split the genotypes of all the rows at once (once per distinct genotype)
+    genotypes = pd.Series([properties.get("Genotype") for properties in rows], dtype=object)
+    qc = qc_genotypes(genotypes)
+    keys = canonical_genotypes(genotypes, qc)
+    alleles = allele_arrays(genotypes, qc)
+
+    # validate all the rows
+    valid = []
+    for i, properties in enumerate(rows):
+        missing = [field for field in STOCK_REQUIRED_FIELDS if not properties.get(field)]
+        if missing:
+            report[i]["error"] = f"{', '.join(missing)} required"
+            continue
+        if not qc["Valid"].iat[i]:
+            report[i]["error"] = qc["Error"].iat[i]
+            continue
+        genotype_fields = {field: keys[field].iat[i] for field in keys.columns}
+        genotype_fields.update({allele_field("Genotype", chromosome): list(alleles[chromosome].iat[i])
+                                for chromosome in alleles.columns})
+        valid.append((i, properties, qc["Genotype"].iat[i], genotype_fields))
+
+    if not valid:
+        return report
+
+    # allocate the UniqueIDs in one block
+    seeds = [str(user) + str(properties["Genotype"]) + str(properties["SeriesID"]) + str(properties["ReplicateID"])
+             for _, properties, _, _ in valid]
+    uids = allocate_uids(seeds, "stock", db)
+
+    # insert all the documents at once
+    now = datetime.datetime.now()
+    stock_documents = [_stock_document(user, uid, properties, genotype, now, genotype_fields)
+                       for uid, (_, properties, genotype, genotype_fields) in zip(uids, valid)]
+    failed = {}
+    try:
+        db["stocks"].insert_many(stock_documents, ordered=False)
+    except BulkWriteError as e:
+        failed = {error["index"]: error["errmsg"] for error in e.details["writeErrors"]}
+        release_uids([uids[index] for index in failed], db)
+
+    # report the outcome and record the creations in the event store
+    events = []
+    inserted = []
+    for index, ((i, _, _, _), document) in enumerate(zip(valid, stock_documents)):
+        if index in failed:
+            report[i]["error"] = failed[index]
+            continue
+        report[i]["success"] = True
+        report[i]["uid"] = document["UniqueID"]
+        inserted.append(document)
+        events.append(make_event("stock", document["UniqueID"], user, "create", document))
+    record_events(events, db)
+    index_documents(inserted, "stocks", db)
+    _user_data_changed(user, db)
+
+    return report
 
 def get_stock(user, uid, db, admin_include=False):
     """
@@ -407,9 +578,54 @@ def get_stock(user, uid, db, admin_include=False):
 
 
 
+def _flip_pipeline(ts, new_status=None, added_comment=None):
+    """
+    Build the aggregation-pipeline update that flips a stock or cross in a single round trip.
+    
+    Parameters:
+    ts: str
+        The flip timestamp (stored as a datetime).
+    new_status: str
+        The new status (DataModifiedDate is only updated if it differs from the current status).
+    added_comment: str
+        The comment to prepend to the comments.
+    
+    Returns:
+    pipeline: list
+        The update pipeline for find_one_and_update.
+    """
+    # wrap user supplied values so that they are never interpreted as field paths or operators
+    flip_time = parse_timestamp(ts) or datetime.datetime.now().replace(microsecond=0)
+    ts_literal = {"$literal": flip_time}
+    update_fields = {"LastFlipDate": ts_literal}
+
+    # Prepend the flip to the capped FlipLog
+    update_fields.update(flip_log_update(flip_time))
+
+    # Count the event (used to schedule snapshots in the event store)
+    update_fields['EventCount'] = {"$add": [{"$ifNull": ["$EventCount", 0]}, 1]}
+
+    # If new status is provided and different from current, update it
+    if new_status:
+        status_changed = {"$ne": ["$Status", new_status]}
+        update_fields['Status'] = {"$literal": new_status}
+        update_fields['DataModifiedDate'] = {"$cond": [status_changed, ts_literal, "$DataModifiedDate"]}
+
+    # If comment is provided, add it to the comments
+    if added_comment:
+        comment_literal = {"$literal": added_comment}
+        update_fields['Comments'] = {"$cond": [
+            {"$eq": [{"$ifNull": ["$Comments", ""]}, ""]},
+            comment_literal,
+            {"$concat": [comment_literal, "; ", "$Comments"]}
+        ]}
+
+    return [{"$set": update_fields}]
+
 def flip_stock(user, uid, db, timestamp, new_status=None, added_comment=None):
     """
     Flip the status of the stock in MongoDB.
+    The flip is applied atomically in a single round trip, so concurrent flips of the same stock do not overwrite each other.
     
     Parameters:
     user: str
@@ -424,58 +640,40 @@ def flip_stock(user, uid, db, timestamp, new_status=None, added_comment=None):
         The new status of the stock.
     added_comment: str
         The comment to add to the stock.
+    
+    Returns:
+    stock: dict
+        The stock after the flip, or None if the stock was not found.
     """
     
     # Define the user's collection
     stocks_collection = db["stocks"]
-    print(f"Flipping stock {uid} for user {user}")
-    # Prepare the update fields
-    update_fields = {}
     
-    # Update the LastFlipDate and FlipLog
+    # Update the stock document in MongoDB and return the updated document
     ts = timestamp.replace('T', ' ')
-    current_stock = stocks_collection.find_one({"UniqueID": uid, "User": user})
-
-    # If the stock exists
-    print(current_stock)
-    
-    if current_stock:
-        # Update LastFlipDate
-        update_fields['LastFlipDate'] = ts
-
-        # Update FlipLog
-        flip_log = current_stock.get('FlipLog', '')
-        update_fields['FlipLog'] = f"{ts}; {flip_log}" if flip_log else ts
+    stock = stocks_collection.find_one_and_update(
+        {"UniqueID": uid, "User": user},
+        _flip_pipeline(ts, new_status, added_comment),
+        return_document=ReturnDocument.AFTER
+    )
 
-        # Prepare the modification log
-        modification_log_entries = []
-        
-        # If new status is provided and different from current, update it
-        if new_status and current_stock.get('Status') != new_status:
-            update_fields['Status'] = new_status
-            update_fields['DataModifiedDate'] = ts
-            modification_log_entries.append(f"{ts} : Status changed from {current_stock.get('Status')} to {new_status}")
+    # Move flips beyond the FlipLog cap to the overflow collection
+    spill_flip_log(stock, "stocks", db)
 
-        # If comment is provided, add it to the comments and the modification log
+    # Record the flip in the event store
+    if stock:
+        changes = {"LastFlipDate": stock["LastFlipDate"], "Status": stock.get("Status")}
         if added_comment:
-            comments = current_stock.get('Comments', '')
-            update_fields['Comments'] = f"{added_comment}; {comments}" if comments else added_comment
-            modification_log_entries.append(f"{ts} : Comments added: {added_comment}")
-
-        # If there are modification log entries, concatenate them with the existing log
-        if modification_log_entries:
-            modification_log = current_stock.get('ModificationLog', '')
-            new_modification_log = "; ".join(modification_log_entries)
-            update_fields['ModificationLog'] = f"{new_modification_log}; {modification_log}" if modification_log else new_modification_log
-
-        print(update_fields)
-
-        # Update the stock document in MongoDB
-        stocks_collection.update_one(
-            {"UniqueID": uid, "User": user},
-            {"$set": update_fields}
-        )
+            changes["Comments"] = stock["Comments"]
+        event = make_event("stock", uid, user, "flip", changes)
+        record_events([event], db)
+        # the comments are searched and the status is filtered on in the search index
+        if added_comment or new_status:
+            index_documents([stock], "stocks", db)
+        _user_data_changed(user, db)
+        maybe_snapshot(stock, "stock", db, event["ts"])
 
+    return stock
 
 def delete_stock(user, uid, db):
     """
@@ -502,6 +700,9 @@ def delete_stock(user, uid, db):
     
     # Check if any document was deleted
     if result.deleted_count > 0:
+        record_events([make_event("stock", uid, user, "delete")], db)
+        remove_documents([uid], db)
+        _user_data_changed(user, db)
         return True
     else:
         return False
@@ -528,34 +729,35 @@ def edit_stock(user, uid, db, updates):
     # Define the user's collection
     stocks_collection = db["stocks"]
     
-    # Prepare the update fields and log the modification
-    update_fields = {}
-    modification_log_entries = []
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    # Loop through the updates and apply them
-    for field, value in updates.items():
-        update_fields[field] = value
-        modification_log_entries.append(f"{timestamp} : {field} updated to {value}")
-    
-    # If there are updates, add to the ModificationLog and DataModifiedDate
-    if modification_log_entries:
-        current_stock = stocks_collection.find_one({"UniqueID": uid, "User": user})
-        if current_stock:
-            modification_log = current_stock.get('ModificationLog', '')
-            new_modification_log = "; ".join(modification_log_entries)
-            update_fields['ModificationLog'] = f"{new_modification_log}; {modification_log}" if modification_log else new_modification_log
-            update_fields['DataModifiedDate'] = timestamp
-            
-            # Update the stock document in MongoDB
-            result = stocks_collection.update_one(
-                {"UniqueID": uid, "User": user},
-                {"$set": update_fields}
-            )
-            
-            return result.matched_count > 0
-    
-    return False
+    # Nothing to update
+    if not updates:
+        return False
+
+    # Prepare the update fields
+    timestamp = datetime.datetime.now().replace(microsecond=0)
+    update_fields = dict(updates)
+    update_fields['DataModifiedDate'] = timestamp
+    # keep the canonical genotype keys and the allele arrays in sync with the genotypes
+    update_fields.update(genotype_key_fields(updates))
+    update_fields.update(genotype_allele_fields(updates))
+
+    # Update the stock document in MongoDB (the change history is kept in the event store)
+    stock = stocks_collection.find_one_and_update(
+        {"UniqueID": uid, "User": user},
+        {"$set": update_fields, "$inc": {"EventCount": 1}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not stock:
+        return False
+
+    # Record the edit in the event store
+    event = make_event("stock", uid, user, "edit", update_fields)
+    record_events([event], db)
+    index_documents([stock], "stocks", db)
+    _user_data_changed(user, db)
+    maybe_snapshot(stock, "stock", db, event["ts"])
+
+    return True
 
 
 def add_to_cross(user, properties, db):
@@ -597,17 +799,12 @@ def add_to_cross(user, properties, db):
     assert "Status" in properties, "Status is required"
     assert "FoodType" in properties, "FoodType is required"
 
-    # Create a UniqueID for the cross based on Male and Female UniqueID + User + Name
+    # Create a UniqueID for the cross based on Male and Female UniqueID + User + Name, unique across all users
     uid = str(user) + str(properties["MaleUniqueID"]) + str(properties["FemaleUniqueID"]) + str(properties["Name"])
-    uid = shake_256(uid.encode()).hexdigest(5)
-
-    # Ensure the UniqueID is unique
-    while uid_exists(uid, db):
-        print("UniqueID already exists, generating a new one")
-        uid = shake_256(uid.encode()).hexdigest(5)
+    uid = allocate_uid(uid, "cross", db)
 
     # Get the current timestamp
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    timestamp = datetime.datetime.now().replace(microsecond=0)
 
     # Create the document to insert
     cross_document = {
@@ -625,13 +822,20 @@ def add_to_cross(user, properties, db):
         "Comments": properties.get("Comments", ""),
         "CreationDate": timestamp,
         "DataModifiedDate": timestamp,
-        "ModificationLog": f"{timestamp} : Cross created"
+        "EventCount": 1,
+        **genotype_key_fields(properties),
+        **genotype_allele_fields(properties)
     }
 
     # Insert the document into the MongoDB collection
     crosses_collection = db["crosses"]
     crosses_collection.insert_one(cross_document)
 
+    # Record the creation in the event store
+    record_events([make_event("cross", uid, user, "create", cross_document)], db)
+    index_documents([cross_document], "crosses", db)
+    _user_data_changed(user, db)
+
     return True, uid
 
 def get_cross(user, uid, db, admin_include=False):
@@ -668,6 +872,7 @@ def get_cross(user, uid, db, admin_include=False):
 def flip_cross(user, uid, db, timestamp, new_status=None, added_comment=None):
     """
     Flip the status of the cross in MongoDB.
+    The flip is applied atomically in a single round trip, so concurrent flips of the same cross do not overwrite each other.
     
     Parameters:
     user: str
@@ -682,52 +887,40 @@ def flip_cross(user, uid, db, timestamp, new_status=None, added_comment=None):
         The new status of the cross.
     added_comment: str
         The comment to add to the cross.
+    
+    Returns:
+    cross: dict
+        The cross after the flip, or None if the cross was not found.
     """
     
     # Define the user's collection
     crosses_collection = db["crosses"]
 
-    # Prepare the update fields
-    update_fields = {}
-    
-    # Update the LastFlipDate and FlipLog
+    # Update the cross document in MongoDB and return the updated document
     ts = timestamp.replace('T', ' ')
-    current_cross = crosses_collection.find_one({"UniqueID": uid, "User": user})
-
-    if current_cross:
-        # Update LastFlipDate
-        update_fields['LastFlipDate'] = ts
-
-        # Update FlipLog
-        flip_log = current_cross.get('FlipLog', '')
-        update_fields['FlipLog'] = f"{ts}; {flip_log}" if flip_log else ts
-
-        # Prepare the modification log
-        modification_log_entries = []
-        
-        # If new status is provided and different from current, update it
-        if new_status and current_cross.get('Status') != new_status:
-            update_fields['Status'] = new_status
-            update_fields['DataModifiedDate'] = ts
-            modification_log_entries.append(f"{ts} : Status changed from {current_cross.get('Status')} to {new_status}")
-
-        # If comment is provided, add it to the comments and the modification log
+    cross = crosses_collection.find_one_and_update(
+        {"UniqueID": uid, "User": user},
+        _flip_pipeline(ts, new_status, added_comment),
+        return_document=ReturnDocument.AFTER
+    )
+
+    # Move flips beyond the FlipLog cap to the overflow collection
+    spill_flip_log(cross, "crosses", db)
+
+    # Record the flip in the event store
+    if cross:
+        changes = {"LastFlipDate": cross["LastFlipDate"], "Status": cross.get("Status")}
         if added_comment:
-            comments = current_cross.get('Comments', '')
-            update_fields['Comments'] = f"{added_comment}; {comments}" if comments else added_comment
-            modification_log_entries.append(f"{ts} : Comments added: {added_comment}")
-
-        # If there are modification log entries, concatenate them with the existing log
-        if modification_log_entries:
-            modification_log = current_cross.get('ModificationLog', '')
-            new_modification_log = "; ".join(modification_log_entries)
-            update_fields['ModificationLog'] = f"{new_modification_log}; {modification_log}" if modification_log else new_modification_log
-
-        # Update the cross document in MongoDB
-        crosses_collection.update_one(
-            {"UniqueID": uid, "User": user},
-            {"$set": update_fields}
-        )
+            changes["Comments"] = cross["Comments"]
+        event = make_event("cross", uid, user, "flip", changes)
+        record_events([event], db)
+        # the comments are searched and the status is filtered on in the search index
+        if added_comment or new_status:
+            index_documents([cross], "crosses", db)
+        _user_data_changed(user, db)
+        maybe_snapshot(cross, "cross", db, event["ts"])
+
+    return cross
 
 def delete_cross(user, uid, db):
     """
@@ -754,6 +947,9 @@ def delete_cross(user, uid, db):
     
     # Check if any document was deleted
     if result.deleted_count > 0:
+        record_events([make_event("cross", uid, user, "delete")], db)
+        remove_documents([uid], db)
+        _user_data_changed(user, db)
         return True
     else:
         return False
@@ -780,39 +976,40 @@ def edit_cross(user, uid, db, updates):
     # Define the user's collection
     crosses_collection = db["crosses"]
     
-    # Prepare the update fields and log the modification
-    update_fields = {}
-    modification_log_entries = []
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    # Loop through the updates and apply them
-    for field, value in updates.items():
-        update_fields[field] = value
-        modification_log_entries.append(f"{timestamp} : {field} updated to {value}")
-    
-    # If there are updates, add to the ModificationLog and DataModifiedDate
-    if modification_log_entries:
-        current_cross = crosses_collection.find_one({"UniqueID": uid, "User": user})
-        if current_cross:
-            modification_log = current_cross.get('ModificationLog', '')
-            new_modification_log = "; ".join(modification_log_entries)
-            update_fields['ModificationLog'] = f"{new_modification_log}; {modification_log}" if modification_log else new_modification_log
-            update_fields['DataModifiedDate'] = timestamp
-            
-            # Update the cross document in MongoDB
-            result = crosses_collection.update_one(
-                {"UniqueID": uid, "User": user},
-                {"$set": update_fields}
-            )
-            
-            return result.matched_count > 0
-    
-    return False
+    # Nothing to update
+    if not updates:
+        return False
+
+    # Prepare the update fields
+    timestamp = datetime.datetime.now().replace(microsecond=0)
+    update_fields = dict(updates)
+    update_fields['DataModifiedDate'] = timestamp
+    # keep the canonical genotype keys and the allele arrays in sync with the genotypes
+    update_fields.update(genotype_key_fields(updates))
+    update_fields.update(genotype_allele_fields(updates))
+
+    # Update the cross document in MongoDB (the change history is kept in the event store)
+    cross = crosses_collection.find_one_and_update(
+        {"UniqueID": uid, "User": user},
+        {"$set": update_fields, "$inc": {"EventCount": 1}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not cross:
+        return False
+
+    # Record the edit in the event store
+    event = make_event("cross", uid, user, "edit", update_fields)
+    record_events([event], db)
+    index_documents([cross], "crosses", db)
+    _user_data_changed(user, db)
+    maybe_snapshot(cross, "cross", db, event["ts"])
+
+    return True
 
 # Metadata Management
 def get_metadata(metadata_type, db):
     """
-    Get the metadata for a specific type from the MongoDB database.
+    Get the metadata for a specific type (served from the versioned metadata cache).
     
     Parameters:
     metadata_type: str
@@ -826,9 +1023,7 @@ def get_metadata(metadata_type, db):
     """
     assert metadata_type in ["types", "food_types", "provenances", "genesX", "genes2nd", 
                              "genes3rd", "genes4th"], "Invalid metadata type"
-    metadata_collection = db[metadata_type]
-    metadata = list(metadata_collection.find())
-    values = [m["Value"] for m in metadata]
+    values = list(get_all_metadata(db)[metadata_type])
     return values
 
 def add_metadata(metadata_type, metadata_value, db):
@@ -863,6 +1058,7 @@ def add_metadata(metadata_type, metadata_value, db):
     }
 
     metadata_collection.insert_one(metadata_document)
+    bump_metadata_version(db)
 
     return True
 
@@ -893,6 +1089,7 @@ def delete_metadata(metadata_type, metadata_value, db):
 
     # Check if any document was deleted
     if result.deleted_count > 0:
+        bump_metadata_version(db)
         return True
     else:
         return False
@@ -927,7 +1124,10 @@ def edit_metadata(metadata_type, old_value, new_value, db):
         {"$set": {"Value": new_value}}
     )
 
-    return result.matched_count > 0
+    if result.matched_count > 0:
+        bump_metadata_version(db)
+        return True
+    return False
 
 
 
@@ -0,0 +1,542 @@
+# Description: This file contains the cross planner (parent pairs and two-generation schemes producing a target genotype), searched on an allele -> stock bitset index.
+
+import heapq
+import threading
+from itertools import combinations
+from fractions import Fraction
+from flymanager.utils.versions import get_data_version
+from flymanager.utils.genetics import CHROMOSOME_NAMES, allele_field, qc_genotype, get_genetic_components, \
+    genotype_alleles, x_offspring, autosome_offspring
+
+# default number of crosses and schemes returned
+PLAN_RESULTS = 20
+
+# maximum number of parent pairs evaluated per search (bounds the time of very common targets such as "+; +; +; +")
+MAX_EVALUATED_PAIRS = 100000
+
+# maximum number of first-generation mothers tried per split of the target alleles of a two-generation scheme
+MAX_SCHEME_MOTHERS = 50
+
+# maximum number of first-generation fathers and of second-generation partners tried per mother
+MAX_SCHEME_PARTNERS = 3
+
+ADMIN_USER = "admin"
+
+# cached (versions, StockIndex) per (user, admin_include)
+_index_cache = {}
+_index_lock = threading.Lock()
+
+
+class StockIndex:
+    """
+    Inverted index of the stocks: allele ID -> bitset (int) of the positions of the stocks carrying the allele on a
+    chromosome, and of the stocks homozygous for it.
+    """
+
+    def __init__(self, stocks):
+        self.stocks = stocks
+        self.allele_ids = {}
+        self.carriers = []
+        self.homozygous = []
+        self.all = (1 << len(stocks)) - 1
+        for position, stock in enumerate(stocks):
+            bit = 1 << position
+            for chromosome, alleles in enumerate(stock["Alleles"]):
+                for allele in alleles:
+                    allele_id = self.allele_id(chromosome, allele, create=True)
+                    self.carriers[allele_id] |= bit
+                    if len(alleles) == 1:
+                        self.homozygous[allele_id] |= bit
+
+    def allele_id(self, chromosome, allele, create=False):
+        """
+        Get the ID of an allele of a chromosome (None if no stock carries it, unless create is True).
+        """
+        key = (chromosome, allele)
+        allele_id = self.allele_ids.get(key)
+        if allele_id is None and create:
+            allele_id = self.allele_ids[key] = len(self.carriers)
+            self.carriers.append(0)
+            self.homozygous.append(0)
+        return allele_id
+
+    def carrying(self, chromosome, *alleles):
+        """
+        Get the bitset of the stocks carrying any of the alleles on a chromosome.
+        """
+        bits = 0
+        for allele in alleles:
+            allele_id = self.allele_id(chromosome, allele)
+            if allele_id is not None:
+                bits |= self.carriers[allele_id]
+        return bits
+
+    def homozygous_for(self, chromosome, allele):
+        """
+        Get the bitset of the stocks homozygous for an allele on a chromosome.
+        """
+        allele_id = self.allele_id(chromosome, allele)
+        return 0 if allele_id is None else self.homozygous[allele_id]
+
+    def __len__(self):
+        return len(self.stocks)
+
+
+def _positions(bits):
+    """
+    Get the positions of the set bits of a bitset, in increasing order.
+    """
+    return [position for position, bit in enumerate(reversed(bin(bits)[2:])) if bit == "1"]
+
+
+def _stock_alleles(stock):
+    """
+    Get the distinct alleles of every chromosome of a stock (from its allele arrays, or its genotype for the stocks
+    stored before the arrays).
+    """
+    fields = [allele_field("Genotype", chromosome) for chromosome in CHROMOSOME_NAMES]
+    if all(field in stock for field in fields):
+        return tuple(tuple(stock[field]) for field in fields)
+    return genotype_alleles(stock.get("Genotype"))
+
+
+def get_stock_index(user, db, admin_include=False):
+    """
+    Get the stock index of a user (with the admin stocks if admin_include), cached until the data of the user
+    (or of the admin) changes.
+    Parameters:
+    user: str
+        The username of the user.
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    admin_include: bool
+        Whether to include the admin stocks as well.
+    Returns:
+    index: StockIndex
+        The index of the stocks with a valid genotype.
+    """
+    users = [user] + ([ADMIN_USER] if admin_include and user != ADMIN_USER else [])
+    versions = tuple(get_data_version(name, db) for name in users)
+    key = (user, len(users) > 1)
+    with _index_lock:
+        cached = _index_cache.get(key)
+        if cached is not None and cached[0] == versions:
+            return cached[1]
+
+    projection = {"_id": 0, "UniqueID": 1, "User": 1, "Genotype": 1}
+    projection.update({allele_field("Genotype", chromosome): 1 for chromosome in CHROMOSOME_NAMES})
+    stocks = []
+    for stock in db["stocks"].find({"User": {"$in": users}}, projection, sort=[("UniqueID", 1)]):
+        alleles = _stock_alleles(stock)
+        if alleles:
+            stocks.append({"UniqueID": stock["UniqueID"], "User": stock["User"], "Genotype": stock.get("Genotype"),
+                           "Alleles": alleles})
+    index = StockIndex(stocks)
+
+    with _index_lock:
+        _index_cache[key] = (versions, index)
+    return index
+
+
+def _fraction(alleles, allele):
+    """
+    Get the fraction of the gametes of a chromosome carrying an allele.
+    """
+    if allele not in alleles:
+        return 0.0
+    return 1.0 if len(alleles) == 1 else 0.5
+
+
+def _autosome_probability(mother, father, target):
+    """
+    Get the probability that an offspring gets the target alleles of an autosome.
+    """
+    a, b = target
+    if a == b:
+        return _fraction(mother, a) * _fraction(father, a)
+    return _fraction(mother, a) * _fraction(father, b) + _fraction(mother, b) * _fraction(father, a)
+
+
+def _x_probability(mother, father, target, sex):
+    """
+    Get the probability that an offspring of a sex gets the target X (the males used as fathers are selected for one
+    of the X alleles of their stock).
+    Returns the probability within the sex and the X allele of the father.
+    """
+    if sex == "male":
+        return _fraction(mother, target[0]), None
+    a, b = target
+    best = (0.0, None)
+    for father_x in father:
+        if father_x == "Y":
+            continue
+        if a == b:
+            probability = _fraction(mother, a) * (father_x == a)
+        else:
+            probability = _fraction(mother, a) * (father_x == b) + _fraction(mother, b) * (father_x == a)
+        best = max(best, (probability, father_x), key=lambda option: option[0])
+    return best
+
+
+def _pair_probability(mother, father, target):
+    """
+    Get the probability that the offspring of a cross has the target genotype (of either allowed sex).
+    Returns the probability and the X allele of the father.
+    """
+    autosomes = 1.0
+    for chromosome in range(1, len(CHROMOSOME_NAMES)):
+        autosomes *= _autosome_probability(mother[chromosome], father[chromosome], target["Alleles"][chromosome])
+        if not autosomes:
+            return 0.0, None
+    probability, father_x = 0.0, None
+    for sex in target["Sexes"]:
+        x_probability, x_allele = _x_probability(mother[0], father[0], target["Alleles"][0], sex)
+        probability += 0.5 * x_probability * autosomes
+        father_x = father_x or x_allele
+    return probability, father_x
+
+
+def _mother_bound(mother, target):
+    """
+    Get an upper bound of the probability of the target over all the fathers of a cross.
+    """
+    bound = 1.0
+    for chromosome in range(1, len(CHROMOSOME_NAMES)):
+        a, b = target["Alleles"][chromosome]
+        bound *= _fraction(mother[chromosome], a) if a == b else \
+            min(1.0, _fraction(mother[chromosome], a) + _fraction(mother[chromosome], b))
+    x = target["Alleles"][0]
+    x_bound = 0.0
+    for sex in target["Sexes"]:
+        if sex == "male" or x[0] == x[1]:
+            x_bound += _fraction(mother[0], x[0])
+        else:
+            x_bound += min(1.0, _fraction(mother[0], x[0]) + _fraction(mother[0], x[1]))
+    return 0.5 * x_bound * bound
+
+
+def _needed_alleles(alleles, target):
+    """
+    Get the target alleles that the other parent must carry, given the alleles of one parent on a chromosome.
+    """
+    a, b = target
+    if a == b:
+        return (a,)
+    has_a, has_b = a in alleles, b in alleles
+    if has_a and has_b:
+        return (a, b)
+    return (b,) if has_a else (a,)
+
+
+def parse_target(genotype, sex=None):
+    """
+    Parse a target genotype.
+    Parameters:
+    genotype: str
+        The target genotype (the X of a male target is written hemizygous, e.g. "w").
+    sex: str
+        "female", "male" or None (any sex allowed by the X).
+    Returns:
+    target: dict
+        {"Genotype": cleaned genotype, "Alleles": sorted allele pair per chromosome, "Sexes": [allowed sexes]}
+    Raises:
+    ValueError
+        If the genotype fails the QC or does not fit the sex.
+    """
+    qc, cleaned = qc_genotype(genotype)
+    if not qc:
+        raise ValueError(cleaned)
+    alleles = [tuple(sorted(allele.strip() or "+" for allele in chromosome))
+               for chromosome in get_genetic_components(cleaned)]
+    if sex not in (None, "female", "male"):
+        raise ValueError("sex must be female or male")
+    heterozygous_x = alleles[0][0] != alleles[0][1]
+    if sex == "male" and heterozygous_x:
+        raise ValueError("The X chromosome of a male target must be hemizygous")
+    sexes = [sex] if sex else (["female"] if heterozygous_x else ["female", "male"])
+    return {"Genotype": cleaned, "Alleles": alleles, "Sexes": sexes}
+
+
+def _describe(stock, x_allele=None):
+    """
+    Describe a parent stock in the results.
+    """
+    parent = {"UniqueID": stock["UniqueID"], "Genotype": stock["Genotype"], "User": stock["User"]}
+    if x_allele is not None and len(stock["Alleles"][0]) > 1:
+        # the males of the stock have to be selected for this X
+        parent["X"] = x_allele
+    return parent
+
+
+def _probability(probability):
+    """
+    Format a probability as {"Probability": float, "Fraction": "1/8"}.
+    """
+    return {"Probability": probability, "Fraction": str(Fraction(probability).limit_denominator(1 << 20))}
+
+
+def find_parent_pairs(index, target, k=PLAN_RESULTS, user=None):
+    """
+    Find the best parent pairs producing a target genotype in one generation.
+    The mothers are the stocks carrying one of the target alleles of every chromosome (an intersection of bitsets);
+    for every mother the fathers are the stocks carrying the complementary alleles, so only the pairs that can produce
+    the target are evaluated, the best mothers first (a mother is skipped once it cannot beat the k-th pair).
+    Parameters:
+    index: StockIndex
+        The stock index.
+    target: dict
+        The target (see parse_target).
+    k: int
+        The number of pairs.
+    user: str
+        The user, whose own stocks are preferred over the admin stocks at equal probability.
+    Returns:
+    pairs: list
+        The pairs as {"Female": ..., "Male": ..., "Probability": ..., "Fraction": ...}, most likely first.
+    truncated: bool
+        Whether the search stopped at MAX_EVALUATED_PAIRS.
+    """
+    stocks = index.stocks
+    alleles = target["Alleles"]
+
+    # the mothers must carry one of the target alleles of every chromosome, the fathers one of every autosome
+    # (and of the X for a female target)
+    fathers = index.all
+    for chromosome in range(1, len(CHROMOSOME_NAMES)):
+        fathers &= index.carrying(chromosome, *alleles[chromosome])
+    mothers = fathers & index.carrying(0, *alleles[0])
+    female_only = target["Sexes"] == ["female"]
+    if female_only:
+        fathers &= index.carrying(0, *alleles[0])
+
+    candidates = []
+    for position in _positions(mothers):
+        bound = _mother_bound(stocks[position]["Alleles"], target)
+        if bound > 0:
+            candidates.append((-bound, stocks[position]["User"] != user, position))
+    candidates.sort()
+
+    best = []
+    evaluated = 0
+    truncated = False
+    for negative_bound, mother_admin, mother in candidates:
+        if len(best) >= k and -negative_bound <= best[0][0]:
+            break
+        mother_alleles = stocks[mother]["Alleles"]
+        compatible = fathers
+        for chromosome in range(1, len(CHROMOSOME_NAMES)):
+            compatible &= index.carrying(chromosome, *_needed_alleles(mother_alleles[chromosome], alleles[chromosome]))
+        if female_only:
+            compatible &= index.carrying(0, *_needed_alleles(mother_alleles[0], alleles[0]))
+        compatible &= ~(1 << mother)
+        for father in _positions(compatible):
+            evaluated += 1
+            probability, father_x = _pair_probability(mother_alleles, stocks[father]["Alleles"], target)
+            admins = mother_admin + (stocks[father]["User"] != user)
+            entry = (probability, -admins, -mother, -father, father_x)
+            if len(best) < k:
+                heapq.heappush(best, entry)
+            elif entry[:4] > best[0][:4]:
+                heapq.heapreplace(best, entry)
+            if evaluated >= MAX_EVALUATED_PAIRS:
+                truncated = True
+                break
+        if truncated:
+            break
+
+    pairs = []
+    for probability, _, mother, father, father_x in sorted(best, key=lambda entry: entry[:4], reverse=True):
+        if probability > 0:
+            pairs.append({"Female": _describe(stocks[-mother]), "Male": _describe(stocks[-father], father_x),
+                          **_probability(probability)})
+    return pairs, truncated
+
+
+def _pair_alleles(alleles):
+    """
+    Write the distinct alleles of a chromosome as the allele pair used by the cross predictor.
+    """
+    return alleles if len(alleles) == 2 else alleles * 2
+
+
+def _best_f1(mother, father, needed, partner, target):
+    """
+    Choose the F1 females of a first-generation cross to use with a second-generation partner: on every chromosome,
+    the F1 class giving the target most often with the partner (the most frequent class on ties).
+    Returns the F1 genotype, its frequency among the F1 females, the probability of the target in the second
+    generation (the F1 as mother, the partner as father) and the X of the first-cross father the F1 is bred from,
+    or None if no F1 class works.
+    """
+    father_x = sorted(allele for allele in father[0] if allele != "Y")
+    father_x = [needed[0]] if needed[0] in father_x else father_x[:1]
+    if not father_x:
+        return None
+    x_classes = [(tuple(chromosome.split("/")), probability)
+                 for sex, chromosome, probability in x_offspring(_pair_alleles(mother[0]), tuple(father_x))
+                 if sex == "female"]
+    classes = [x_classes] + [
+        [(tuple(chromosome.split("/")), probability)
+         for chromosome, probability in autosome_offspring(_pair_alleles(mother[c]), _pair_alleles(father[c]))]
+        for c in range(1, len(CHROMOSOME_NAMES))
+    ]
+
+    chromosomes, frequency, probability = [], Fraction(1, 2), 1.0
+    for c, chromosome_classes in enumerate(classes):
+        options = []
+        for alleles, class_probability in chromosome_classes:
+            if c == 0:
+                x = target["Alleles"][0]
+                chromosome_probability = sum(0.5 * _x_probability(alleles, partner[0], x, sex)[0]
+                                             for sex in target["Sexes"])
+            else:
+                chromosome_probability = _autosome_probability(alleles, partner[c], target["Alleles"][c])
+            options.append((chromosome_probability, class_probability, alleles))
+        chromosome_probability, class_probability, alleles = max(options)
+        if not chromosome_probability:
+            return None
+        chromosomes.append("/".join(alleles))
+        frequency *= class_probability
+        probability *= chromosome_probability
+    return "; ".join(chromosomes), float(frequency), probability, father_x[0]
+
+
+def find_schemes(index, target, k=PLAN_RESULTS, user=None):
+    """
+    Find two-generation schemes producing a target genotype: F1 females of a first cross (mother x father) are crossed
+    to the males of a partner stock.
+    For every split of the target alleles between the F1 and the partner, the partners are the stocks carrying (if
+    possible homozygous) the partner alleles, and the first crosses are pairs of stocks that together carry the F1
+    alleles, one missing only what the other carries (bitset intersections again).
+    Parameters:
+    index: StockIndex
+        The stock index.
+    target: dict
+        The target (see parse_target).
+    k: int
+        The number of schemes.
+    user: str
+        The user, whose own stocks are preferred over the admin stocks at equal probability.
+    Returns:
+    schemes: list
+        The schemes as {"Cross": {"Female": ..., "Male": ...}, "F1": {"Genotype": ..., "Frequency": ...},
+        "Partner": ..., "Probability": ..., "Fraction": ...} (the probability of the target in the second generation),
+        most likely first.
+    """
+    stocks = index.stocks
+    alleles = target["Alleles"]
+    chromosomes = range(len(CHROMOSOME_NAMES))
+
+    # every way of splitting the target alleles between the F1 (needed) and the partner (given)
+    # (the X of a male target only comes from the F1 mother)
+    splits = [[]]
+    for c in chromosomes:
+        a, b = alleles[c]
+        options = [(a, b)] if c == 0 and target["Sexes"] == ["male"] else list(dict.fromkeys([(a, b), (b, a)]))
+        splits = [split + [option] for split in splits for option in options]
+
+    best = {}
+    for split in splits:
+        needed = [option[0] for option in split]
+        given = [option[1] for option in split]
+
+        # the partners carry the given alleles (homozygous partners give them to every offspring)
+        partners = index.all
+        homozygous_partners = index.all
+        for c in chromosomes:
+            if c == 0 and target["Sexes"] == ["male"]:
+                continue
+            partners &= index.carrying(c, given[c])
+            homozygous_partners &= index.homozygous_for(c, given[c])
+        partners = _positions(homozygous_partners or partners)[:MAX_SCHEME_PARTNERS]
+        if not partners:
+            continue
+
+        # the first-generation mothers carry some (but not all) of the needed alleles, the most first
+        carriers = [index.carrying(c, needed[c]) for c in chromosomes]
+        mothers = []
+        for size in range(len(CHROMOSOME_NAMES) - 1, 0, -1):
+            for covered in combinations(chromosomes, size):
+                bits = index.all
+                for c in chromosomes:
+                    bits &= carriers[c] if c in covered else ~carriers[c]
+                mothers.extend(sorted(_positions(bits), key=lambda position: stocks[position]["User"] != user))
+            if len(mothers) >= MAX_SCHEME_MOTHERS:
+                break
+        for mother in mothers[:MAX_SCHEME_MOTHERS]:
+            fathers = index.all & ~(1 << mother)
+            for c in chromosomes:
+                if not carriers[c] >> mother & 1:
+                    fathers &= carriers[c]
+            for father in _positions(fathers)[:MAX_SCHEME_PARTNERS]:
+                for partner in partners:
+                    if partner in (mother, father):
+                        continue
+                    f1 = _best_f1(stocks[mother]["Alleles"], stocks[father]["Alleles"], needed,
+                                  stocks[partner]["Alleles"], target)
+                    if f1 is None:
+                        continue
+                    genotype, frequency, probability, father_x = f1
+                    admins = sum(stocks[position]["User"] != user for position in (mother, father, partner))
+                    key = (mother, father, partner)
+                    entry = (probability, frequency, -admins)
+                    if key not in best or entry > best[key][0]:
+                        best[key] = (entry, genotype, father_x, given)
+
+    ranked = heapq.nlargest(k, best.items(), key=lambda item: (item[1][0], tuple(-p for p in item[0])))
+    schemes = []
+    # the X of the partner males only matters for a female target
+    partner_x = target["Sexes"] != ["male"]
+    for (mother, father, partner), ((probability, frequency, _), genotype, father_x, given) in ranked:
+        schemes.append({
+            "Cross": {"Female": _describe(stocks[mother]), "Male": _describe(stocks[father], father_x)},
+            "F1": {"Sex": "female", "Genotype": genotype, **_probability(frequency)},
+            "Partner": _describe(stocks[partner], given[0] if partner_x else None),
+            **_probability(probability),
+        })
+    return schemes
+
+
+def plan_cross(user, genotype, db, sex=None, admin_include=False, k=PLAN_RESULTS, generations=2):
+    """
+    Plan how to obtain a target genotype from the user's stocks (and the admin stocks if admin_include).
+    Parameters:
+    user: str
+        The username of the user.
+    genotype: str
+        The target genotype.
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    sex: str
+        The sex of the target ("female", "male" or None for any).
+    admin_include: bool
+        Whether to use the admin stocks as well.
+    k: int
+        The number of crosses and schemes returned.
+    generations: int
+        1 for the parent pairs only, 2 to also search two-generation schemes.
+    Returns:
+    plan: dict
+        {"Target": cleaned genotype, "Crosses": parent pairs (see find_parent_pairs), "Schemes": two-generation
+        schemes (see find_schemes), "Truncated": bool, "Stocks": number of stocks searched}
+    Raises:
+    ValueError
+        If the target genotype is invalid.
+    """
+    target = parse_target(genotype, sex)
+    index = get_stock_index(user, db, admin_include)
+    crosses, truncated = find_parent_pairs(index, target, k, user)
+    schemes = find_schemes(index, target, k, user) if generations > 1 else []
+    return {"Target": target["Genotype"], "Crosses": crosses, "Schemes": schemes, "Truncated": truncated,
+            "Stocks": len(index)}
+
+
+def invalidate_stock_index(user=None):
+    """
+    Drop the cached stock indexes of a user (or of all users if user is None).
+    """
+    with _index_lock:
+        if user is None:
+            _index_cache.clear()
+        else:
+            for key in [key for key in _index_cache if key[0] == user]:
+                del _index_cache[key]
@@ -0,0 +1,219 @@
+# Description: This file contains the persistent trigram search index for stocks and crosses.
+
+import itertools
+import re
+from fuzzywuzzy import fuzz
+from pymongo import ReplaceOne
+
+SEARCH_COLLECTION = "search_index"
+
+# fields indexed for the search, per collection
+SEARCH_FIELDS = {
+    "stocks": ["SourceID", "Genotype", "Name", "AltReference", "SeriesID", "TrayID", "TrayPosition", "Comments"],
+    "crosses": ["Name", "MaleGenotype", "FemaleGenotype", "TrayID", "TrayPosition", "Comments"],
+}
+
+# explorer filter fields copied into the index entries, so that the candidates are filtered by the aggregation
+# (the document fields of flymanager.utils.explorer.EXPLORERS)
+FILTER_FIELDS = {
+    "stocks": ["Type", "TrayID", "Status", "FoodType", "Provenance"],
+    "crosses": ["MaleGenotype", "FemaleGenotype", "TrayID", "Status", "FoodType"],
+}
+
+# version of the index entries (the index is rebuilt at startup if it holds entries of another version)
+SEARCH_INDEX_VERSION = 2
+
+# number of candidates (by trigram overlap) ranked with the fuzzy scorer per batch
+CANDIDATES = 200
+
+# maximum number of candidates ranked per search (a query without fuzzy matches stops there)
+MAX_CANDIDATES = 5000
+
+# minimum fuzzy score for a stock/cross to match the search query
+SEARCH_THRESHOLD = 80
+
+
+def trigrams(text):
+    """
+    Get the set of trigrams of a text (each alphanumeric token is padded with spaces, so short tokens are indexed too).
+    """
+    grams = set()
+    for token in re.findall(r"[a-z0-9]+", str(text).lower()):
+        token = f" {token} "
+        grams.update(token[i:i + 3] for i in range(len(token) - 2))
+    return grams
+
+
+def search_text(document, collection_name):
+    """
+    Concatenate the searchable fields of a document.
+    """
+    return ' '.join(str(document.get(field, '')) for field in SEARCH_FIELDS[collection_name])
+
+
+def _index_entry(document, collection_name):
+    """
+    Create the search index entry of a document.
+    """
+    entry = {
+        "_id": document["UniqueID"],
+        "User": document["User"],
+        "Kind": collection_name,
+        "Version": SEARCH_INDEX_VERSION,
+        "Grams": sorted(trigrams(search_text(document, collection_name))),
+    }
+    entry.update({field: document[field] for field in FILTER_FIELDS[collection_name] if field in document})
+    return entry
+
+
+def index_documents(documents, collection_name, db):
+    """
+    Add or update the search index entries of stocks or crosses (called by the mutators).
+    Parameters:
+    documents: list
+        The stock or cross documents.
+    collection_name: str
+        "stocks" or "crosses"
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    """
+    operations = [ReplaceOne({"_id": document["UniqueID"]}, _index_entry(document, collection_name), upsert=True)
+                  for document in documents if document]
+    if operations:
+        db[SEARCH_COLLECTION].bulk_write(operations, ordered=False)
+
+
+def remove_documents(uids, db):
+    """
+    Remove the search index entries of deleted stocks or crosses.
+    """
+    if uids:
+        db[SEARCH_COLLECTION].delete_many({"_id": {"$in": list(uids)}})
+
+
+def rebuild_search_index(db, batch_size=1000):
+    """
+    Rebuild the search index from all the stocks and crosses.
+    Parameters:
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    batch_size: int
+        The number of entries written per bulk write.
+    Returns:
+    count: int
+        The number of indexed documents.
+    """
+    db[SEARCH_COLLECTION].delete_many({})
+    count = 0
+    for collection_name, fields in SEARCH_FIELDS.items():
+        projection = {field: 1 for field in fields + FILTER_FIELDS[collection_name] + ["UniqueID", "User"]}
+        batch = []
+        for document in db[collection_name].find({}, projection):
+            batch.append(_index_entry(document, collection_name))
+            if len(batch) >= batch_size:
+                db[SEARCH_COLLECTION].insert_many(batch, ordered=False)
+                count += len(batch)
+                batch = []
+        if batch:
+            db[SEARCH_COLLECTION].insert_many(batch, ordered=False)
+            count += len(batch)
+    return count
+
+
+def ensure_search_index(db):
+    """
+    Build the search index if it is empty but there are stocks or crosses, or if it holds entries of an older version
+    (e.g. after an upgrade).
+    """
+    if db[SEARCH_COLLECTION].estimated_document_count() == 0:
+        if any(db[collection_name].estimated_document_count() for collection_name in SEARCH_FIELDS):
+            rebuild_search_index(db)
+    elif db[SEARCH_COLLECTION].find_one({"Version": {"$ne": SEARCH_INDEX_VERSION}}, {"_id": 1}):
+        rebuild_search_index(db)
+
+
+def search_candidates(user, collection_name, query, db, filters=None, limit=MAX_CANDIDATES):
+    """
+    Get the UniqueIDs of the user's stocks or crosses sharing the most trigrams with the query, read from a single
+    aggregation cursor in batches of CANDIDATES.
+    Parameters:
+    user: str
+        The username of the user.
+    collection_name: str
+        "stocks" or "crosses"
+    query: str
+        The search query.
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    filters: dict
+        The explorer filters ({document field: condition}), the filter fields are matched on the index entries.
+    limit: int
+        The maximum number of candidates.
+    Returns:
+    uids: iterator
+        The UniqueIDs of the candidates, best first.
+    """
+    grams = sorted(trigrams(query))
+    if not grams:
+        return iter(())
+    match = {"User": user, "Kind": collection_name, "Grams": {"$in": grams}}
+    match.update({field: condition for field, condition in (filters or {}).items()
+                  if field in FILTER_FIELDS[collection_name]})
+    pipeline = [
+        {"$match": match},
+        {"$project": {"score": {"$size": {"$setIntersection": ["$Grams", grams]}}}},
+        {"$sort": {"score": -1, "_id": 1}},
+        {"$limit": limit},
+    ]
+    return (entry["_id"] for entry in db[SEARCH_COLLECTION].aggregate(pipeline, batchSize=CANDIDATES))
+
+
+def search(user, collection_name, query, db, filters=None, k=100, projection=None):
+    """
+    Search the user's stocks or crosses: candidates are selected with the trigram index and ranked with the fuzzy scorer.
+    The explorer filters are applied to the index entries, and the candidates are ranked in batches (best trigram
+    overlap first) until k of them match the query or MAX_CANDIDATES have been ranked.
+    Parameters:
+    user: str
+        The username of the user.
+    collection_name: str
+        "stocks" or "crosses"
+    query: str
+        The search query.
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    filters: dict
+        An additional MongoDB query the results must match (e.g. the explorer filters).
+    k: int
+        The maximum number of results.
+    projection: dict
+        The projection of the returned documents.
+    Returns:
+    documents: list
+        The best matching documents, best first.
+    """
+    # the ranking needs the searched fields, which are dropped again if an inclusion projection did not ask for them
+    ranking_fields = []
+    if projection and any(value for field, value in projection.items() if field != "_id"):
+        ranking_fields = [field for field in SEARCH_FIELDS[collection_name] if field not in projection]
+        projection = {**projection, **{field: 1 for field in ranking_fields}}
+
+    # rank the candidates with the fuzzy scorer
+    query_text = query.lower()
+    scored = []
+    candidates = search_candidates(user, collection_name, query, db, filters=filters)
+    while len(scored) < k:
+        uids = list(itertools.islice(candidates, CANDIDATES))
+        if not uids:
+            break
+        documents = db[collection_name].find({**(filters or {}), "User": user, "UniqueID": {"$in": uids}}, projection)
+        for document in documents:
+            score = fuzz.partial_ratio(search_text(document, collection_name).lower(), query_text)
+            if score > SEARCH_THRESHOLD:
+                scored.append((score, document))
+    scored.sort(key=lambda item: item[0], reverse=True)
+    documents = [document for _, document in scored[:k]]
+    for document in documents:
+        for field in ranking_fields:
+            document.pop(field, None)
+    return documents
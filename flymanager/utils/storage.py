@@ -0,0 +1,437 @@
+# Description: This file contains the storage backends (a repository interface with a MongoDB and an in-memory implementation) used by the storage benchmarks; the app itself always uses MongoDB.
+
+import abc
+import bisect
+import datetime
+import itertools
+import os
+import re
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from flymanager.utils import mongo
+from flymanager.utils.activity import ACTIVITY_COLLECTION, FEED_PAGE_SIZE, get_activity_feed, \
+    encode_feed_cursor, decode_feed_cursor
+from flymanager.utils.connection import get_db
+from flymanager.utils.explorer import EXPLORERS, PAGE_SIZE, encode_cursor, decode_cursor, query_page, build_query, \
+    api_projection, stream_ndjson, stream_pages, get_facet_counts
+from flymanager.utils.fliplog import FLIPLOG_CAP
+from flymanager.utils.indexes import METADATA_COLLECTIONS
+from flymanager.utils.users import USERS_COLLECTION, get_user
+from flymanager.utils.versions import get_data_version
+
+# backend used when FLYMANAGER_BACKEND is not set (read by the benchmark scripts, not by the app)
+DEFAULT_BACKEND = "mongo"
+
+
+class Repository(abc.ABC):
+    """
+    Storage operations on stocks, crosses, users, activity and metadata.
+    collection_name is "stocks" or "crosses"; filters are {document field: value} on the explorer filter fields.
+    """
+
+    # stocks and crosses
+    @abc.abstractmethod
+    def insert(self, collection_name, documents):
+        """Insert stock or cross documents as they are (no QC, no UniqueID allocation)."""
+
+    @abc.abstractmethod
+    def get(self, collection_name, user, uid):
+        """Get a stock or cross of the user (None if not found)."""
+
+    @abc.abstractmethod
+    def find_page(self, collection_name, user, filters=None, after=None, limit=PAGE_SIZE):
+        """Get one page of the user's stocks or crosses in tray order, returns (documents, next_cursor)."""
+
+    @abc.abstractmethod
+    def update(self, collection_name, user, uid, fields):
+        """Set fields of a stock or cross (returns False if not found)."""
+
+    @abc.abstractmethod
+    def flip(self, collection_name, user, uid, flip_time, new_status=None, added_comment=None):
+        """Flip a stock or cross (returns the flipped document, or None if not found)."""
+
+    @abc.abstractmethod
+    def delete(self, collection_name, user, uid):
+        """Delete a stock or cross (returns False if not found)."""
+
+    @abc.abstractmethod
+    def stream_ndjson(self, collection_name, user, filter_state=None, after=None, limit=None, fields=None):
+        """
+        Get the NDJSON lines of the user's stocks or crosses for the stock/cross API (see explorer.stream_ndjson),
+        filter_state holds the explorer form fields. Raises ValueError if the filters are invalid or unsupported.
+        """
+
+    @abc.abstractmethod
+    def facet_counts(self, collection_name, user, version=None):
+        """Get {field: sorted list of (value, count)} of the explorer filter fields."""
+
+    @abc.abstractmethod
+    def data_version(self, user):
+        """Get the version of the user's data (changes whenever a stock or cross of the user changes)."""
+
+    # users
+    @abc.abstractmethod
+    def get_user(self, username):
+        """Get a user document (None if not found)."""
+
+    @abc.abstractmethod
+    def add_user(self, user_document):
+        """Add a user document (returns False if the username is taken)."""
+
+    @abc.abstractmethod
+    def set_password(self, username, hashed_password):
+        """Set the hashed password of a user (returns False if not found)."""
+
+    # activity
+    @abc.abstractmethod
+    def add_activities(self, activity_documents):
+        """Append activity documents."""
+
+    @abc.abstractmethod
+    def activity_feed(self, user, after=None, limit=FEED_PAGE_SIZE):
+        """Get one page of the user's activities, most recent first, returns (activities, next_cursor)."""
+
+    # metadata
+    @abc.abstractmethod
+    def get_metadata(self, metadata_type):
+        """Get the values of a metadata type."""
+
+    @abc.abstractmethod
+    def add_metadata(self, metadata_type, value):
+        """Add a metadata value (returns False if it exists)."""
+
+    @abc.abstractmethod
+    def delete_metadata(self, metadata_type, value):
+        """Delete a metadata value (returns False if not found)."""
+
+    @abc.abstractmethod
+    def edit_metadata(self, metadata_type, old_value, new_value):
+        """Rename a metadata value (returns False if not found)."""
+
+
+class MongoRepository(Repository):
+    """
+    Repository backed by MongoDB (mutations go through flymanager.utils.mongo, with their events and indexes).
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def insert(self, collection_name, documents):
+        if documents:
+            self.db[collection_name].insert_many(documents)
+
+    def get(self, collection_name, user, uid):
+        return self.db[collection_name].find_one({"UniqueID": uid, "User": user})
+
+    def find_page(self, collection_name, user, filters=None, after=None, limit=PAGE_SIZE):
+        # translate the document fields back into the explorer form fields
+        filter_state = {form_field: filters[field] for form_field, field in EXPLORERS[collection_name]["filters"].items()
+                        if field in (filters or {})}
+        return query_page(user, collection_name, self.db, filter_state, after, limit)
+
+    def update(self, collection_name, user, uid, fields):
+        edit = mongo.edit_stock if collection_name == "stocks" else mongo.edit_cross
+        return edit(user, uid, self.db, fields)
+
+    def flip(self, collection_name, user, uid, flip_time, new_status=None, added_comment=None):
+        flip = mongo.flip_stock if collection_name == "stocks" else mongo.flip_cross
+        return flip(user, uid, self.db, flip_time.strftime("%Y-%m-%d %H:%M:%S"), new_status, added_comment)
+
+    def delete(self, collection_name, user, uid):
+        delete = mongo.delete_stock if collection_name == "stocks" else mongo.delete_cross
+        return delete(user, uid, self.db)
+
+    def stream_ndjson(self, collection_name, user, filter_state=None, after=None, limit=None, fields=None):
+        # validate the filters (e.g. the allele query) before anything is streamed
+        build_query(user, collection_name, filter_state)
+        return stream_ndjson(user, collection_name, self.db, filter_state, after=after, limit=limit,
+                             projection=api_projection(collection_name, fields))
+
+    def facet_counts(self, collection_name, user, version=None):
+        return get_facet_counts(user, collection_name, self.db, version)
+
+    def data_version(self, user):
+        return get_data_version(user, self.db)
+
+    def get_user(self, username):
+        return get_user(username, self.db)
+
+    def add_user(self, user_document):
+        try:
+            self.db[USERS_COLLECTION].insert_one(dict(user_document))
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def set_password(self, username, hashed_password):
+        result = self.db[USERS_COLLECTION].update_one({"Username": username}, {"$set": {"Password": hashed_password}})
+        return result.matched_count > 0
+
+    def add_activities(self, activity_documents):
+        if activity_documents:
+            self.db[ACTIVITY_COLLECTION].insert_many(activity_documents, ordered=False)
+
+    def activity_feed(self, user, after=None, limit=FEED_PAGE_SIZE):
+        return get_activity_feed(user, self.db, limit=limit, after=after)
+
+    def get_metadata(self, metadata_type):
+        return mongo.get_metadata(metadata_type, self.db)
+
+    def add_metadata(self, metadata_type, value):
+        return mongo.add_metadata(metadata_type, value, self.db)
+
+    def delete_metadata(self, metadata_type, value):
+        return mongo.delete_metadata(metadata_type, value, self.db)
+
+    def edit_metadata(self, metadata_type, old_value, new_value):
+        return mongo.edit_metadata(metadata_type, old_value, new_value, self.db)
+
+
+def _natural_key(value):
+    """
+    Sort key matching the tray collation (numeric ordering: "2" before "10", case-insensitive).
+    """
+    return tuple((0, int(part), "") if part.isdigit() else (1, 0, part) for part in re.split(r"(\d+)", str(value).lower()) if part)
+
+
+def _filter_value(field, value):
+    """
+    Get the value indexed for an explorer filter field (provenances are filtered on their source).
+    """
+    if field == "Provenance":
+        return str(value).split("/")[0]
+    return str(value)
+
+
+class InMemoryRepository(Repository):
+    """
+    Repository kept in process memory, for hermetic benchmarks and load tests.
+    Stocks and crosses are indexed by UniqueID (dict), by user in tray order (sorted list) and by filter value (dict of sets).
+    Only the documents are stored: events, the search index and the caches of the Mongo backend are not maintained
+    (the explorer filters work, the text and allele searches do not).
+    """
+
+    def __init__(self):
+        self._documents = {"stocks": {}, "crosses": {}}
+        self._tray_index = {"stocks": {}, "crosses": {}}
+        self._filter_index = {"stocks": {}, "crosses": {}}
+        self._users = {}
+        self._activity = {}
+        self._metadata = {metadata_type: {} for metadata_type in METADATA_COLLECTIONS}
+        self._versions = {}
+
+    # index maintenance
+    def _sort_key(self, document):
+        return (_natural_key(document.get("TrayID", "")), _natural_key(document.get("TrayPosition", "")), document["UniqueID"])
+
+    def _filter_keys(self, collection_name, document):
+        return [(field, _filter_value(field, document.get(field, "")))
+                for field in EXPLORERS[collection_name]["filters"].values()]
+
+    def _changed(self, user):
+        self._versions[user] = self._versions.get(user, 0) + 1
+
+    def _index(self, collection_name, document):
+        bisect.insort(self._tray_index[collection_name].setdefault(document["User"], []), self._sort_key(document))
+        for key in self._filter_keys(collection_name, document):
+            self._filter_index[collection_name].setdefault(document["User"], {}).setdefault(key, set()).add(document["UniqueID"])
+
+    def _unindex(self, collection_name, document):
+        keys = self._tray_index[collection_name][document["User"]]
+        del keys[bisect.bisect_left(keys, self._sort_key(document))]
+        postings = self._filter_index[collection_name][document["User"]]
+        for key in self._filter_keys(collection_name, document):
+            postings[key].discard(document["UniqueID"])
+
+    @staticmethod
+    def _copy(document):
+        document = dict(document)
+        if isinstance(document.get("FlipLog"), list):
+            document["FlipLog"] = list(document["FlipLog"])
+        return document
+
+    # stocks and crosses
+    def insert(self, collection_name, documents):
+        documents_by_uid = self._documents[collection_name]
+        for document in documents:
+            if document["UniqueID"] in documents_by_uid:
+                raise ValueError(f"Duplicate UniqueID {document['UniqueID']}")
+            document = self._copy(document)
+            documents_by_uid[document["UniqueID"]] = document
+            self._index(collection_name, document)
+            self._changed(document["User"])
+
+    def get(self, collection_name, user, uid):
+        document = self._documents[collection_name].get(uid)
+        return self._copy(document) if document and document["User"] == user else None
+
+    def find_page(self, collection_name, user, filters=None, after=None, limit=PAGE_SIZE):
+        keys = self._tray_index[collection_name].get(user, [])
+        start = 0
+        key = decode_cursor(after) if after else None
+        if key:
+            tray_id, tray_position, uid = key
+            start = bisect.bisect_right(keys, (_natural_key(tray_id), _natural_key(tray_position), uid))
+
+        # intersect the postings of the filters
+        candidates = None
+        postings = self._filter_index[collection_name].get(user, {})
+        for field, value in (filters or {}).items():
+            if value:
+                uids = postings.get((field, _filter_value(field, value)), set())
+                candidates = uids if candidates is None else candidates & uids
+
+        documents = []
+        for _, _, uid in itertools.islice(keys, start, None):
+            if candidates is None or uid in candidates:
+                documents.append(self._copy(self._documents[collection_name][uid]))
+                if len(documents) > limit:
+                    break
+        if len(documents) > limit:
+            documents = documents[:limit]
+            return documents, encode_cursor(documents[-1])
+        return documents, None
+
+    def update(self, collection_name, user, uid, fields):
+        document = self._documents[collection_name].get(uid)
+        if not document or document["User"] != user or not fields:
+            return False
+        self._unindex(collection_name, document)
+        document.update(fields)
+        document["DataModifiedDate"] = datetime.datetime.now().replace(microsecond=0)
+        document["EventCount"] = document.get("EventCount", 0) + 1
+        self._index(collection_name, document)
+        self._changed(user)
+        return True
+
+    def flip(self, collection_name, user, uid, flip_time, new_status=None, added_comment=None):
+        document = self._documents[collection_name].get(uid)
+        if not document or document["User"] != user:
+            return None
+        # the flip fields are not indexed except Status, which is a filter field
+        self._unindex(collection_name, document)
+        document["LastFlipDate"] = flip_time
+        document["FlipLog"] = ([flip_time] + list(document.get("FlipLog") or []))[:FLIPLOG_CAP]
+        document["EventCount"] = document.get("EventCount", 0) + 1
+        if new_status:
+            if document.get("Status") != new_status:
+                document["DataModifiedDate"] = flip_time
+            document["Status"] = new_status
+        if added_comment:
+            comments = document.get("Comments", "")
+            document["Comments"] = f"{added_comment}; {comments}" if comments else added_comment
+        self._index(collection_name, document)
+        self._changed(user)
+        return self._copy(document)
+
+    def delete(self, collection_name, user, uid):
+        document = self._documents[collection_name].get(uid)
+        if not document or document["User"] != user:
+            return False
+        self._unindex(collection_name, document)
+        del self._documents[collection_name][uid]
+        self._changed(user)
+        return True
+
+    def stream_ndjson(self, collection_name, user, filter_state=None, after=None, limit=None, fields=None):
+        filter_state = filter_state or {}
+        if filter_state.get("searchQuery") or filter_state.get("alleleQuery"):
+            raise ValueError("Text and allele searches are not supported by the memory backend")
+        filters = {field: filter_state[form_field] for form_field, field in EXPLORERS[collection_name]["filters"].items()
+                   if filter_state.get(form_field)}
+        included = [field for field, value in api_projection(collection_name, fields).items() if value]
+
+        def read_page(after, limit):
+            documents, after = self.find_page(collection_name, user, filters, after, limit)
+            return [{field: document[field] for field in included if field in document} for document in documents], after
+
+        return stream_pages(read_page, after=after, limit=limit)
+
+    def facet_counts(self, collection_name, user, version=None):
+        postings = self._filter_index[collection_name].get(user, {})
+        return {field: sorted((value, len(uids)) for (posting_field, value), uids in postings.items()
+                              if posting_field == field and uids)
+                for field in EXPLORERS[collection_name]["filters"].values()}
+
+    def data_version(self, user):
+        return str(self._versions.get(user, 0))
+
+    # users
+    def get_user(self, username):
+        user_document = self._users.get(username)
+        return dict(user_document) if user_document else None
+
+    def add_user(self, user_document):
+        if user_document["Username"] in self._users:
+            return False
+        self._users[user_document["Username"]] = dict(user_document)
+        return True
+
+    def set_password(self, username, hashed_password):
+        if username not in self._users:
+            return False
+        self._users[username]["Password"] = hashed_password
+        return True
+
+    # activity (per user, sorted by (timestamp, insertion order))
+    def add_activities(self, activity_documents):
+        for activity_document in activity_documents:
+            activity_document = dict(activity_document, _id=ObjectId())
+            bisect.insort(self._activity.setdefault(activity_document["user"], []),
+                          (activity_document["timestamp"], activity_document["_id"], activity_document))
+
+    def activity_feed(self, user, after=None, limit=FEED_PAGE_SIZE):
+        entries = self._activity.get(user, [])
+        end = len(entries)
+        key = decode_feed_cursor(after) if after else None
+        if key:
+            end = bisect.bisect_left(entries, key)
+        page = [dict(entry[2]) for entry in reversed(entries[max(0, end - limit - 1):end])]
+        if len(page) > limit:
+            page = page[:limit]
+            return page, encode_feed_cursor(page[-1])
+        return page, None
+
+    # metadata (insertion ordered dicts used as ordered sets)
+    def get_metadata(self, metadata_type):
+        return list(self._metadata[metadata_type])
+
+    def add_metadata(self, metadata_type, value):
+        if value in self._metadata[metadata_type]:
+            return False
+        self._metadata[metadata_type][value] = None
+        return True
+
+    def delete_metadata(self, metadata_type, value):
+        if value not in self._metadata[metadata_type]:
+            return False
+        del self._metadata[metadata_type][value]
+        return True
+
+    def edit_metadata(self, metadata_type, old_value, new_value):
+        if old_value not in self._metadata[metadata_type]:
+            return False
+        del self._metadata[metadata_type][old_value]
+        self._metadata[metadata_type][new_value] = None
+        return True
+
+
+def get_repository(backend=None, db=None):
+    """
+    Get a repository for the configured storage backend.
+    Parameters:
+    backend: str
+        "mongo" or "memory" (defaults to the FLYMANAGER_BACKEND environment variable, then "mongo").
+    db: pymongo.database.Database
+        The MongoDB database for the mongo backend (defaults to the database of this process).
+    Returns:
+    repository: Repository
+        The repository.
+    """
+    backend = (backend or os.getenv("FLYMANAGER_BACKEND") or DEFAULT_BACKEND).lower()
+    if backend == "mongo":
+        return MongoRepository(db if db is not None else get_db())
+    if backend == "memory":
+        return InMemoryRepository()
+    raise ValueError(f"Unknown storage backend: {backend}")
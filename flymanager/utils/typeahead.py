@@ -0,0 +1,141 @@
+# Description: This file contains the user-scoped typeahead lookups of the add-cross form (genotype and UniqueID prefixes, UniqueID -> genotype).
+
+import threading
+from flymanager.utils.versions import get_data_version
+from flymanager.utils.genetics import genotype_keys
+
+# maximum number of suggestions returned per lookup
+TYPEAHEAD_LIMIT = 20
+
+# maximum number of cached lookups per user (the cache of a user is cleared when it is full)
+TYPEAHEAD_CACHE_SIZE = 512
+
+# cached (data version, {lookup key: result}) per user
+_typeahead_cache = {}
+_typeahead_lock = threading.Lock()
+
+
+def _prefix_range(prefix):
+    """
+    Build the range condition matching the strings that start with a prefix (answered by a range scan of an index).
+    """
+    if not prefix:
+        return {"$exists": True}
+    return {"$gte": prefix, "$lt": prefix[:-1] + chr(ord(prefix[-1]) + 1)}
+
+
+def _cached(user, key, db, compute):
+    """
+    Get a lookup result from the cache of the user, computing it on a miss.
+    The cache of a user is only used at the user's current data version, so changes made by other processes are picked up.
+    """
+    version = get_data_version(user, db)
+    with _typeahead_lock:
+        cached = _typeahead_cache.get(user)
+        if cached is not None and cached[0] == version and key in cached[1]:
+            return cached[1][key]
+
+    result = compute()
+
+    with _typeahead_lock:
+        cached = _typeahead_cache.get(user)
+        if cached is None or cached[0] != version or len(cached[1]) >= TYPEAHEAD_CACHE_SIZE:
+            cached = (version, {})
+            _typeahead_cache[user] = cached
+        cached[1][key] = result
+    return result
+
+
+def suggest_genotypes(user, prefix, db, limit=TYPEAHEAD_LIMIT):
+    """
+    Get the distinct genotypes of the user's stocks starting with a prefix (served by the (User, Genotype) index).
+    Parameters:
+    user: str
+        The username of the user.
+    prefix: str
+        The beginning of the genotype (case sensitive, all genotypes if empty).
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    limit: int
+        The maximum number of genotypes.
+    Returns:
+    genotypes: list
+        The sorted matching genotypes.
+    """
+    def compute():
+        genotypes = db["stocks"].distinct("Genotype", {"User": user, "Genotype": _prefix_range(prefix)})
+        return sorted(genotype for genotype in genotypes if genotype)[:limit]
+    return _cached(user, ("genotypes", prefix, limit), db, compute)
+
+
+def suggest_uids(user, prefix, db, genotype=None, limit=TYPEAHEAD_LIMIT, after=None):
+    """
+    Get the user's stocks whose UniqueID starts with a prefix, optionally only those of a genotype however it is written
+    (served by the (User, UniqueID) or (User, GenotypeHash) index).
+    Parameters:
+    user: str
+        The username of the user.
+    prefix: str
+        The beginning of the UniqueID (all UniqueIDs if empty).
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    genotype: str
+        Only return the stocks of this genotype.
+    limit: int
+        The maximum number of stocks.
+    after: str
+        Only return the stocks after this UniqueID (the last one of the previous page).
+    Returns:
+    stocks: list
+        The matching stocks as {"UniqueID": ..., "Genotype": ...}, sorted by UniqueID.
+    """
+    def compute():
+        query = {"User": user}
+        if genotype:
+            canonical, genotype_hash = genotype_keys(genotype)
+            if canonical is None:
+                query["Genotype"] = genotype
+            else:
+                query.update(GenotypeHash=genotype_hash, CanonicalGenotype=canonical)
+        if prefix:
+            query["UniqueID"] = _prefix_range(prefix)
+        if after:
+            query["UniqueID"] = dict(query.get("UniqueID", {}), **{"$gt": after})
+        cursor = db["stocks"].find(query, {"_id": 0, "UniqueID": 1, "Genotype": 1}, sort=[("UniqueID", 1)], limit=limit)
+        return list(cursor)
+    return _cached(user, ("uids", prefix, genotype, limit, after), db, compute)
+
+
+def resolve_genotypes(user, uids, db):
+    """
+    Resolve many UniqueIDs of the user's stocks to their genotypes in a single query.
+    Parameters:
+    user: str
+        The username of the user.
+    uids: list
+        The UniqueIDs.
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    Returns:
+    genotypes: dict
+        A dictionary of {UniqueID: genotype} (UniqueIDs that are not stocks of the user are left out).
+    """
+    uids = sorted(set(uid for uid in uids if uid))
+    if not uids:
+        return {}
+
+    def compute():
+        cursor = db["stocks"].find({"User": user, "UniqueID": {"$in": uids}}, {"_id": 0, "UniqueID": 1, "Genotype": 1})
+        return {stock["UniqueID"]: stock.get("Genotype", "") for stock in cursor}
+    return _cached(user, ("resolve", tuple(uids)), db, compute)
+
+
+def invalidate_typeahead(user=None):
+    """
+    Drop the cached lookups of a user (or of all users if user is None).
+    """
+    with _typeahead_lock:
+        if user is None:
+            _typeahead_cache.clear()
+        else:
+            _typeahead_cache.pop(user, None)
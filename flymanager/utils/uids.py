@@ -0,0 +1,148 @@
+# Description: This file contains the UniqueID allocator for stocks and crosses (backed by the uids registry collection).
+
+import datetime
+import threading
+import time
+from hashlib import shake_256
+from pymongo.errors import BulkWriteError
+
+UIDS_COLLECTION = "uids"
+
+# MongoDB duplicate key error code
+DUPLICATE_KEY = 11000
+
+# maximum number of rehashes before giving up on a UniqueID
+MAX_ATTEMPTS = 20
+
+# allocation statistics (shared by all threads of the process)
+_stats_lock = threading.Lock()
+_stats = {
+    "calls": 0,
+    "allocated": 0,
+    "collisions": 0,
+    "round_trips": 0,
+    "total_latency": 0.0,
+}
+
+
+def hash_uid(value):
+    """
+    Hash a string into a 10 character UniqueID.
+    """
+    return shake_256(value.encode()).hexdigest(5)
+
+
+def allocate_uids(seeds, kind, db):
+    """
+    Allocate a block of UniqueIDs by inserting them into the uids registry (the unique _id makes the allocation race free).
+    Each UniqueID starts as the hash of its seed and is rehashed until the insert succeeds,
+    so a block without collisions is allocated in a single round trip.
+    Parameters:
+    seeds: list
+        The strings to derive the UniqueIDs from (e.g. User + Genotype + SeriesID + ReplicateID).
+    kind: str
+        "stock" or "cross"
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    Returns:
+    uids: list
+        The allocated UniqueIDs (in the order of the seeds).
+    """
+    start = time.perf_counter()
+    candidates = [hash_uid(str(seed)) for seed in seeds]
+    uids = [None] * len(seeds)
+    pending = list(range(len(seeds)))
+    collisions = 0
+    round_trips = 0
+    timestamp = datetime.datetime.now()
+
+    for _ in range(MAX_ATTEMPTS):
+        if not pending:
+            break
+        failed = set()
+        try:
+            round_trips += 1
+            db[UIDS_COLLECTION].insert_many(
+                [{"_id": candidates[i], "Kind": kind, "AllocatedAt": timestamp} for i in pending],
+                ordered=False
+            )
+        except BulkWriteError as e:
+            for error in e.details["writeErrors"]:
+                if error["code"] != DUPLICATE_KEY:
+                    raise
+                failed.add(pending[error["index"]])
+
+        # keep the UniqueIDs that were inserted and rehash the ones that collided
+        for i in pending:
+            if i not in failed:
+                uids[i] = candidates[i]
+            else:
+                print("UniqueID already exists, generating a new one")
+                candidates[i] = hash_uid(candidates[i])
+        collisions += len(failed)
+        pending = [i for i in pending if i in failed]
+
+    if pending:
+        raise RuntimeError(f"Could not allocate {len(pending)} UniqueIDs after {MAX_ATTEMPTS} attempts")
+
+    with _stats_lock:
+        _stats["calls"] += 1
+        _stats["allocated"] += len(uids)
+        _stats["collisions"] += collisions
+        _stats["round_trips"] += round_trips
+        _stats["total_latency"] += time.perf_counter() - start
+
+    return uids
+
+
+def allocate_uid(seed, kind, db):
+    """
+    Allocate a single UniqueID (see allocate_uids).
+    """
+    return allocate_uids([seed], kind, db)[0]
+
+
+def release_uids(uids, db):
+    """
+    Remove UniqueIDs from the registry (only for UniqueIDs that were allocated but never used).
+    """
+    if uids:
+        db[UIDS_COLLECTION].delete_many({"_id": {"$in": list(uids)}})
+
+
+def backfill_uid_registry(db):
+    """
+    Register the UniqueIDs of all existing stocks and crosses that are missing from the uids registry.
+    Parameters:
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    Returns:
+    count: int
+        The number of UniqueIDs registered.
+    """
+    registered = set(db[UIDS_COLLECTION].distinct("_id"))
+    timestamp = datetime.datetime.now()
+    documents = []
+    for kind, collection_name in [("stock", "stocks"), ("cross", "crosses")]:
+        for uid in db[collection_name].distinct("UniqueID"):
+            if uid not in registered:
+                registered.add(uid)
+                documents.append({"_id": uid, "Kind": kind, "AllocatedAt": timestamp})
+    if documents:
+        db[UIDS_COLLECTION].insert_many(documents, ordered=False)
+    return len(documents)
+
+
+def get_allocator_stats():
+    """
+    Get the UniqueID allocation statistics of this process.
+    Returns:
+    stats: dict
+        The number of calls, allocated UniqueIDs, collisions and round trips,
+        the collision rate and the mean allocation latency (in milliseconds) per call.
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["collision_rate"] = stats["collisions"] / (stats["allocated"] + stats["collisions"]) if stats["allocated"] else 0.0
+    stats["mean_latency_ms"] = 1000 * stats.pop("total_latency") / stats["calls"] if stats["calls"] else 0.0
+    return stats
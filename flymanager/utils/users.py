@@ -0,0 +1,95 @@
+# Description: This file contains the user directory (indexed lookups by Username and the cached list of users).
+
+import threading
+import time
+from hashlib import shake_256
+
+USERS_COLLECTION = "users"
+
+# maximum age (in seconds) of the cached user list, so users registered through another process show up
+DIRECTORY_TTL = 60.0
+
+# cached list of users (shared by all threads of the process)
+_directory_lock = threading.Lock()
+_directory = {
+    "users": None,
+    "loaded_at": 0.0,
+}
+
+
+def hash_password(user, password):
+    """
+    Hash the password of a user.
+    """
+    return shake_256((user + password).encode()).hexdigest(5)
+
+
+def get_user(user, db):
+    """
+    Get a user document with a single indexed lookup by Username.
+    Parameters:
+    user: str
+        The username of the user.
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    Returns:
+    user_document: dict
+        The user document (Username, Password and Initials), or None if the user does not exist.
+    """
+    return db[USERS_COLLECTION].find_one({"Username": user}, {"_id": 0})
+
+
+def verify_password(user_document, password):
+    """
+    Check a password against a user document (from get_user).
+    """
+    return user_document is not None and \
+        user_document.get("Password") == hash_password(user_document["Username"], password)
+
+
+def get_directory(db):
+    """
+    Get the list of users and their initials (cached in memory, refreshed every DIRECTORY_TTL seconds).
+    Parameters:
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    Returns:
+    users: list
+        A list of {"Username": ..., "Initials": ...} sorted by username (shared, do not modify).
+    """
+    now = time.monotonic()
+    with _directory_lock:
+        if _directory["users"] is not None and now - _directory["loaded_at"] < DIRECTORY_TTL:
+            return _directory["users"]
+
+    # the sort on Username is served by the Username_unique index
+    users = list(db[USERS_COLLECTION].find({}, {"_id": 0, "Username": 1, "Initials": 1}, sort=[("Username", 1)]))
+    with _directory_lock:
+        _directory.update(users=users, loaded_at=now)
+    return users
+
+
+def get_usernames(db):
+    """
+    Get the usernames for the login and password dropdowns (from the cached directory).
+    """
+    return [user["Username"] for user in get_directory(db)]
+
+
+def get_initials(user, db):
+    """
+    Get the initials of a user (from the cached directory, falling back to an indexed lookup).
+    """
+    for user_document in get_directory(db):
+        if user_document["Username"] == user:
+            return user_document.get("Initials")
+    user_document = get_user(user, db)
+    return user_document.get("Initials") if user_document else None
+
+
+def invalidate_directory():
+    """
+    Drop the cached user list of this process (called when a user is added or changed).
+    """
+    with _directory_lock:
+        _directory.update(users=None, loaded_at=0.0)
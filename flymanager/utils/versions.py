@@ -0,0 +1,53 @@
+# Description: This file contains the per-user data versions of the stocks and crosses (used for caching and ETags).
+
+import hashlib
+import json
+import uuid
+from pymongo import ReturnDocument
+
+VERSIONS_COLLECTION = "data_versions"
+
+
+def _version_token(document):
+    """
+    Build the version token of a data version document ("<epoch>.<version>").
+    The epoch is set when the document is created, so versions never repeat after the collection is dropped.
+    """
+    if not document:
+        return "0"
+    return f"{document['Epoch']}.{document['Version']}"
+
+
+def bump_data_version(user, db):
+    """
+    Increment the data version of a user (called whenever the user's stocks or crosses change).
+    Parameters:
+    user: str
+        The username of the user.
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    Returns:
+    version: str
+        The new version token.
+    """
+    document = db[VERSIONS_COLLECTION].find_one_and_update(
+        {"_id": user},
+        {"$inc": {"Version": 1}, "$setOnInsert": {"Epoch": uuid.uuid4().hex[:8]}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return _version_token(document)
+
+
+def get_data_version(user, db):
+    """
+    Get the current data version token of a user ("0" if the user's data has never changed).
+    """
+    return _version_token(db[VERSIONS_COLLECTION].find_one({"_id": user}))
+
+
+def make_etag(*parts):
+    """
+    Build an ETag from the data version and everything else the response depends on (filters, cursor...).
+    """
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
@@ -0,0 +1,83 @@
+# Description: This file contains the date fields migration and the overdue flips worklist of stocks and crosses.
+
+import datetime
+from flymanager.utils.indexes import TRAY_COLLATION
+from flymanager.utils.fliplog import DEFAULT_FLIP_INTERVAL
+from flymanager.utils.explorer import TRAY_SORT
+
+# fields stored as native datetimes
+DATE_FIELDS = ["CreationDate", "LastFlipDate", "DataModifiedDate"]
+
+# fields returned by the worklist
+WORKLIST_PROJECTION = {
+    "_id": 0, "UniqueID": 1, "Name": 1, "Genotype": 1, "MaleGenotype": 1, "FemaleGenotype": 1,
+    "TrayID": 1, "TrayPosition": 1, "Status": 1, "FoodType": 1, "LastFlipDate": 1,
+}
+
+
+def _date_expression(field):
+    """
+    Build the expression converting a legacy date string ("%Y-%m-%d %H:%M:%S", or "%Y-%m-%d %H:%M" with an
+    optional "T" from the flip UI) into a date, leaving unparsable values unchanged.
+    """
+    date_string = {"$trim": {"input": {"$replaceAll": {"input": "$" + field, "find": "T", "replacement": " "}}}}
+    return {"$dateFromString": {
+        "dateString": date_string, "format": "%Y-%m-%d %H:%M:%S",
+        "onError": {"$dateFromString": {"dateString": date_string, "format": "%Y-%m-%d %H:%M", "onError": "$" + field}}
+    }}
+
+
+def migrate_date_fields(db):
+    """
+    Convert the string CreationDate, LastFlipDate and DataModifiedDate of all stocks and crosses into native datetimes (one-off migration).
+    Parameters:
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    Returns:
+    migrated: dict
+        The number of migrated values per collection and field.
+    """
+    migrated = {}
+    for collection_name in ["stocks", "crosses"]:
+        for field in DATE_FIELDS:
+            result = db[collection_name].update_many(
+                {field: {"$type": "string", "$ne": ""}},
+                [{"$set": {field: _date_expression(field)}}]
+            )
+            migrated[f"{collection_name}.{field}"] = result.modified_count
+    return migrated
+
+
+def get_overdue(user, db, collection_name="stocks", days=DEFAULT_FLIP_INTERVAL, tray_id=None, now=None, limit=None):
+    """
+    Get the user's stocks (or crosses) that have not been flipped for a number of days, in tray order.
+    The query is served by the (User, TrayID, TrayPosition, UniqueID, LastFlipDate) index: the tray order comes from
+    the index and the LastFlipDate range is checked on the index keys.
+    Parameters:
+    user: str
+        The username of the user.
+    db: pymongo.database.Database
+        The MongoDB database instance.
+    collection_name: str
+        "stocks" or "crosses"
+    days: float
+        The number of days after which a flip is overdue.
+    tray_id: str
+        Only return the stocks of this tray (all trays if None).
+    now: datetime.datetime
+        The reference time (defaults to the current time).
+    limit: int
+        The maximum number of stocks to return.
+    Returns:
+    overdue: list
+        The overdue documents, with the number of days since their last flip in "DaysSinceFlip".
+    """
+    now = now or datetime.datetime.now()
+    query = {"User": user, "LastFlipDate": {"$lt": now - datetime.timedelta(days=days)}}
+    if tray_id:
+        query["TrayID"] = tray_id
+    overdue = list(db[collection_name].find(query, WORKLIST_PROJECTION, sort=TRAY_SORT, collation=TRAY_COLLATION,
+                                            limit=limit or 0))
+    for document in overdue:
+        document["DaysSinceFlip"] = round((now - document["LastFlipDate"]).total_seconds() / 86400, 1)
+    return overdue
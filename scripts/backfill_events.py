@@ -0,0 +1,23 @@
+# One-off migration that records a "create" event for every stock and cross without a history in the event store
+#
+# usage:
+#   python scripts/backfill_events.py
+
+from flymanager.utils.mongo import create_mongo_client, get_database
+from flymanager.utils.indexes import ensure_indexes
+from flymanager.utils.events import backfill_events
+
+# setup dotenv
+from dotenv import load_dotenv
+load_dotenv()
+
+# setup the mongo db
+client = create_mongo_client()
+db = get_database(client)
+
+# make sure the event store is indexed before it is filled
+ensure_indexes(db)
+
+backfilled = backfill_events(db)
+for collection_name, count in backfilled.items():
+    print(f"{collection_name}: recorded {count} creation events")
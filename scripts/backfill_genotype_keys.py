@@ -0,0 +1,26 @@
+# One-off backfill of the canonical genotype keys (CanonicalGenotype/GenotypeHash and their Male/Female variants)
+# and of the allele arrays (AllelesX ... Alleles4 and their Male/Female variants) on the stocks and crosses
+# created before they were stored
+#
+# usage:
+#   python scripts/backfill_genotype_keys.py
+
+from flymanager.utils.mongo import create_mongo_client, get_database, backfill_genotype_keys
+from flymanager.utils.indexes import ensure_indexes
+from flymanager.utils.genetics import get_genotype_cache_stats
+
+# setup dotenv
+from dotenv import load_dotenv
+load_dotenv()
+
+# setup the mongo db
+client = create_mongo_client()
+db = get_database(client)
+
+# make sure the genotype hash and allele indexes exist
+ensure_indexes(db)
+
+updated = backfill_genotype_keys(db)
+for collection_name, count in updated.items():
+    print(f"{collection_name}: updated {count} documents")
+print("genotype cache:", get_genotype_cache_stats())
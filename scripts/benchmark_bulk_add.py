@@ -0,0 +1,54 @@
+# Benchmark add_stocks_bulk against one add_to_stock call per stock
+#
+# usage:
+#   python scripts/benchmark_bulk_add.py --stocks 1000
+#
+# the benchmark runs against a scratch database (<MONGO_DB_NAME>_benchmark) which is dropped afterwards
+
+import argparse
+import os
+import time
+from flymanager.utils.mongo import create_mongo_client, add_to_stock, add_stocks_bulk
+from flymanager.utils.indexes import ensure_indexes
+
+# setup dotenv
+from dotenv import load_dotenv
+load_dotenv()
+
+parser = argparse.ArgumentParser(description="Benchmark bulk stock registration.")
+parser.add_argument("--stocks", type=int, default=1000, help="number of stocks to register")
+args = parser.parse_args()
+
+# setup a scratch database
+client = create_mongo_client()
+db = client[os.getenv("MONGO_DB_NAME") + "_benchmark"]
+
+
+def make_rows(series):
+    """
+    Create synthetic stock rows for one replicate series.
+    """
+    return [{
+        "SourceID": str(i), "Genotype": f"w[1118]; UAS-GFP{i % 50}/CyO; +; +", "Name": f"Stock {i}",
+        "Type": "Line", "SeriesID": series, "ReplicateID": str(i), "Status": "Healthy",
+        "TrayID": f"T{i // 100}", "TrayPosition": str(i % 100)
+    } for i in range(args.stocks)]
+
+
+client.drop_database(db.name)
+ensure_indexes(db)
+start = time.perf_counter()
+for row in make_rows("single"):
+    add_to_stock("benchmark", row, db)
+single = time.perf_counter() - start
+
+client.drop_database(db.name)
+ensure_indexes(db)
+start = time.perf_counter()
+report = add_stocks_bulk("benchmark", make_rows("bulk"), db)
+bulk = time.perf_counter() - start
+
+print(f"add_to_stock x {args.stocks}: {single:.3f} s")
+print(f"add_stocks_bulk:       {bulk:.3f} s ({single / bulk:.1f}x), {sum(r['success'] for r in report)} added")
+
+client.drop_database(db.name)
@@ -0,0 +1,96 @@
+# Benchmark the single round trip flip_stock against the previous read-modify-write implementation
+#
+# usage:
+#   python scripts/benchmark_flips.py --stocks 1000 --flips 5000
+#
+# the benchmark runs against a scratch database (<MONGO_DB_NAME>_benchmark) which is dropped afterwards
+
+import argparse
+import datetime
+import os
+import random
+import time
+from flymanager.utils.mongo import create_mongo_client, flip_stock
+from flymanager.utils.indexes import ensure_indexes
+
+# setup dotenv
+from dotenv import load_dotenv
+load_dotenv()
+
+
+def legacy_flip_stock(user, uid, db, timestamp, new_status=None, added_comment=None):
+    """
+    The previous flip implementation (find_one followed by update_one).
+    """
+    stocks_collection = db["stocks"]
+    update_fields = {}
+    ts = timestamp.replace('T', ' ')
+    current_stock = stocks_collection.find_one({"UniqueID": uid, "User": user})
+    if current_stock:
+        update_fields['LastFlipDate'] = ts
+        flip_log = current_stock.get('FlipLog', '')
+        update_fields['FlipLog'] = f"{ts}; {flip_log}" if flip_log else ts
+        modification_log_entries = []
+        if new_status and current_stock.get('Status') != new_status:
+            update_fields['Status'] = new_status
+            update_fields['DataModifiedDate'] = ts
+            modification_log_entries.append(f"{ts} : Status changed from {current_stock.get('Status')} to {new_status}")
+        if added_comment:
+            comments = current_stock.get('Comments', '')
+            update_fields['Comments'] = f"{added_comment}; {comments}" if comments else added_comment
+            modification_log_entries.append(f"{ts} : Comments added: {added_comment}")
+        if modification_log_entries:
+            modification_log = current_stock.get('ModificationLog', '')
+            new_modification_log = "; ".join(modification_log_entries)
+            update_fields['ModificationLog'] = f"{new_modification_log}; {modification_log}" if modification_log else new_modification_log
+        stocks_collection.update_one({"UniqueID": uid, "User": user}, {"$set": update_fields})
+        # the flipper needed a second read to show the updated stock
+        stocks_collection.find_one({"UniqueID": uid, "User": user})
+
+
+def run(flip_function, db, uids, n_flips, user):
+    """
+    Flip random stocks and return the number of flips per second.
+    """
+    statuses = ["Healthy", "Showing Issues", "Needs refresh"]
+    start = time.perf_counter()
+    for i in range(n_flips):
+        flip_function(user, random.choice(uids), db, f"2024-01-01T10:{i % 60:02d}",
+                      new_status=random.choice(statuses), added_comment="benchmark" if i % 10 == 0 else None)
+    return n_flips / (time.perf_counter() - start)
+
+
+parser = argparse.ArgumentParser(description="Benchmark flips per second.")
+parser.add_argument("--stocks", type=int, default=1000, help="number of stocks to create")
+parser.add_argument("--flips", type=int, default=5000, help="number of flips per implementation")
+args = parser.parse_args()
+
+# setup a scratch database
+client = create_mongo_client()
+db = client[os.getenv("MONGO_DB_NAME") + "_benchmark"]
+db.drop_collection("stocks")
+ensure_indexes(db)
+
+user = "benchmark"
+uids = [f"{i:010x}" for i in range(args.stocks)]
+
+def seed(flip_log):
+    """
+    Recreate the benchmark stocks with the given initial FlipLog.
+    """
+    db.stocks.delete_many({})
+    db.stocks.insert_many([{
+        "UniqueID": uid, "User": user, "Status": "Healthy", "Comments": "", "FlipLog": flip_log,
+        "LastFlipDate": "2024-01-01 00:00:00", "DataModifiedDate": "2024-01-01 00:00:00", "ModificationLog": ""
+    } for uid in uids])
+
+# the legacy implementation stored the flip log as a string, the current one as a capped datetime array
+seed("2024-01-01 00:00:00")
+legacy = run(legacy_flip_stock, db, uids, args.flips, user)
+seed([datetime.datetime(2024, 1, 1)])
+pipeline = run(flip_stock, db, uids, args.flips, user)
+
+print(f"legacy find_one + update_one: {legacy:8.1f} flips/s")
+print(f"find_one_and_update pipeline: {pipeline:8.1f} flips/s ({pipeline / legacy:.2f}x)")
+
+client.drop_database(db.name)
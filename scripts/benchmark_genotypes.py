@@ -0,0 +1,83 @@
+# Benchmark the genotype QC, canonical keys and component extraction: string at a time vs a whole pandas Series
+#
+# usage:
+#   python scripts/benchmark_genotypes.py --genotypes 100000 --distinct 20000
+
+import argparse
+import random
+import time
+import pandas as pd
+from flymanager.utils import genetics
+
+ALLELES = ["w[1118]", "y[1] w[*]", "+", "CyO", "TM3, Sb[1]", "TM6B, Tb[1]", "UAS-GFP", "nSyb-GAL4", "20XUAS-CsChrimson",
+           "R58E02-GAL4", "Orco-GAL4", "attP40", "attP2", "Gr64f-LexA", "13XLexAop2-GCaMP7f", "ey[1]"]
+
+
+def make_genotype():
+    """
+    Create a random genotype (about 5% of them fail the QC).
+    """
+    chromosomes = []
+    for _ in range(4 if random.random() > 0.05 else 3):
+        if random.random() < 0.5:
+            chromosomes.append(f"{random.choice(ALLELES)}/{random.choice(ALLELES)}")
+        else:
+            chromosomes.append(random.choice(ALLELES))
+    return "; ".join(chromosomes)
+
+
+def timed(function):
+    """
+    Run a function and return its result and duration in seconds.
+    """
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def scalar(genotypes, qc, keys):
+    """
+    QC, canonical keys and components one string at a time.
+    """
+    results = []
+    for genotype in genotypes:
+        valid, cleaned = qc(genotype)
+        components = genetics.get_genetic_components(cleaned) if valid else None
+        results.append((valid, cleaned, components, keys(genotype)))
+    return results
+
+
+def vectorized(genotypes):
+    """
+    QC, canonical keys and components of the whole Series at once.
+    """
+    qc = genetics.qc_genotypes(genotypes)
+    components = genetics.genetic_components(qc["Genotype"].where(qc["Valid"], ""))
+    keys = genetics.canonical_genotypes(genotypes, qc)
+    return qc, components, keys
+
+
+parser = argparse.ArgumentParser(description="Benchmark the genotype QC.")
+parser.add_argument("--genotypes", type=int, default=100000, help="number of genotypes")
+parser.add_argument("--distinct", type=int, default=20000, help="number of distinct genotypes")
+args = parser.parse_args()
+
+pool = [make_genotype() for _ in range(args.distinct)]
+genotypes = pd.Series([random.choice(pool) for _ in range(args.genotypes)])
+print(f"{args.genotypes} genotypes ({genotypes.nunique()} distinct)")
+
+# without the caches (every string is processed again)
+_, uncached = timed(lambda: scalar(genotypes, lambda g: genetics._qc_genotype.__wrapped__(g),
+                                   genetics.genotype_keys.__wrapped__))
+print(f"  string at a time (uncached) {uncached:8.3f} s")
+
+# with the lru caches (cleared first, so every distinct genotype is processed once)
+genetics._qc_genotype.cache_clear()
+genetics.genotype_keys.cache_clear()
+_, cached = timed(lambda: scalar(genotypes, genetics.qc_genotype, genetics.genotype_keys))
+print(f"  string at a time (cached)   {cached:8.3f} s")
+
+(qc, _, _), series = timed(lambda: vectorized(genotypes))
+print(f"  whole Series                {series:8.3f} s  ({uncached / series:.1f}x faster than uncached, "
+      f"{cached / series:.1f}x than cached)")
+print(f"  {int((~qc['Valid']).sum())} genotypes failed the QC")
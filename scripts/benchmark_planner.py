@@ -0,0 +1,102 @@
+# Benchmark the cross planner (bitset allele index) against evaluating every pair of stocks
+#
+# usage:
+#   python scripts/benchmark_planner.py --sizes 5000 20000 --targets 20
+#
+# the benchmark runs against a scratch database (<MONGO_DB_NAME>_benchmark) which is dropped afterwards;
+# the pair scan is timed on a sample of mothers and extrapolated to all the pairs
+
+import argparse
+import datetime
+import os
+import random
+import time
+from flymanager.utils.mongo import create_mongo_client, _stock_document
+from flymanager.utils.indexes import ensure_indexes
+from flymanager.utils.planner import get_stock_index, parse_target, find_parent_pairs, find_schemes, \
+    _pair_probability
+
+# setup dotenv
+from dotenv import load_dotenv
+load_dotenv()
+
+X = ["w", "w[1118]", "y w", "FM7/w", "+"]
+SECOND = ["+", "CyO", "Sp/CyO", "Gal4-{}", "UAS-{}", "nSyb-Gal4", "tub-Gal80ts"]
+THIRD = ["+", "TM3", "TM6B", "MKRS", "Gal4-{}", "UAS-{}", "elav-Gal4"]
+
+
+def allele(alleles):
+    """
+    Pick a random allele (numbered transgenes get one of 300 insertions).
+    """
+    return random.choice(alleles).format(random.randint(1, 300))
+
+
+def chromosome(alleles):
+    """
+    Create a random homozygous or heterozygous chromosome.
+    """
+    return allele(alleles) if random.random() < 0.5 else allele(alleles) + "/" + allele(alleles)
+
+
+def make_stock(i, user, now):
+    """
+    Create a random stock.
+    """
+    genotype = "; ".join([random.choice(X), chromosome(SECOND), chromosome(THIRD), "+"])
+    properties = {"SourceID": f"BDSC{random.randint(1, 99999)}", "Name": f"line {i}", "Type": "Stock",
+                  "SeriesID": str(i // 4), "ReplicateID": "1", "Status": "Healthy"}
+    return _stock_document(user, f"{i:010x}", properties, genotype, now)
+
+
+def scan_pairs(index, target, mothers):
+    """
+    Evaluate every (mother, father) pair of a sample of mothers, return the time per mother in seconds.
+    """
+    start = time.perf_counter()
+    for mother in mothers:
+        for father in index.stocks:
+            _pair_probability(mother["Alleles"], father["Alleles"], target)
+    return (time.perf_counter() - start) / len(mothers)
+
+
+parser = argparse.ArgumentParser(description="Benchmark the cross planner latency.")
+parser.add_argument("--sizes", type=int, nargs="+", default=[5000, 20000], help="numbers of stocks to search")
+parser.add_argument("--targets", type=int, default=20, help="number of target genotypes")
+parser.add_argument("--sample", type=int, default=20, help="number of mothers of the pair scan")
+args = parser.parse_args()
+
+# setup a scratch database
+client = create_mongo_client()
+db = client[os.getenv("MONGO_DB_NAME") + "_benchmark"]
+ensure_indexes(db)
+
+user = "benchmark"
+now = datetime.datetime.now()
+targets = [parse_target("; ".join(["w", allele(["Gal4-{}", "UAS-{}"]) + "/CyO",
+                                   allele(["Gal4-{}", "UAS-{}"]) + "/" + allele(["TM3", "TM6B"]), "+"]))
+           for _ in range(args.targets)]
+
+for size in args.sizes:
+    db.stocks.delete_many({})
+    db.stocks.insert_many([make_stock(i, user, now) for i in range(size)])
+    start = time.perf_counter()
+    index = get_stock_index(user, db)
+    build = time.perf_counter() - start
+
+    pairs = schemes = 0.0
+    for target in targets:
+        start = time.perf_counter()
+        find_parent_pairs(index, target, user=user)
+        pairs += time.perf_counter() - start
+        start = time.perf_counter()
+        find_schemes(index, target, user=user)
+        schemes += time.perf_counter() - start
+    scan = scan_pairs(index, targets[0], random.sample(index.stocks, min(args.sample, size))) * size
+
+    print(f"{size} stocks (index built in {build:.2f} s)")
+    print(f"  every pair evaluated (extrapolated): {1000 * scan:10.1f} ms/target")
+    print(f"  bitset parent pairs:                 {1000 * pairs / len(targets):10.1f} ms/target")
+    print(f"  bitset two-generation schemes:       {1000 * schemes / len(targets):10.1f} ms/target")
+
+client.drop_database(db.name)
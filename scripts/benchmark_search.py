@@ -0,0 +1,87 @@
+# Benchmark the trigram search index against the previous full scan with fuzz.partial_ratio on every stock
+#
+# usage:
+#   python scripts/benchmark_search.py --sizes 10000 100000 --queries 50
+#
+# the benchmark runs against a scratch database (<MONGO_DB_NAME>_benchmark) which is dropped afterwards
+
+import argparse
+import os
+import random
+import time
+from fuzzywuzzy import fuzz
+from flymanager.utils.mongo import create_mongo_client
+from flymanager.utils.indexes import ensure_indexes
+from flymanager.utils.search import SEARCH_THRESHOLD, rebuild_search_index, search, search_text
+
+# setup dotenv
+from dotenv import load_dotenv
+load_dotenv()
+
+GENES = ["w[1118]", "UAS-GFP", "Gal4", "Orco", "Or42b", "TM6B", "CyO", "Sb", "Tb", "elav", "nSyb", "GMR", "Dcr-2", "tub-Gal80ts"]
+WORDS = ["healthy", "mites", "refresh", "expanding", "sterile", "weak", "check", "balancer", "backup"]
+
+
+def legacy_search(user, collection_name, query, db, k=100):
+    """
+    The previous search (every stock of the user is scored with the fuzzy scorer).
+    """
+    query = query.lower()
+    results = []
+    for document in db[collection_name].find({"User": user}):
+        if fuzz.partial_ratio(search_text(document, collection_name).lower(), query) > SEARCH_THRESHOLD:
+            results.append(document)
+            if len(results) >= k:
+                break
+    return results
+
+
+def make_stock(i, user):
+    """
+    Create a random stock.
+    """
+    genotype = "w[1118]; " + "/".join(random.sample(GENES, 2)) + "; " + "/".join(random.sample(GENES, 2))
+    return {
+        "UniqueID": f"{i:010x}", "User": user, "SourceID": f"BDSC{random.randint(1, 99999)}", "Genotype": genotype,
+        "Name": f"{random.choice(GENES)} line {i}", "AltReference": "", "SeriesID": str(i // 4), "TrayID": str(i // 50),
+        "TrayPosition": str(i % 50), "Comments": " ".join(random.sample(WORDS, 2)),
+    }
+
+
+def run(search_function, db, queries, user):
+    """
+    Run the queries and return the mean latency in milliseconds.
+    """
+    start = time.perf_counter()
+    for query in queries:
+        search_function(user, "stocks", query, db, k=100)
+    return 1000 * (time.perf_counter() - start) / len(queries)
+
+
+parser = argparse.ArgumentParser(description="Benchmark the stock search latency.")
+parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000], help="numbers of stocks to search")
+parser.add_argument("--queries", type=int, default=50, help="number of queries per implementation")
+args = parser.parse_args()
+
+# setup a scratch database
+client = create_mongo_client()
+db = client[os.getenv("MONGO_DB_NAME") + "_benchmark"]
+ensure_indexes(db)
+
+user = "benchmark"
+queries = [random.choice(GENES + WORDS) for _ in range(args.queries)]
+
+for size in args.sizes:
+    db.stocks.delete_many({})
+    db.stocks.insert_many([make_stock(i, user) for i in range(size)])
+    start = time.perf_counter()
+    rebuild_search_index(db)
+    build = time.perf_counter() - start
+
+    legacy = run(legacy_search, db, queries, user)
+    indexed = run(search, db, queries, user)
+    print(f"{size} stocks (index built in {build:.1f} s)")
+    print(f"  full scan with fuzz.partial_ratio: {legacy:8.1f} ms/query")
+    print(f"  trigram index + fuzzy ranking:     {indexed:8.1f} ms/query ({legacy / indexed:.1f}x)")
+
+client.drop_database(db.name)
@@ -0,0 +1,93 @@
+# Benchmark a storage backend with a flip session workload (explorer pages, flips, edits and activity)
+#
+# usage:
+#   python scripts/benchmark_storage.py --backend memory --stocks 10000 --operations 5000
+#   FLYMANAGER_BACKEND=mongo python scripts/benchmark_storage.py
+#
+# the mongo backend runs against a scratch database (<MONGO_DB_NAME>_benchmark) which is dropped afterwards;
+# the memory backend only lives in this process (the app always uses MongoDB)
+
+import argparse
+import datetime
+import os
+import random
+import time
+from flymanager.utils.storage import get_repository
+from flymanager.utils.indexes import ensure_indexes
+
+# setup dotenv
+from dotenv import load_dotenv
+load_dotenv()
+
+STATUSES = ["Healthy", "Showing Issues", "Needs refresh"]
+
+
+def make_stock(i, user, now):
+    """
+    Create a stock document.
+    """
+    return {
+        "UniqueID": f"{i:010x}", "User": user, "SourceID": f"BDSC{i}", "Genotype": "w[1118]; +; +; +", "Name": f"line {i}",
+        "AltReference": "", "Type": random.choice(["Balancer", "Driver", "Effector"]), "SeriesID": str(i // 4),
+        "ReplicateID": str(i % 4), "TrayID": str(i // 50), "TrayPosition": str(i % 50), "Status": random.choice(STATUSES),
+        "FoodType": "Standard", "Provenance": "BDSC", "Comments": "", "CreationDate": now, "LastFlipDate": now,
+        "FlipLog": [now], "DataModifiedDate": now, "EventCount": 1,
+    }
+
+
+def timed(operation, n):
+    """
+    Run an operation n times and return the number of operations per second.
+    """
+    start = time.perf_counter()
+    for i in range(n):
+        operation(i)
+    return n / (time.perf_counter() - start)
+
+
+parser = argparse.ArgumentParser(description="Benchmark a storage backend.")
+parser.add_argument("--backend", default=None, help="mongo or memory (defaults to FLYMANAGER_BACKEND)")
+parser.add_argument("--stocks", type=int, default=10000, help="number of stocks to create")
+parser.add_argument("--operations", type=int, default=5000, help="number of operations per workload")
+args = parser.parse_args()
+
+backend = args.backend or os.getenv("FLYMANAGER_BACKEND") or "mongo"
+db = None
+if backend == "mongo":
+    # setup a scratch database
+    from flymanager.utils.mongo import create_mongo_client
+    client = create_mongo_client()
+    db = client[os.getenv("MONGO_DB_NAME") + "_benchmark"]
+    for collection_name in ["stocks", "activity", "events", "snapshots", "search_index"]:
+        db.drop_collection(collection_name)
+    ensure_indexes(db)
+repository = get_repository(backend, db)
+
+user = "benchmark"
+now = datetime.datetime.now().replace(microsecond=0)
+uids = [f"{i:010x}" for i in range(args.stocks)]
+
+start = time.perf_counter()
+repository.insert("stocks", [make_stock(i, user, now) for i in range(args.stocks)])
+print(f"{backend}: inserted {args.stocks} stocks in {time.perf_counter() - start:.2f} s")
+
+results = {
+    "explorer page (100 stocks)": timed(lambda i: repository.find_page("stocks", user), args.operations // 10),
+    "filtered explorer page": timed(
+        lambda i: repository.find_page("stocks", user, filters={"Status": random.choice(STATUSES)}), args.operations // 10),
+    "explorer stream (all stocks)": timed(lambda i: sum(1 for _ in repository.stream_ndjson("stocks", user)), 5),
+    "explorer facets": timed(lambda i: repository.facet_counts("stocks", user), args.operations // 10),
+    "get stock": timed(lambda i: repository.get("stocks", user, random.choice(uids)), args.operations),
+    "flip": timed(lambda i: repository.flip("stocks", user, random.choice(uids), now + datetime.timedelta(seconds=i),
+                                            new_status=random.choice(STATUSES)), args.operations),
+    "edit": timed(lambda i: repository.update("stocks", user, random.choice(uids), {"Comments": f"edit {i}"}),
+                  args.operations),
+    "activity": timed(lambda i: repository.add_activities(
+        [{"user": user, "timestamp": now + datetime.timedelta(seconds=i), "activity": f"activity {i}"}]), args.operations),
+    "activity feed": timed(lambda i: repository.activity_feed(user), args.operations // 10),
+}
+for name, rate in results.items():
+    print(f"  {name:28s} {rate:10.1f} ops/s")
+
+if db is not None:
+    client.drop_database(db.name)
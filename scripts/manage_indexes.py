@@ -0,0 +1,47 @@
+# Report (and optionally create) the MongoDB indexes used by flymanager
+#
+# usage:
+#   python scripts/manage_indexes.py           # report missing, undeclared, redundant and unused indexes
+#   python scripts/manage_indexes.py --apply   # create the missing indexes, then report
+#
+# unique indexes that cannot be built are reported with their duplicate values, which have to be fixed by hand
+# (e.g. duplicate UniqueIDs from an old spreadsheet import) before running --apply again
+
+import argparse
+from flymanager.utils.mongo import create_mongo_client, get_database
+from flymanager.utils.indexes import ensure_indexes, index_report
+
+# setup dotenv
+from dotenv import load_dotenv
+load_dotenv()
+
+parser = argparse.ArgumentParser(description="Report and provision the flymanager MongoDB indexes.")
+parser.add_argument("--apply", action="store_true", help="create the declared indexes before reporting")
+args = parser.parse_args()
+
+# setup the mongo db
+client = create_mongo_client()
+db = get_database(client)
+
+if args.apply:
+    created = ensure_indexes(db)
+    for collection_name, names in created.items():
+        print(f"{collection_name}: ensured {', '.join(names)}")
+    print()
+
+report = index_report(db)
+problems = 0
+for collection_name, result in report.items():
+    lines = []
+    for category in ["missing", "undeclared", "redundant", "unused", "duplicates"]:
+        if result[category] is None:
+            lines.append(f"  {category}: unavailable (requires the indexStats privilege)")
+        elif result[category]:
+            problems += len(result[category])
+            lines.append(f"  {category}: {', '.join(result[category])}")
+    if lines:
+        print(collection_name)
+        print("\n".join(lines))
+
+if problems == 0:
+    print("All indexes are in order.")
@@ -0,0 +1,22 @@
+# One-off migration of the legacy string activity timestamps into native datetimes
+#
+# usage:
+#   python scripts/migrate_activity_timestamps.py
+
+from flymanager.utils.mongo import create_mongo_client, get_database
+from flymanager.utils.indexes import ensure_indexes
+from flymanager.utils.activity import migrate_activity_timestamps
+
+# setup dotenv
+from dotenv import load_dotenv
+load_dotenv()
+
+# setup the mongo db
+client = create_mongo_client()
+db = get_database(client)
+
+# make sure the activity feed index exists
+ensure_indexes(db)
+
+migrated = migrate_activity_timestamps(db)
+print(f"activity: migrated {migrated} timestamps")
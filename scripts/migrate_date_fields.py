@@ -0,0 +1,23 @@
+# One-off migration of the string CreationDate, LastFlipDate and DataModifiedDate fields into native datetimes
+#
+# usage:
+#   python scripts/migrate_date_fields.py
+
+from flymanager.utils.mongo import create_mongo_client, get_database
+from flymanager.utils.indexes import ensure_indexes
+from flymanager.utils.worklist import migrate_date_fields
+
+# setup dotenv
+from dotenv import load_dotenv
+load_dotenv()
+
+# setup the mongo db
+client = create_mongo_client()
+db = get_database(client)
+
+migrated = migrate_date_fields(db)
+for field, count in migrated.items():
+    print(f"{field}: migrated {count} values")
+
+# make sure the overdue worklist index exists
+ensure_indexes(db)
@@ -0,0 +1,23 @@
+# One-off migration of the legacy semicolon-joined FlipLog strings into capped datetime arrays
+#
+# usage:
+#   python scripts/migrate_flip_logs.py
+
+from flymanager.utils.mongo import create_mongo_client, get_database
+from flymanager.utils.indexes import ensure_indexes
+from flymanager.utils.fliplog import migrate_flip_logs
+
+# setup dotenv
+from dotenv import load_dotenv
+load_dotenv()
+
+# setup the mongo db
+client = create_mongo_client()
+db = get_database(client)
+
+# make sure the overflow collection is indexed before it is filled
+ensure_indexes(db)
+
+migrated = migrate_flip_logs(db)
+for collection_name, count in migrated.items():
+    print(f"{collection_name}: migrated {count} flip logs")
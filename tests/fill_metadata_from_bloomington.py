@@ -1,6 +1,7 @@
 from flymanager.utils.mongo import create_mongo_client, get_database, reset_database
 from flymanager.utils.converter import xls_to_mongo
 from flymanager.utils.genetics import qc_genotype, get_genetic_components
+from flymanager.utils.metadata import bump_metadata_version
 
 # setup dotenv
 from dotenv import load_dotenv
@@ -112,4 +113,7 @@ db.genes4th.drop()
 db.genesX.insert_many([{"Value": x} for x in all_components[0]])
 db.genes2nd.insert_many([{"Value": x} for x in all_components[1]])
 db.genes3rd.insert_many([{"Value": x} for x in all_components[2]])
-db.genes4th.insert_many([{"Value": x} for x in all_components[3]])
\ No newline at end of file
+db.genes4th.insert_many([{"Value": x} for x in all_components[3]])
+
+# invalidate the metadata cached by the running servers
+bump_metadata_version(db)
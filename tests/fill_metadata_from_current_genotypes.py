@@ -1,6 +1,8 @@
 from flymanager.utils.mongo import create_mongo_client, get_database, reset_database
 from flymanager.utils.converter import xls_to_mongo
-from flymanager.utils.genetics import qc_genotype, get_genetic_components
+from flymanager.utils.genetics import CHROMOSOME_NAMES, qc_genotypes, genetic_components, genotype_errors
+from flymanager.utils.metadata import bump_metadata_version
+import pandas as pd
 
 # setup dotenv
 from dotenv import load_dotenv
@@ -11,38 +13,27 @@ client = create_mongo_client()
 db = get_database(client)
 
 # get the genotypes collection
-stocks = list(db.stocks.find())
+stocks = pd.DataFrame(list(db.stocks.find({}, {"_id": 0, "Genotype": 1, "Type": 1, "FoodType": 1, "Provenance": 1})),
+                      columns=["Genotype", "Type", "FoodType", "Provenance"])
 print("Number of stocks: ", len(stocks))
-# verify the genotypes collection
-genotypes_qc = []
-types = []
-food_types = []
+types = stocks["Type"].tolist()
+food_types = stocks["FoodType"].tolist()
 provenances = []
-all_components = {
-    0: [],
-    1: [],
-    2: [],
-    3: []
-}
-for stock in stocks:
-    genotype = stock["Genotype"]
-    types.append(stock["Type"])
-    food_types.append(stock["FoodType"])
-    provenances.extend(stock["Provenance"].split("/") if len(stock["Provenance"].split("/")) > 1 else [stock["Provenance"]])
-    success, genotype_qc = qc_genotype(genotype)
-    if success:
-        genotypes_qc.append(genotype_qc)
-        # get the genetic components
-        components = get_genetic_components(genotype_qc)
-        # add the components to the dictionary
-        for n, chr in enumerate(components):
-            all_components[n].extend(chr)
-    else:
-        print("Genotype failed QC: ", genotype)
+for provenance in stocks["Provenance"]:
+    provenances.extend(provenance.split("/") if len(provenance.split("/")) > 1 else [provenance])
+
+# verify all the genotypes at once
+qc = qc_genotypes(stocks["Genotype"])
+for error in genotype_errors(stocks["Genotype"], qc):
+    print("Genotype failed QC: ", error["genotype"])
+
+# get the genetic components of the valid genotypes
+components = genetic_components(qc["Genotype"][qc["Valid"]])
 
 # get the unique components
-for n, chr in all_components.items():
-    all_components[n] = list(set(chr))
+all_components = {}
+for n, name in enumerate(CHROMOSOME_NAMES):
+    all_components[n] = list(set(components[f"{name}_1"]) | set(components[f"{name}_2"]))
 
 print("All components: ", all_components)
 
@@ -68,3 +59,5 @@ db.provenances.drop()
 provenances = list(set(provenances))
 db.provenances.insert_many([{"Value": x} for x in provenances])
 
+# invalidate the metadata cached by the running servers
+bump_metadata_version(db)